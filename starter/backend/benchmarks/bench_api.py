@@ -0,0 +1,385 @@
+"""Benchmark the trivia API.
+
+Seeds a database with question banks of the given sizes, then times every
+route through the Flask test client and through a real WSGI server, and
+writes throughput and p50/p99 latency per route to a JSON file. Run from
+starter/backend, for example:
+
+    python benchmarks/bench_api.py --sizes 1000,100000 --output before.json
+    (make a change)
+    python benchmarks/bench_api.py --sizes 1000,100000 --output after.json
+    python benchmarks/compare.py before.json after.json
+
+By default a temporary SQLite database is used. To benchmark against
+Postgres, create an empty database and pass its URL with --database. The
+benchmark drops and recreates the questions and categories tables, so the
+database name must contain "bench" (or pass --force).
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from werkzeug.serving import make_server  # noqa: E402
+
+from flaskr import create_app  # noqa: E402
+from models import db, Question, Category  # noqa: E402
+
+CATEGORIES = ['Science', 'Art', 'Geography', 'History', 'Entertainment',
+              'Sports']
+
+WORDS = ('apollo canal desert engine falcon glacier harbor island jungle '
+         'kettle lantern meadow nebula orchid pepper quartz river saturn '
+         'temple umbrella violin walrus xylophone yacht zebra painting '
+         'monarch castle empire comet volcano').split()
+
+SEED_BATCH_SIZE = 10000
+
+
+# ----------------------------------------------------------------------------
+#  seed: replace the questions and categories with size generated questions
+#  spread evenly over the categories. Returns the question ids
+# ----------------------------------------------------------------------------
+def seed(app, size, rng):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        db.session.execute(Category.__table__.insert(),
+                           [{'id': i, 'type': t}
+                            for i, t in enumerate(CATEGORIES, 1)])
+
+        for start in range(0, size, SEED_BATCH_SIZE):
+            rows = []
+            for i in range(start, min(start + SEED_BATCH_SIZE, size)):
+                words = rng.sample(WORDS, 6)
+                rows.append({'id': i + 1,
+                             'question': 'Which {} {} the {} {}?'.format(
+                                 *words[:4]),
+                             'answer': ' '.join(words[4:]),
+                             'difficulty': i % 5 + 1,
+                             'category': i % len(CATEGORIES) + 1})
+            db.session.execute(Question.__table__.insert(), rows)
+        db.session.commit()
+
+    return list(range(1, size + 1))
+
+
+# ----------------------------------------------------------------------------
+#  Routes: each route is (name, method, make_request), where make_request()
+#  returns the path and json body of the next request to time. Routes named
+#  in HEAVY_ROUTES read the whole bank and are timed fewer times
+# ----------------------------------------------------------------------------
+HEAVY_ROUTES = ('questions_all', 'export')
+
+
+def build_routes(size, rng, session_next):
+    last_page = max(1, (size + 9) // 10)
+
+    def quiz_request():
+        previous = rng.sample(range(1, size + 1), min(10, size))
+        return '/quizzes', {'previous_questions': previous,
+                            'quiz_category': {'type': 'Science', 'id': 1}}
+
+    def quiz_batch_request():
+        path, body = quiz_request()
+        body['count'] = 5
+        return path, body
+
+    def add_request():
+        return '/questions/add', {'question': 'Benchmark question?',
+                                  'answer': 'Benchmark answer',
+                                  'difficulty': rng.randint(1, 5),
+                                  'category': rng.randint(1, 6)}
+
+    return [
+        ('categories', 'GET', lambda: ('/categories', None)),
+        ('questions_page', 'GET', lambda: ('/questions?page=1', None)),
+        ('questions_page_categories', 'GET',
+         lambda: ('/questions?page=2&include=category', None)),
+        ('questions_deep_page', 'GET',
+         lambda: ('/questions?page={}'.format(last_page), None)),
+        ('questions_cursor', 'GET', lambda: ('/questions?cursor=', None)),
+        ('category_page', 'GET',
+         lambda: ('/categories/1/questions?page=1', None)),
+        ('search', 'POST',
+         lambda: ('/questions/search',
+                  {'searchTerm': rng.choice(WORDS), 'page': 1})),
+        ('search_answers', 'POST',
+         lambda: ('/questions/search',
+                  {'searchTerm': rng.choice(WORDS), 'page': 1,
+                   'includeAnswers': True})),
+        ('quiz', 'POST', quiz_request),
+        ('quiz_batch', 'POST', quiz_batch_request),
+        ('quiz_session_next', 'GET', session_next),
+        ('add_question', 'POST', add_request),
+        ('questions_all', 'GET', lambda: ('/questions?all=true', None)),
+        ('export', 'GET', lambda: ('/questions/export', None)),
+    ]
+
+
+# ----------------------------------------------------------------------------
+#  Clients: send(method, path, body) performs one request and returns its
+#  status code, reading the whole response body
+# ----------------------------------------------------------------------------
+class TestClientSender:
+
+    name = 'test_client'
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def send(self, method, path, body):
+        if method == 'GET':
+            res = self.client.get(path)
+        else:
+            res = self.client.post(path, json=body)
+        res.get_data()
+        return res.status_code
+
+
+class WSGIServerSender:
+
+    name = 'wsgi'
+
+    def __init__(self, app):
+        # the server's access log would swamp the results
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.local = threading.local()
+
+    def connection(self):
+        if not hasattr(self.local, 'conn'):
+            self.local.conn = http.client.HTTPConnection(
+                '127.0.0.1', self.server.server_port)
+        return self.local.conn
+
+    def send(self, method, path, body):
+        conn = self.connection()
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            conn.request(method, path, body=payload, headers=headers)
+            res = conn.getresponse()
+            res.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            del self.local.conn
+            raise
+        return res.status
+
+    def close(self):
+        self.server.shutdown()
+
+
+# ----------------------------------------------------------------------------
+#  percentile: nearest-rank percentile of a sorted list
+# ----------------------------------------------------------------------------
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+# ----------------------------------------------------------------------------
+#  time_route: send requests requests for the route (after warmup untimed
+#  ones) from concurrency threads, and summarize their latencies
+# ----------------------------------------------------------------------------
+def time_route(sender, route, requests, warmup, concurrency):
+    name, method, make_request = route
+
+    for _ in range(warmup):
+        path, body = make_request()
+        sender.send(method, path, body)
+
+    def timed_request(_):
+        path, body = make_request()
+        start = time.perf_counter()
+        try:
+            status = sender.send(method, path, body)
+        except (http.client.HTTPException, OSError):
+            status = None
+        return time.perf_counter() - start, status
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as pool:
+            samples = list(pool.map(timed_request, range(requests)))
+    else:
+        samples = [timed_request(i) for i in range(requests)]
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _ in samples)
+    errors = sum(1 for _, status in samples
+                 if status is None or status >= 500)
+    statuses = sorted({status for _, status in samples if status})
+
+    return {'route': name,
+            'method': method,
+            'requests': requests,
+            'concurrency': concurrency,
+            'errors': errors,
+            'statuses': statuses,
+            'throughput_rps': requests / elapsed if elapsed else None,
+            'mean_ms': 1000 * sum(latencies) / len(latencies),
+            'p50_ms': 1000 * percentile(latencies, 50),
+            'p99_ms': 1000 * percentile(latencies, 99)}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=HERE,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_config(pairs):
+    config = {}
+    for pair in pairs:
+        key, _, value = pair.partition('=')
+        try:
+            config[key] = json.loads(value)
+        except ValueError:
+            config[key] = value
+    return config
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the trivia API routes.')
+    parser.add_argument('--database',
+                        help='database URL (default: a temporary SQLite '
+                             'file); its tables are dropped and recreated')
+    parser.add_argument('--force', action='store_true',
+                        help='allow a --database whose name does not '
+                             'contain "bench"')
+    parser.add_argument('--sizes', default='1000,100000',
+                        help='comma separated question bank sizes '
+                             '(default 1000,100000)')
+    parser.add_argument('--servers', default='test_client,wsgi',
+                        help='test_client, wsgi or both (default both)')
+    parser.add_argument('--routes',
+                        help='comma separated route names (default all)')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='timed requests per route (default 200)')
+    parser.add_argument('--heavy-requests', type=int, default=3,
+                        help='timed requests for routes that read the '
+                             'whole bank (default 3)')
+    parser.add_argument('--warmup', type=int, default=10,
+                        help='untimed requests per route (default 10)')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='concurrent clients for the wsgi server '
+                             '(default 1)')
+    parser.add_argument('--config', action='append', default=[],
+                        metavar='KEY=VALUE',
+                        help='app config setting passed to create_app, '
+                             'for example HTTP_CACHE_SIZE=0')
+    parser.add_argument('--seed', type=int, default=1234,
+                        help='random seed (default 1234)')
+    parser.add_argument('--output', default='bench_results.json',
+                        help='where to write the results '
+                             '(default bench_results.json)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+
+    tmpdir = None
+    database = args.database
+    if database is None:
+        tmpdir = tempfile.mkdtemp(prefix='trivia-bench-')
+        database = 'sqlite:///' + os.path.join(tmpdir, 'bench.db')
+    elif 'bench' not in database.rsplit('/', 1)[-1] and not args.force:
+        sys.exit('refusing to drop the tables of {}: use a database whose '
+                 'name contains "bench", or --force'.format(database))
+
+    config = {'DATABASE_URL': database}
+    config.update(parse_config(args.config))
+    app = create_app(config)
+
+    route_names = args.routes.split(',') if args.routes else None
+    results = []
+
+    for size in [int(s) for s in args.sizes.split(',')]:
+        start = time.perf_counter()
+        seed(app, size, rng)
+        print('seeded {} questions in {:.1f}s'.format(
+            size, time.perf_counter() - start))
+
+        for server in args.servers.split(','):
+            if server == 'wsgi':
+                sender = WSGIServerSender(app)
+                concurrency = args.concurrency
+            else:
+                sender = TestClientSender(app)
+                concurrency = 1
+
+            session = {'id': None}
+
+            def session_next():
+                # start a new quiz session whenever the last one runs out
+                if session['id'] is None or rng.random() < 0.1:
+                    client = app.test_client()
+                    res = client.post('/quizzes/sessions',
+                                      json={'quiz_category': {'id': 1}})
+                    session['id'] = res.get_json()['session_id']
+                return '/quizzes/sessions/{}/next'.format(session['id']), None
+
+            for route in build_routes(size, rng, session_next):
+                if route_names and route[0] not in route_names:
+                    continue
+                heavy = route[0] in HEAVY_ROUTES
+                result = time_route(
+                    sender, route,
+                    args.heavy_requests if heavy else args.requests,
+                    1 if heavy else args.warmup,
+                    concurrency)
+                result.update({'size': size, 'server': sender.name})
+                results.append(result)
+                print('{size:>8} {server:<12} {route:<20} '
+                      '{throughput_rps:>9.1f} req/s  p50 {p50_ms:>8.2f} ms  '
+                      'p99 {p99_ms:>8.2f} ms  errors {errors}'
+                      .format(**result))
+
+            if server == 'wsgi':
+                sender.close()
+
+    output = {'meta': {'commit': git_commit(),
+                       'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'database': database.split(':', 1)[0],
+                       'config': parse_config(args.config),
+                       'seed': args.seed},
+              'results': results}
+
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2, sort_keys=True)
+    print('wrote {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
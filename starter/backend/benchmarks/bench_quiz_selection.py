@@ -0,0 +1,253 @@
+"""Simulate quiz sessions to benchmark the quiz selectors.
+
+Builds a synthetic question bank in memory (no database is needed), indexes
+it into (category, difficulty) buckets as the question index does, then
+plays thousands of quiz sessions through each selector (see
+flaskr/quiz_selectors.py) and reports:
+
+  - the latency of each pick (mean, p50 and p99), compared with scanning
+    every question of the category for the ones in range, as a query
+    without the buckets would
+  - the quality of the picks: for range selection, the fraction of picks in
+    range, repeats within a session and how evenly the questions in range
+    are picked (chi-squared over degrees of freedom, about 1 when uniform);
+    for adaptive selection, how close the difficulty of the questions gets
+    to the player's skill, compared with picking at random, and the
+    fraction answered correctly
+
+Run from starter/backend, for example:
+
+    python benchmarks/bench_quiz_selection.py --questions 100000 \
+        --sessions 5000 --output quiz_selection.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from bench_api import percentile, git_commit  # noqa: E402
+from flaskr.quiz_selectors import (index_by_difficulty,  # noqa: E402
+                                   RangeSelector, AdaptiveSelector,
+                                   DIFFICULTIES)
+
+CATEGORIES = 6
+
+# how often each difficulty occurs in the synthetic bank; like most question
+# banks, it has more easy questions than hard ones
+DIFFICULTY_WEIGHTS = (30, 25, 20, 15, 10)
+
+
+def build_bank(size, rng):
+    rows = [(id, rng.randint(1, CATEGORIES),
+             rng.choices(DIFFICULTIES, DIFFICULTY_WEIGHTS)[0])
+            for id in range(1, size + 1)]
+    difficulty = {id: d for id, _, d in rows}
+    by_category = {0: [id for id, _, _ in rows]}
+    for id, category, _ in rows:
+        by_category.setdefault(category, []).append(id)
+    return index_by_difficulty(rows), by_category, difficulty
+
+
+# ----------------------------------------------------------------------------
+#  answers_correctly: whether a player of the given skill (a difficulty on
+#  the same 1 to 5 scale) answers a question of the given difficulty; the
+#  chance is one half when they match
+# ----------------------------------------------------------------------------
+def answers_correctly(skill, difficulty, rng):
+    return rng.random() < 1 / (1 + math.exp(2 * (difficulty - skill)))
+
+
+def latency_summary(durations):
+    durations = sorted(durations)
+    return {'picks': len(durations),
+            'mean_us': 1e6 * sum(durations) / len(durations),
+            'p50_us': 1e6 * percentile(durations, 50),
+            'p99_us': 1e6 * percentile(durations, 99)}
+
+
+# ----------------------------------------------------------------------------
+#  scan_pick: the pick without buckets: every question of the category is
+#  looked at to find the ones in range that have not been asked
+# ----------------------------------------------------------------------------
+def scan_pick(ids, difficulty, low, high, excluded, rng):
+    candidates = [id for id in ids
+                  if low <= difficulty[id] <= high and id not in excluded]
+    return rng.choice(candidates) if candidates else None
+
+
+def simulate_range(buckets, by_category, difficulty, args, rng):
+    durations = []
+    scan_durations = []
+    picks = in_range = repeats = 0
+    # the picks of each question, for the sessions over every category and
+    # difficulty, which all draw from the same questions
+    uniform_counts = {}
+
+    for session in range(args.sessions):
+        category = rng.randint(0, CATEGORIES)
+        low = rng.randint(1, len(DIFFICULTIES))
+        high = rng.randint(low, len(DIFFICULTIES))
+        if session % 4 == 0:
+            category, low, high = 0, 1, len(DIFFICULTIES)
+        selector = RangeSelector(low, high)
+
+        def bucket(d):
+            return buckets.get((category, d), [])
+
+        asked = set()
+        for _ in range(args.questions_per_session):
+            start = time.perf_counter()
+            id = selector.select(bucket, asked, {})
+            durations.append(time.perf_counter() - start)
+            if id is None:
+                break
+            picks += 1
+            in_range += low <= difficulty[id] <= high
+            repeats += id in asked
+            asked.add(id)
+            if (category, low, high) == (0, 1, len(DIFFICULTIES)):
+                uniform_counts[id] = uniform_counts.get(id, 0) + 1
+
+        if session < args.scan_sessions:
+            asked = set()
+            ids = by_category[category]
+            for _ in range(args.questions_per_session):
+                start = time.perf_counter()
+                id = scan_pick(ids, difficulty, low, high, asked, rng)
+                scan_durations.append(time.perf_counter() - start)
+                if id is None:
+                    break
+                asked.add(id)
+
+    # chi-squared over every question, including those never picked
+    total = sum(uniform_counts.values())
+    expected = total / len(difficulty)
+    chi2 = (sum((n - expected) ** 2 for n in uniform_counts.values()) +
+            (len(difficulty) - len(uniform_counts)) * expected ** 2) / expected
+
+    return {'selector': 'range',
+            'latency': latency_summary(durations),
+            'scan_latency': latency_summary(scan_durations),
+            'picks': picks,
+            'in_range_fraction': in_range / picks if picks else None,
+            'repeats': repeats,
+            'uniformity_chi2_per_dof': chi2 / (len(difficulty) - 1)}
+
+
+def simulate_adaptive(buckets, difficulty, args, rng):
+    durations = []
+    errors = {'adaptive': [], 'random': []}
+    correct = {'adaptive': 0, 'random': 0}
+    answered = {'adaptive': 0, 'random': 0}
+
+    for session in range(args.sessions):
+        category = rng.randint(0, CATEGORIES)
+        skill = rng.uniform(1, len(DIFFICULTIES))
+
+        def bucket(d):
+            return buckets.get((category, d), [])
+
+        for name, selector in (('adaptive', AdaptiveSelector()),
+                               ('random', RangeSelector())):
+            state = {}
+            asked = set()
+            for n in range(args.questions_per_session):
+                start = time.perf_counter()
+                id = selector.select(bucket, asked, state)
+                if name == 'adaptive':
+                    durations.append(time.perf_counter() - start)
+                if id is None:
+                    break
+                asked.add(id)
+
+                d = difficulty[id]
+                is_correct = answers_correctly(skill, d, rng)
+                selector.report(state, d, is_correct)
+                answered[name] += 1
+                correct[name] += is_correct
+                # once the staircase has had a few answers to settle
+                if n >= args.questions_per_session // 2:
+                    errors[name].append(abs(d - skill))
+
+    return {'selector': 'adaptive',
+            'latency': latency_summary(durations),
+            'mean_distance_to_skill': (sum(errors['adaptive']) /
+                                       len(errors['adaptive'])),
+            'random_mean_distance_to_skill': (sum(errors['random']) /
+                                              len(errors['random'])),
+            'correct_fraction': correct['adaptive'] / answered['adaptive'],
+            'random_correct_fraction': (correct['random'] /
+                                        answered['random'])}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Simulate quiz sessions to benchmark the quiz selectors.')
+    parser.add_argument('--questions', type=int, default=100000,
+                        help='questions in the synthetic bank '
+                             '(default 100000)')
+    parser.add_argument('--sessions', type=int, default=5000,
+                        help='quiz sessions per selector (default 5000)')
+    parser.add_argument('--questions-per-session', type=int, default=20,
+                        help='questions asked in each session (default 20)')
+    parser.add_argument('--scan-sessions', type=int, default=100,
+                        help='sessions also played by scanning the category, '
+                             'for comparison (default 100)')
+    parser.add_argument('--seed', type=int, default=1234,
+                        help='random seed (default 1234)')
+    parser.add_argument('--output', default='bench_quiz_selection.json',
+                        help='where to write the results '
+                             '(default bench_quiz_selection.json)')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    # the selectors draw from the random module
+    random.seed(args.seed)
+
+    start = time.perf_counter()
+    buckets, by_category, difficulty = build_bank(args.questions, rng)
+    index_seconds = time.perf_counter() - start
+    print('{} questions indexed into {} buckets in {:.3f}s'
+          .format(args.questions, len(buckets), index_seconds))
+
+    results = [simulate_range(buckets, by_category, difficulty, args, rng),
+               simulate_adaptive(buckets, difficulty, args, rng)]
+
+    latency = results[0]['latency']
+    scan = results[0]['scan_latency']
+    print('range     pick p50 {:.1f} us  p99 {:.1f} us  (scan p50 {:.1f} us  '
+          'p99 {:.1f} us)'.format(latency['p50_us'], latency['p99_us'],
+                                  scan['p50_us'], scan['p99_us']))
+    print('          in range {in_range_fraction:.3f}  repeats {repeats}  '
+          'uniformity chi2/dof {uniformity_chi2_per_dof:.2f}'
+          .format(**results[0]))
+    latency = results[1]['latency']
+    print('adaptive  pick p50 {:.1f} us  p99 {:.1f} us'
+          .format(latency['p50_us'], latency['p99_us']))
+    print('          distance to skill {mean_distance_to_skill:.2f} '
+          '(random {random_mean_distance_to_skill:.2f})  correct '
+          '{correct_fraction:.2f} (random {random_correct_fraction:.2f})'
+          .format(**results[1]))
+
+    with open(args.output, 'w') as f:
+        json.dump({'meta': {'commit': git_commit(),
+                            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                            'seed': args.seed,
+                            'questions': args.questions,
+                            'sessions': args.sessions,
+                            'questions_per_session':
+                                args.questions_per_session,
+                            'index_seconds': index_seconds},
+                   'results': results}, f, indent=2, sort_keys=True)
+    print('wrote {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Benchmark the serialization of question pages.
+
+Measures the CPU time taken to turn a page of questions into the json body
+get_questions_package returns, no database needed:
+
+  jsonify            a dict per question, encoded with jsonify (as before
+                     the fragment cache)
+  fragments_cold     each question encoded on its own and the page
+                     assembled from the encoded questions, with nothing
+                     cached (FRAGMENT_CACHE_SIZE=0)
+  fragments_warm     the same, with every question already cached
+
+the fragment ones with the json module and, if it is installed, orjson.
+Run from starter/backend, for example:
+
+    python benchmarks/bench_serialization.py --page-sizes 10,100 \
+        --output serialization.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from flask import Flask, jsonify  # noqa: E402
+
+from bench_api import WORDS, CATEGORIES, git_commit  # noqa: E402
+from flaskr import format_question  # noqa: E402
+from flaskr import fragments  # noqa: E402
+from flaskr.snapshot import SnapshotRow  # noqa: E402
+
+
+def make_rows(count, rng):
+    return [SnapshotRow(id,
+                        ' '.join(rng.choice(WORDS) for _ in range(12)) + '?',
+                        ' '.join(rng.choice(WORDS) for _ in range(2)),
+                        rng.randint(1, 5),
+                        rng.randint(1, len(CATEGORIES)),
+                        None)
+            for id in range(1, count + 1)]
+
+
+def time_per_page(encode, repeat):
+    encode()
+    start = time.process_time()
+    for _ in range(repeat):
+        encode()
+    return (time.process_time() - start) / repeat
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the serialization of question pages.')
+    parser.add_argument('--page-sizes', default='10,100',
+                        help='comma separated page sizes (default 10,100)')
+    parser.add_argument('--repeat', type=int, default=2000,
+                        help='pages encoded per measurement (default 2000)')
+    parser.add_argument('--seed', type=int, default=1234,
+                        help='random seed (default 1234)')
+    parser.add_argument('--output', default='bench_serialization.json',
+                        help='where to write the results '
+                             '(default bench_serialization.json)')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    app = Flask(__name__)
+    categories = {i: name for i, name in enumerate(CATEGORIES, 1)}
+    encoders = [('json', None)]
+    if fragments.orjson is not None:
+        encoders.append(('orjson', fragments.orjson))
+
+    results = []
+    for size in [int(s) for s in args.page_sizes.split(',')]:
+        rows = make_rows(size, rng)
+
+        def encode_jsonify():
+            return jsonify({'questions': {i: format_question(q)
+                                          for i, q in enumerate(rows, 1)},
+                            'total_questions': 1000,
+                            'categories': categories,
+                            'currentCategory': None,
+                            'success': True}).get_data()
+
+        with app.app_context():
+            timings = {'jsonify': time_per_page(encode_jsonify, args.repeat)}
+
+        for name, module in encoders:
+            fragments.orjson = module
+            for cached in (False, True):
+                cache = fragments.FragmentCache(
+                    fragments.FRAGMENT_CACHE_SIZE if cached else 0)
+
+                def encode_fragments():
+                    return fragments.encode_questions_package(
+                        cache.fragments(rows, format_question), 1000,
+                        categories, None)
+
+                key = 'fragments_{}_{}'.format('warm' if cached else 'cold',
+                                               name)
+                timings[key] = time_per_page(encode_fragments, args.repeat)
+        fragments.orjson = encoders[-1][1]
+
+        for key, seconds in timings.items():
+            result = {'page_size': size,
+                      'serializer': key,
+                      'us_per_page': 1e6 * seconds,
+                      'speedup': timings['jsonify'] / seconds}
+            results.append(result)
+            print('{page_size:>5} questions  {serializer:<22} '
+                  '{us_per_page:>9.1f} us/page  x{speedup:.1f}'
+                  .format(**result))
+
+    with open(args.output, 'w') as f:
+        json.dump({'meta': {'commit': git_commit(),
+                            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                            'repeat': args.repeat,
+                            'seed': args.seed},
+                   'results': results}, f, indent=2, sort_keys=True)
+    print('wrote {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
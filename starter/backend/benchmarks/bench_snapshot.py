@@ -0,0 +1,142 @@
+"""Benchmark snapshot mode (SNAPSHOT_MODE) against the database.
+
+For each question bank size, reports the memory the snapshot takes per
+question, compared with loading every question as an ORM object, how long
+the snapshot takes to load, and the latency of the routes snapshot mode
+serves, with and without it. Run from starter/backend, for example:
+
+    python benchmarks/bench_snapshot.py --sizes 10000,100000 \
+        --output snapshot.json
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from bench_api import (seed, build_routes, time_route,  # noqa: E402
+                       TestClientSender, git_commit)
+from flaskr import create_app  # noqa: E402
+from flaskr.pagination import question_listing  # noqa: E402
+from flaskr.snapshot import question_snapshot, SnapshotData  # noqa: E402
+from models import db, Question, Category  # noqa: E402
+
+ROUTES = ('questions_page', 'questions_deep_page', 'questions_cursor',
+          'category_page', 'search', 'search_answers', 'quiz', 'quiz_batch')
+
+
+# ----------------------------------------------------------------------------
+#  retained_bytes: the memory still held by the result of load(), as traced
+#  by tracemalloc
+# ----------------------------------------------------------------------------
+def retained_bytes(load):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = load()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def measure_memory(app, size):
+    with app.app_context():
+        def load_snapshot():
+            categories = {c.id: c.type for c in Category.query}
+            return SnapshotData(question_listing().order_by(Question.id),
+                                categories)
+
+        def load_orm():
+            return Question.query.order_by(Question.id).all()
+
+        start = time.perf_counter()
+        snapshot, snapshot_bytes = retained_bytes(load_snapshot)
+        load_seconds = time.perf_counter() - start
+        estimate = snapshot.memory_bytes()
+        del snapshot
+
+        orm, orm_bytes = retained_bytes(load_orm)
+        del orm
+        db.session.remove()
+
+    return {'size': size,
+            'snapshot_load_seconds': load_seconds,
+            'snapshot_bytes': snapshot_bytes,
+            'snapshot_bytes_per_question': snapshot_bytes / size,
+            'snapshot_estimate_bytes_per_question': estimate / size,
+            'orm_bytes': orm_bytes,
+            'orm_bytes_per_question': orm_bytes / size}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark snapshot mode against the database.')
+    parser.add_argument('--sizes', default='10000,100000',
+                        help='comma separated question bank sizes '
+                             '(default 10000,100000)')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='timed requests per route (default 200)')
+    parser.add_argument('--warmup', type=int, default=10,
+                        help='untimed requests per route (default 10)')
+    parser.add_argument('--seed', type=int, default=1234,
+                        help='random seed (default 1234)')
+    parser.add_argument('--output', default='bench_snapshot.json',
+                        help='where to write the results '
+                             '(default bench_snapshot.json)')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    database = 'sqlite:///' + os.path.join(
+        tempfile.mkdtemp(prefix='trivia-bench-'), 'bench.db')
+    # caches off, so that every request reaches the database or snapshot
+    config = {'DATABASE_URL': database,
+              'HTTP_CACHE_SIZE': 0,
+              'SEARCH_CACHE': 'none'}
+
+    memory = []
+    results = []
+    for size in [int(s) for s in args.sizes.split(',')]:
+        app = create_app(config)
+        seed(app, size, rng)
+
+        memory.append(measure_memory(app, size))
+        print('{size:>8} questions: snapshot {snapshot_bytes_per_question:.0f}'
+              ' bytes/question (loaded in {snapshot_load_seconds:.2f}s), '
+              'ORM objects {orm_bytes_per_question:.0f} bytes/question'
+              .format(**memory[-1]))
+
+        for mode in ('database', 'snapshot'):
+            app = create_app(dict(config, SNAPSHOT_MODE=mode == 'snapshot'))
+            sender = TestClientSender(app)
+            for route in build_routes(size, rng, None):
+                if route[0] not in ROUTES:
+                    continue
+                result = time_route(sender, route, args.requests,
+                                    args.warmup, 1)
+                result.update({'size': size, 'server': mode})
+                results.append(result)
+                print('{size:>8} {server:<9} {route:<20} '
+                      '{throughput_rps:>9.1f} req/s  p50 {p50_ms:>8.2f} ms  '
+                      'p99 {p99_ms:>8.2f} ms'.format(**result))
+
+    question_snapshot.enabled = False
+
+    with open(args.output, 'w') as f:
+        json.dump({'meta': {'commit': git_commit(),
+                            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                            'seed': args.seed},
+                   'memory': memory,
+                   'results': results}, f, indent=2, sort_keys=True)
+    print('wrote {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
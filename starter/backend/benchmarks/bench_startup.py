@@ -0,0 +1,208 @@
+"""Measure how long the app takes to start and serve its first requests.
+
+Seeds a temporary SQLite database (or uses --database), then:
+
+  - cold start: in fresh Python processes, times importing the app,
+    create_app, warm_up (see flaskr/server.py), and the first and second
+    request to a few routes, with and without warming up first
+  - time to first request: starts each server (the "flask run" development
+    server and "flask serve", the pre-forking production server) and times
+    how long until it answers, then the latency of its first requests
+
+Run from starter/backend, for example:
+
+    python benchmarks/bench_startup.py --size 100000 --output startup.json
+
+"flask serve" needs gunicorn (pip install -r requirements-server.txt); it is
+skipped if gunicorn is not installed.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.dirname(HERE)
+sys.path.insert(0, BACKEND)
+
+from bench_api import seed, git_commit  # noqa: E402
+from flaskr import create_app  # noqa: E402
+
+# the requests timed after startup: a cached listing, one that needs the
+# category registry, and one that needs the question index
+REQUESTS = (('GET', '/categories', None),
+            ('GET', '/questions?page=1', None),
+            ('POST', '/quizzes', {'previous_questions': [],
+                                  'quiz_category': {'id': 0}}))
+
+# run in a fresh interpreter for each cold start; prints its timings as json
+COLD_START = '''
+import json, sys, time
+start = time.perf_counter()
+from flaskr import create_app
+from flaskr.server import warm_up
+timings = {'import': time.perf_counter() - start}
+start = time.perf_counter()
+app = create_app()
+timings['create_app'] = time.perf_counter() - start
+if sys.argv[1] == 'warm':
+    start = time.perf_counter()
+    warm_up(app)
+    timings['warm_up'] = time.perf_counter() - start
+client = app.test_client()
+for method, url, body in json.loads(sys.argv[2]):
+    for attempt in ('first', 'second'):
+        start = time.perf_counter()
+        client.open(url, method=method, json=body)
+        timings['{} {} {}'.format(attempt, method, url)] = (
+            time.perf_counter() - start)
+print(json.dumps(timings))
+'''
+
+
+def environment(database):
+    env = dict(os.environ, DATABASE_URL=database, FLASK_APP='flaskr')
+    env.pop('FLASK_ENV', None)
+    env.pop('CREATE_SCHEMA', None)
+    return env
+
+
+def cold_start(database, warm):
+    output = subprocess.check_output(
+        [sys.executable, '-c', COLD_START, 'warm' if warm else 'cold',
+         json.dumps(REQUESTS)],
+        cwd=BACKEND, env=environment(database))
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def request(port, method, url, body):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        start = time.perf_counter()
+        conn.request(method, url,
+                     body=json.dumps(body) if body is not None else None,
+                     headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        return response.status, time.perf_counter() - start
+    finally:
+        conn.close()
+
+
+# ----------------------------------------------------------------------------
+#  time_to_first_request: start the server with the given flask command,
+#  and time how long until it answers /categories, then how long the other
+#  first requests take
+# ----------------------------------------------------------------------------
+def time_to_first_request(database, command, timeout=60):
+    port = free_port()
+    args = [sys.executable, '-m', 'flask'] + command
+    args += (['--bind', '127.0.0.1:{}'.format(port)] if command[0] == 'serve'
+             else ['--port', str(port)])
+
+    start = time.perf_counter()
+    server = subprocess.Popen(args, cwd=BACKEND, env=environment(database),
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError('{} did not start'.format(command[0]))
+            if server.poll() is not None:
+                raise RuntimeError('{} exited'.format(command[0]))
+            try:
+                status, _ = request(port, 'GET', '/categories', None)
+            except OSError:
+                time.sleep(0.01)
+                continue
+            if status == 200:
+                break
+        timings = {'time_to_first_request': time.perf_counter() - start}
+        for method, url, body in REQUESTS[1:]:
+            _, seconds = request(port, method, url, body)
+            timings['first {} {}'.format(method, url)] = seconds
+        return timings
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def average(runs):
+    return {key: sum(run[key] for run in runs) / len(runs)
+            for key in runs[0]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Measure app startup and time to first request.')
+    parser.add_argument('--database',
+                        help='database URL (default: a temporary SQLite '
+                             'database, seeded with --size questions)')
+    parser.add_argument('--size', type=int, default=10000,
+                        help='questions to seed (default 10000)')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='runs of each measurement (default 5)')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='workers for flask serve (default 2)')
+    parser.add_argument('--seed', type=int, default=1234,
+                        help='random seed (default 1234)')
+    parser.add_argument('--output', default='bench_startup.json',
+                        help='where to write the results '
+                             '(default bench_startup.json)')
+    args = parser.parse_args(argv)
+
+    database = args.database
+    if database is None:
+        database = 'sqlite:///' + os.path.join(
+            tempfile.mkdtemp(prefix='trivia-bench-'), 'bench.db')
+        seed(create_app({'DATABASE_URL': database}), args.size,
+             random.Random(args.seed))
+
+    results = {}
+    for warm in (False, True):
+        name = 'cold_start_warmed' if warm else 'cold_start'
+        results[name] = average([cold_start(database, warm)
+                                 for _ in range(args.runs)])
+        print('{:<20} {}'.format(name, '  '.join(
+            '{} {:.1f} ms'.format(key, 1000 * seconds)
+            for key, seconds in results[name].items())))
+
+    servers = {'flask_run': ['run']}
+    try:
+        import gunicorn  # noqa: F401
+        servers['flask_serve'] = ['serve', '--workers', str(args.workers)]
+    except ImportError:
+        print('gunicorn is not installed; skipping flask serve')
+
+    for name, command in servers.items():
+        results[name] = average([time_to_first_request(database, command)
+                                 for _ in range(args.runs)])
+        print('{:<20} {}'.format(name, '  '.join(
+            '{} {:.1f} ms'.format(key, 1000 * seconds)
+            for key, seconds in results[name].items())))
+
+    with open(args.output, 'w') as f:
+        json.dump({'meta': {'commit': git_commit(),
+                            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                            'size': args.size if args.database is None
+                            else None,
+                            'runs': args.runs,
+                            'workers': args.workers},
+                   'results': results}, f, indent=2, sort_keys=True)
+    print('wrote {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
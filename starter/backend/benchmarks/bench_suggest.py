@@ -0,0 +1,153 @@
+"""Benchmark the suggestion index behind /questions/suggest.
+
+Builds synthetic question banks in memory (no database is needed): each
+question is a dozen words drawn, with a Zipf-like skew, from a generated
+vocabulary, as words are in real text. For each bank size it loads a
+SuggestionIndex (see flaskr/suggest.py) and reports:
+
+  - build time, words indexed and memory taken
+  - the latency of a suggestion (mean, p50 and p99) for prefixes of 1 to 4
+    letters, compared with scanning every word for the ones starting with
+    the prefix, as an index without the sorted list would
+  - the latency of applying an added and a deleted question to the index
+
+Run from starter/backend, for example:
+
+    python benchmarks/bench_suggest.py --sizes 10000,100000 \
+        --output suggest.json
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from bench_api import percentile, git_commit  # noqa: E402
+from flaskr.suggest import SuggestionIndex, SUGGEST_LIMIT  # noqa: E402
+
+WORDS_PER_QUESTION = 12
+
+
+def make_vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(string.ascii_lowercase)
+                          for _ in range(rng.randint(3, 10))))
+    words = sorted(words)
+    rng.shuffle(words)
+    return words
+
+
+def make_questions(count, vocabulary, rng):
+    # weights 1/rank: a few words are common, most are rare
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    return [' '.join(rng.choices(vocabulary, weights,
+                                 k=WORDS_PER_QUESTION)) + '?'
+            for _ in range(count)]
+
+
+def latency_summary(durations):
+    durations = sorted(durations)
+    return {'mean_us': 1e6 * sum(durations) / len(durations),
+            'p50_us': 1e6 * percentile(durations, 50),
+            'p99_us': 1e6 * percentile(durations, 99)}
+
+
+def time_calls(call, arguments):
+    durations = []
+    for argument in arguments:
+        start = time.perf_counter()
+        call(argument)
+        durations.append(time.perf_counter() - start)
+    return latency_summary(durations)
+
+
+# ----------------------------------------------------------------------------
+#  scan_suggest: the suggestions without the sorted list's binary search:
+#  every word is looked at
+# ----------------------------------------------------------------------------
+def scan_suggest(words, counts, prefix, limit=SUGGEST_LIMIT):
+    found = [(word, count) for word, count in zip(words, counts)
+             if word.startswith(prefix)]
+    return found[:limit]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the suggestion index.')
+    parser.add_argument('--sizes', default='10000,100000',
+                        help='comma separated question bank sizes '
+                             '(default 10000,100000)')
+    parser.add_argument('--vocabulary', type=int, default=50000,
+                        help='distinct words to draw from (default 50000)')
+    parser.add_argument('--lookups', type=int, default=2000,
+                        help='suggestions timed per prefix length '
+                             '(default 2000)')
+    parser.add_argument('--seed', type=int, default=1234,
+                        help='random seed (default 1234)')
+    parser.add_argument('--output', default='bench_suggest.json',
+                        help='where to write the results '
+                             '(default bench_suggest.json)')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    vocabulary = make_vocabulary(args.vocabulary, rng)
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(',')]:
+        questions = make_questions(size, vocabulary, rng)
+        index = SuggestionIndex()
+        index.load(questions)
+        result = {'questions': size,
+                  'build_seconds': index.build_seconds,
+                  'words': len(index._words),
+                  'bytes': index.memory_bytes(),
+                  'suggest': {},
+                  'scan': {}}
+
+        for length in range(1, 5):
+            prefixes = [word[:length] for word in
+                        rng.choices(index._words, k=args.lookups)]
+            result['suggest'][length] = time_calls(index.suggest, prefixes)
+            result['scan'][length] = time_calls(
+                lambda prefix: scan_suggest(index._words, index._counts,
+                                            prefix),
+                prefixes[:max(1, args.lookups // 20)])
+
+        changes = make_questions(args.lookups, vocabulary, rng)
+        result['add'] = time_calls(lambda text: index.update(added=[text]),
+                                   changes)
+        result['delete'] = time_calls(
+            lambda text: index.update(removed=[text]), changes)
+        results.append(result)
+
+        print('{questions:>7} questions  {words:>6} words  '
+              'built in {build_seconds:.3f}s  {mb:.1f} MiB'
+              .format(mb=result['bytes'] / 2 ** 20, **result))
+        for length in range(1, 5):
+            print('    prefix of {}  suggest p50 {:>6.1f} us  p99 {:>6.1f} us'
+                  '   scan p50 {:>9.1f} us'.format(
+                      length, result['suggest'][length]['p50_us'],
+                      result['suggest'][length]['p99_us'],
+                      result['scan'][length]['p50_us']))
+        print('    add p50 {:.1f} us  delete p50 {:.1f} us'.format(
+            result['add']['p50_us'], result['delete']['p50_us']))
+
+    with open(args.output, 'w') as f:
+        json.dump({'meta': {'commit': git_commit(),
+                            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                            'vocabulary': args.vocabulary,
+                            'lookups': args.lookups,
+                            'seed': args.seed},
+                   'results': results}, f, indent=2, sort_keys=True)
+    print('wrote {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Compare two result files written by bench_api.py.
+
+    python benchmarks/compare.py before.json after.json
+
+Prints the change in throughput and p50/p99 latency for every route timed
+in both runs. Exits with status 1 if any p99 latency got worse by more than
+--threshold percent, so it can gate a CI job.
+"""
+import argparse
+import json
+import sys
+
+
+def load_results(path):
+    with open(path) as f:
+        data = json.load(f)
+    return {(r['size'], r['server'], r['route']): r for r in data['results']}
+
+
+def change(before, after):
+    if not before:
+        return None
+    return 100.0 * (after - before) / before
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Compare two benchmark result files.')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=20.0,
+                        help='p99 slowdown, in percent, counted as a '
+                             'regression (default 20)')
+    args = parser.parse_args(argv)
+
+    before = load_results(args.before)
+    after = load_results(args.after)
+
+    regressions = 0
+    print('{:>8} {:<12} {:<20} {:>10} {:>10} {:>10}'.format(
+        'size', 'server', 'route', 'req/s', 'p50', 'p99'))
+    for key in sorted(set(before) & set(after)):
+        old, new = before[key], after[key]
+        p99 = change(old['p99_ms'], new['p99_ms'])
+        if p99 is not None and p99 > args.threshold:
+            regressions += 1
+        print('{:>8} {:<12} {:<20} {:>+9.1f}% {:>+9.1f}% {:>+9.1f}%{}'.format(
+            key[0], key[1], key[2],
+            change(old['throughput_rps'], new['throughput_rps']) or 0,
+            change(old['p50_ms'], new['p50_ms']) or 0,
+            p99 or 0,
+            '  REGRESSION' if p99 is not None and p99 > args.threshold
+            else ''))
+
+    if regressions:
+        print('{} route(s) regressed by more than {}% at p99'.format(
+            regressions, args.threshold))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
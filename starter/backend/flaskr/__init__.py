@@ -1,75 +1,67 @@
 import os
-from flask import Flask, request, abort, jsonify
-from flask_sqlalchemy import SQLAlchemy
+import click
+from flask import (Flask, request, abort, jsonify, Response,
+                   stream_with_context)
 from flask_cors import CORS
 import random
 import logging
-from models import setup_db, Question, Category
+from collections import Counter
+from models import (db, setup_db, get_pool_stats, get_database_path,
+                    get_question_count, rebuild_question_counts,
+                    run_migrations, ALL_CATEGORIES, Question)
 from sqlalchemy.exc import DatabaseError
-
-# db = SQLAlchemy()
-
-QUESTIONS_PER_PAGE = 10
-MOST_DIFFICULT_RATING = 5
+from .categories import (category_registry, invalidate_categories,
+                         CATEGORY_CACHE_TTL)
+from .search import search_questions_query
+from .quiz import (question_index, get_question, get_random_question,
+                   get_random_questions, next_adaptive_question,
+                   QUESTION_INDEX_TTL, QUIZ_MAX_COUNT)
+from .quiz_selectors import (RangeSelector, AdaptiveSelector,
+                             create_selector, parse_difficulty,
+                             MOST_DIFFICULT_RATING)
+from .quiz_sessions import create_session_store
+from .batch import run_batch, BATCH_MAX_OPERATIONS
+from .bulk import (import_questions, iter_ndjson_rows, iter_csv_rows,
+                   iter_export_rows, export_ndjson, export_csv,
+                   NDJSON_MIMETYPES, CSV_MIMETYPES)
+from .streaming import stream_questions_package, stream_json_array
+from .http_cache import (response_cache, cached_response, cache_response,
+                         HTTP_CACHE_SIZE, HTTP_CACHE_TTL)
+from .metrics import init_metrics
+from .read_routing import init_read_routing
+from .fragments import (fragment_cache, encode_json,
+                        encode_questions_package, FRAGMENT_CACHE_SIZE)
+from .server import warm_up, run_server, default_workers, DEFAULT_BIND
+from .search_cache import search_cache, create_search_backend
+from .suggest import (suggestion_index, last_word, SUGGEST_INDEX_TTL,
+                      SUGGEST_LIMIT, SUGGEST_MAX_LIMIT)
+from .snapshot import question_snapshot, install_refresh_signal, paginate_ids
+from .pagination import (paginate_query, paginate_by_cursor,
+                         question_listing, with_category_types,
+                         QUESTIONS_PER_PAGE)
+
+# the difficulty adaptive quiz sessions start at, unless one is given
+ADAPTIVE_START_DIFFICULTY = 2
+
+# the fields of a question that can be changed
+QUESTION_FIELDS = ('question', 'answer', 'difficulty', 'category')
 
 
 # ----------------------------------------------------------------------------
-#  Retrieve the categories from the database and return them in an object
-#  format.
+#  Retrieve the categories from the category registry and return them in an
+#  object format.
 #  This is typically called from an endpoint that needs to return categories
 #  as part of its results, such as /questions
 # ----------------------------------------------------------------------------
 def get_all_categories():
-
-    try:
-        categories = Category.query.all()
-    except DatabaseError:
-        abort(422)
-        print("Could not get categories from the database")
-
-    i = 1
-    cat_obj = {}
-    for c in categories:
-        cat_obj[i] = c.type
-        i = i+1
-
-    return cat_obj
+    return category_registry.payload()
 
 
 # ------------------------------------------------------------------------------
 #  Is valid category: return True if the supplied category id exists in the db
 # ------------------------------------------------------------------------------
 def is_valid_category(id):
-
-    try:
-        categories = Category.query.all()
-    except DatabaseError:
-        abort(422)
-
-    catList = []
-    for cat in categories:
-        catList.append(cat.id)
-
-    if id in catList:
-        return True
-    else:
-        return False
-
-
-# ------------------------------------------------------------------------------
-#  Given array of Question objects, return object, using index as key
-# ------------------------------------------------------------------------------
-def format_question_array(questions):
-    i = 1
-    q_obj = {}
-    for q in questions:
-        q_obj[i] = {'id': q.id,
-                    'question': q.question,
-                    'answer': q.answer,
-                    'difficulty': q.difficulty,
-                    'category': q.category}
-        i = i + 1
-    return q_obj
+    return category_registry.is_valid(id)
 
 
 # return success obj
@@ -88,66 +80,223 @@ def is_valid_difficulty(rating):
     return False
 
 
+# ---------------------------------------------------------------------------
+#  get_difficulty_range: read the optional difficulty of a quiz request (a
+#  difficulty, or {"min": <int>, "max": <int>}), returning (min, max), or
+#  None if there is none. Aborts with 400 if it is not a valid range
+# ---------------------------------------------------------------------------
+def get_difficulty_range(options):
+    if options.get('difficulty') is None:
+        return None
+    try:
+        return parse_difficulty(options['difficulty'])
+    except (TypeError, ValueError):
+        abort(400)
+
+
+# ---------------------------------------------------------------------------
+#  clean_question_row: validate a question from a bulk import and return the
+#  column values to insert. Raises ValueError, with a message saying what is
+#  wrong, if the row is missing data or has an invalid difficulty or category
+# ---------------------------------------------------------------------------
+def clean_question_row(row):
+    question_text = str(row.get('question') or '').strip()
+    answer_text = str(row.get('answer') or '').strip()
+
+    if not question_text:
+        raise ValueError('question is required')
+    if not answer_text:
+        raise ValueError('answer is required')
+
+    try:
+        difficulty_rating = int(row.get('difficulty'))
+        category_setting = int(row.get('category'))
+    except (TypeError, ValueError):
+        raise ValueError('difficulty and category must be integers')
+
+    if not is_valid_difficulty(difficulty_rating):
+        raise ValueError('invalid difficulty: {}'.format(difficulty_rating))
+    if not is_valid_category(category_setting):
+        raise ValueError('invalid category: {}'.format(category_setting))
+
+    return {'question': question_text,
+            'answer': answer_text,
+            'difficulty': difficulty_rating,
+            'category': category_setting}
+
+
+# ---------------------------------------------------------------------------
+#  clean_question_changes: validate the changes to a question sent to
+#  PATCH /questions/<id> or /questions/batch, an object with any of its
+#  question, answer, difficulty and category, and return them cleaned.
+#  Raises ValueError, with a message saying what is wrong, if there are no
+#  changes, or any is unknown or invalid
+# ---------------------------------------------------------------------------
+def clean_question_changes(changes):
+    if not isinstance(changes, dict) or not changes:
+        raise ValueError('changes are required')
+    unknown = sorted(set(changes) - set(QUESTION_FIELDS))
+    if unknown:
+        raise ValueError('unknown fields: {}'.format(', '.join(unknown)))
+
+    cleaned = {}
+    for field in ('question', 'answer'):
+        if field in changes:
+            cleaned[field] = str(changes[field] or '').strip()
+            if not cleaned[field]:
+                raise ValueError('{} must not be empty'.format(field))
+    for field in ('difficulty', 'category'):
+        if field in changes:
+            try:
+                cleaned[field] = int(changes[field])
+            except (TypeError, ValueError):
+                raise ValueError('{} must be an integer'.format(field))
+
+    if 'difficulty' in cleaned and not is_valid_difficulty(
+            cleaned['difficulty']):
+        raise ValueError('invalid difficulty: {}'.format(
+            cleaned['difficulty']))
+    if 'category' in cleaned and not is_valid_category(cleaned['category']):
+        raise ValueError('invalid category: {}'.format(cleaned['category']))
+
+    return cleaned
+
+
 # ---------------------------------------------------------------------------
 #  get_questions_package: Several endpoints utilize this general questions
 #   packager. The endpoints for getting (/questions), questions by category
 #  (/categories/<int:id>/questions) and search for question
-#  (/questions/search) all retrieve different batches of questions,
-#  and then those questions need to be packaged by specified page
-#  into a json object. That work is done here
+#  (/questions/search) all build different queries for questions, and then
+#  the specified page of those questions needs to be packaged into a json
+#  object. That work is done here. Only the requested page is fetched from
+#  the database (see paginate_query).
+#  If a cursor is supplied (even an empty one), the listing is paged by
+#  cursor instead of by page number, and the cursor for the following page
+#  is returned as next_cursor (see paginate_by_cursor).
+#  If a cache_key is supplied, the page is looked up in (and, if it is not
+#  there, added to) the search cache under that key (see search_cache.py).
+#  In snapshot mode, the listing is given as snapshot_ids, the ids of its
+#  questions in snapshot_data, instead of as a query (see snapshot.py).
+#  The json is assembled from each question's encoded json, which is kept
+#  in the fragment cache (see fragments.py).
+#  count, if given, returns the number of questions the query returns, so
+#  that they need not be counted (see models.get_question_count)
 # ---------------------------------------------------------------------------
-def get_questions_package(page, questions, cat):
-    startIdx = (page-1) * QUESTIONS_PER_PAGE
+def get_questions_package(page, query, cat, order_by=None, cursor=None,
+                          include_category=False, cache_key=None,
+                          snapshot_data=None, snapshot_ids=None,
+                          count=None):
+    next_cursor = None
+    cached = None
+    if cache_key is not None:
+        cached = search_cache.get(cache_key)
+
+    if cached is not None:
+        fragments = [encode_json(q) for q in cached['questions']]
+        total = cached['total_questions']
+    else:
+        if snapshot_data is not None:
+            thisPageQuestions, total, next_cursor = paginate_ids(
+                snapshot_data, snapshot_ids, page, cursor, cat)
+        elif cursor is None:
+            thisPageQuestions, total = paginate_query(
+                query, page, order_by=order_by,
+                include_category=include_category, count=count)
+        else:
+            thisPageQuestions, total, next_cursor = paginate_by_cursor(
+                query, cursor, cat, include_category=include_category,
+                count=count)
 
-    if startIdx > len(questions):
-        abort(404)
+        fragments = fragment_cache.fragments(thisPageQuestions,
+                                             format_question,
+                                             include_category)
 
-    else:
-        endIdx = (page * QUESTIONS_PER_PAGE)
+        if cache_key is not None:
+            search_cache.put(cache_key, fragments, total)
 
-        endIdx = min(endIdx, len(questions))
+    body = encode_questions_package(fragments, total, get_all_categories(),
+                                    cat, next_cursor, cursor is not None)
+    return Response(body, mimetype='application/json')
 
-        thisPageQuestions = questions[startIdx:endIdx]
-        num_questions_this_page = len(thisPageQuestions)
 
-        q_obj = {}
-        q_obj = format_question_array(thisPageQuestions)
+# ----------------------------------------------------------------------------
+#  stream_questions_response: return every question of the query, in the
+#  same format as get_questions_package, as a streaming response. The json
+#  is produced one question at a time from a server-side cursor, so memory
+#  use does not grow with the number of questions
+# ----------------------------------------------------------------------------
+def stream_questions_response(query, cat, include_category=False):
+    if include_category:
+        query = with_category_types(query)
+    body = stream_questions_package(
+        query, cat, get_all_categories(),
+        lambda q: format_question(q, include_category))
+    return Response(stream_with_context(body), mimetype='application/json')
 
-        qresults = {'questions': q_obj,
-                    'total_questions': len(questions),
-                    'categories': get_all_categories(),
-                    'currentCategory': cat,
-                    'success': True}
 
-        return jsonify(qresults)
+# ----------------------------------------------------------------------------
+#  wants_all_questions: True if the request asked for every question rather
+#  than one page (?all=true)
+# ----------------------------------------------------------------------------
+def wants_all_questions():
+    return request.args.get('all', '').lower() == 'true'
 
 
 # ----------------------------------------------------------------------------
-#  get_term: given a Search Term, return a lower case version, enclosed with %
+#  wants_category_types: True if the request asked for the category name of
+#  each question to be included (?include=category)
 # ----------------------------------------------------------------------------
-def get_term(term):
-    term_lower = term.lower()
-    term_lower = '%' + term_lower + '%'
-    return term_lower
+def wants_category_types():
+    return 'category' in request.args.get('include', '').split(',')
 
 
 # ----------------------------------------------------------------------------
 #  format_question: Put a Question returned from the db into key:value format
 # ----------------------------------------------------------------------------
-def format_question(question):
-    return {'id': question.id,
-            'question': question.question,
-            'answer': question.answer,
-            'difficulty': question.difficulty,
-            'category': question.category}
+def format_question(question, include_category=False):
+    formatted = {'id': question.id,
+                 'question': question.question,
+                 'answer': question.answer,
+                 'difficulty': question.difficulty,
+                 'category': question.category}
+    if include_category:
+        formatted['category_type'] = question.category_type
+    return formatted
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    if test_config is not None:
+        app.config.update(test_config)
     setup_db(app)
-    db = SQLAlchemy(app)
+
+    category_registry.ttl = app.config.get('CATEGORY_CACHE_TTL',
+                                           CATEGORY_CACHE_TTL)
+    invalidate_categories()
+    question_index.ttl = app.config.get('QUESTION_INDEX_TTL',
+                                        QUESTION_INDEX_TTL)
+    question_index.invalidate()
+    suggestion_index.ttl = app.config.get('SUGGEST_INDEX_TTL',
+                                          SUGGEST_INDEX_TTL)
+    suggestion_index.invalidate()
+    response_cache.max_entries = app.config.get('HTTP_CACHE_SIZE',
+                                                HTTP_CACHE_SIZE)
+    response_cache.ttl = app.config.get('HTTP_CACHE_TTL', HTTP_CACHE_TTL)
+    response_cache.clear()
+    fragment_cache.max_entries = app.config.get('FRAGMENT_CACHE_SIZE',
+                                                FRAGMENT_CACHE_SIZE)
+    fragment_cache.clear()
+    search_cache.backend = create_search_backend(app.config)
+    question_snapshot.enabled = bool(app.config.get('SNAPSHOT_MODE'))
+    question_snapshot.ttl = app.config.get('SNAPSHOT_TTL')
+    question_snapshot.refresh()
+    if question_snapshot.enabled:
+        install_refresh_signal()
+        with app.app_context():
+            question_snapshot.data()
     cors = CORS(app, resources={r"/*": {"origins": "*"}})
+    quiz_sessions = create_session_store(app.config)
 
     @app.after_request
     def after_request(response):
@@ -155,24 +304,99 @@ def create_app(test_config=None):
                              'GET,PATCH,POST,DELETE,OPTIONS')
         return response
 
+# ------------------------------------------------------------------------------
+#  flask db-upgrade: bring the database schema up to date by running the
+#  alembic migrations in the migrations directory
+# ------------------------------------------------------------------------------
+    @app.cli.command('db-upgrade')
+    def db_upgrade():
+        run_migrations(get_database_path(app))
+
+# ------------------------------------------------------------------------------
+#  flask rebuild-counts: count the questions of each category again (see
+#  models.QuestionCount), after they were changed other than through the API
+# ------------------------------------------------------------------------------
+    @app.cli.command('rebuild-counts')
+    def rebuild_counts():
+        counts = rebuild_question_counts()
+        click.echo('Counted {} questions in {} categories'.format(
+            counts.pop(ALL_CATEGORIES), len(counts)))
+
+# ------------------------------------------------------------------------------
+#  flask serve: run the app in production, with gunicorn's pre-forking server
+#  (see server.py). The app is warmed up once and then forked into workers
+#  (--workers, by default WEB_CONCURRENCY or two per CPU plus one). With
+#  --create-schema, missing tables are created first
+# ------------------------------------------------------------------------------
+    @app.cli.command('serve')
+    @click.option('--bind', default=DEFAULT_BIND,
+                  help='Address to listen on (default {}).'
+                       .format(DEFAULT_BIND))
+    @click.option('--workers', type=int, default=None,
+                  help='Worker processes.')
+    @click.option('--threads', type=int, default=1,
+                  help='Threads per worker (default 1).')
+    @click.option('--create-schema', is_flag=True,
+                  help='Create missing tables before serving.')
+    def serve(bind, workers, threads, create_schema):
+        if create_schema:
+            with app.app_context():
+                db.create_all(bind=None)
+
+        timings = warm_up(app)
+        click.echo('Warmed up in {:.3f}s ({})'.format(
+            sum(timings.values()),
+            ', '.join('{} {:.3f}s'.format(step, seconds)
+                      for step, seconds in timings.items())))
+
+        run_server(app, bind, workers or default_workers(), threads)
+
+# ------------------------------------------------------------------------------
+#  Instrumentation (see metrics.py), if METRICS is set: per endpoint request
+#  times, SQL queries and json encoding time, served at /metrics. It is set
+#  up before the HTTP cache so that requests answered from the cache are
+#  counted too
+# ------------------------------------------------------------------------------
+    if app.config.get('METRICS'):
+        init_metrics(app,
+                     caches={'categories': category_registry.stats,
+                             'question_index': question_index.stats,
+                             'suggest': suggestion_index.stats,
+                             'responses': response_cache.stats,
+                             'fragments': fragment_cache.stats,
+                             'search': search_cache.stats,
+                             'snapshot': question_snapshot.stats},
+                     pool_stats=get_pool_stats)
+
+# ------------------------------------------------------------------------------
+#  Read replicas (see read_routing.py and models.ReplicaSet), if REPLICA_URLS
+#  is set: the queries of read-only requests go to a replica, unless the
+#  client wrote recently. Set up before the HTTP cache, which may load the
+#  categories to check a request's ETag
+# ------------------------------------------------------------------------------
+    init_read_routing(app)
+
+# ------------------------------------------------------------------------------
+#  HTTP caching of /categories and the question listings (see http_cache.py):
+#  conditional GETs are answered with 304 and recently served responses are
+#  returned from memory, as long as the questions and categories have not
+#  changed since
+# ------------------------------------------------------------------------------
+    @app.before_request
+    def before_request_cache():
+        return cached_response(app, category_registry)
+
+    @app.after_request
+    def after_request_cache(response):
+        return cache_response(app, response)
+
 # ------------------------------------------------------------------------------
 #  Endpoint /categories (GET) returns an object of all available categories.
 # ------------------------------------------------------------------------------
     @app.route('/categories')
     def get_categories():
 
-        try:
-            categories = Category.query.all()
-        except DatabaseError:
-            abort(422)
-
-        i = 1
-        cat_obj = {}
-        for c in categories:
-            cat_obj[i] = c.type
-            i = i+1
-
-        categories = {'categories': cat_obj,
+        categories = {'categories': get_all_categories(),
                       'success': True}
         return jsonify(categories)
 
@@ -180,38 +404,70 @@ def create_app(test_config=None):
 # ------------------------------------------------------------------------------
 #  /categories/<int:id>/questions (GET) returns the questions that will appear
 #  on the specified page. There are 10 pages per question (const defined above)
+#  Passing cursor= instead of page= pages through the questions by cursor, and
+#  all=true streams every question of the category
 # ------------------------------------------------------------------------------
     @app.route('/categories/<int:id>/questions')
     def get_questions_by_cat(id):
         page = request.args.get('page', 1, type=int)
+        cursor = request.args.get('cursor')
 
         if not is_valid_category(id):
             abort(404)
 
-        try:
-            questions = Question.query.filter_by(category=id).all()
-        except DatabaseError:
-            abort(404)
+        include_category = wants_category_types()
+
+        if question_snapshot.enabled and not wants_all_questions():
+            data = question_snapshot.data()
+            return get_questions_package(page, None, id, cursor=cursor,
+                                         include_category=include_category,
+                                         snapshot_data=data,
+                                         snapshot_ids=data.category_ids(id))
 
-        return get_questions_package(page, questions, id)
+        questions = question_listing().filter(Question.category == id)
+
+        if wants_all_questions():
+            return stream_questions_response(questions, id, include_category)
+
+        return get_questions_package(page, questions, id, cursor=cursor,
+                                     include_category=include_category,
+                                     count=lambda: get_question_count(id))
 
 
 # ------------------------------------------------------------------------------
 #  /questions (GET) returns questions from all categories that will appear on
-#  the specified page
+#  the specified page. Passing cursor= instead of page= pages through the
+#  questions by cursor, and all=true streams every question
 # ------------------------------------------------------------------------------
     @app.route('/questions')
     def get_questions():
         page = request.args.get('page', 1, type=int)
+        cursor = request.args.get('cursor')
+
+        include_category = wants_category_types()
 
-        questions = Question.query.all()
+        if question_snapshot.enabled and not wants_all_questions():
+            data = question_snapshot.data()
+            return get_questions_package(page, None, None, cursor=cursor,
+                                         include_category=include_category,
+                                         snapshot_data=data,
+                                         snapshot_ids=data.ids)
 
-        return get_questions_package(page, questions, None)
+        questions = question_listing()
+
+        if wants_all_questions():
+            return stream_questions_response(questions, None, include_category)
+
+        return get_questions_package(page, questions, None, cursor=cursor,
+                                     include_category=include_category,
+                                     count=get_question_count)
 
 # ------------------------------------------------------------------------------
 #  /questions/search (POST) returns questions that include the user-provided
-#  search term. Both the search term and the question are lowercased to
-#  ignore case.
+#  search term. On Postgres the search uses the full text search indexes and
+#  the best matches come first; otherwise both the search term and the
+#  question are lowercased to ignore case. Set includeAnswers to also search
+#  the answer text
 # ------------------------------------------------------------------------------
     @app.route('/questions/search', methods=['POST'])
     def search_questions():
@@ -225,19 +481,52 @@ def create_app(test_config=None):
             page = request.get_json()['page']
 
         term = request.get_json()['searchTerm']
+        include_answers = bool(request.get_json().get('includeAnswers'))
+
+        include_category = wants_category_types()
 
-        search_term = get_term(term)
+        if question_snapshot.enabled:
+            data = question_snapshot.data()
+            return get_questions_package(page, None, None,
+                                         include_category=include_category,
+                                         snapshot_data=data,
+                                         snapshot_ids=data.search(
+                                             term, include_answers))
+
+        questions, order_by = search_questions_query(
+            term, include_answers, question_listing())
+        cache_key = search_cache.key(term, page, include_answers,
+                                     include_category)
+
+        return get_questions_package(page, questions, None, order_by=order_by,
+                                     include_category=include_category,
+                                     cache_key=cache_key)
+
+# ------------------------------------------------------------------------------
+#  /questions/suggest (GET) returns, for type-ahead search, the words of the
+#  questions that start with the last word of prefix (?prefix=who%20wr gives
+#  "write", "writer", "wrote"...) in alphabetical order, each with the number
+#  of questions it is in; at most limit of them (default 10, at most 50).
+#  Answered from an in-memory index of the question words (see suggest.py)
+# ------------------------------------------------------------------------------
+    @app.route('/questions/suggest')
+    def suggest_questions():
+        prefix = last_word(request.args.get('prefix', ''))
+        if not prefix:
+            abort(400)
 
         try:
-            questions = (
-                          Question.query
-                          .filter(Question.question.ilike(search_term)).all()
-            )
-        except DatabaseError:
-            app.logger.info("An error occurred while attempting to search.")
-            abort(422)
+            limit = int(request.args.get('limit', SUGGEST_LIMIT))
+        except ValueError:
+            abort(400)
+        if not 1 <= limit <= SUGGEST_MAX_LIMIT:
+            abort(400)
 
-        return get_questions_package(page, questions, None)
+        suggestions = suggestion_index.suggest(prefix, limit)
+        return jsonify({'success': True,
+                        'prefix': prefix,
+                        'suggestions': [{'word': word, 'questions': count}
+                                        for word, count in suggestions]})
 
 # ------------------------------------------------------------------------------
 #  /questions/<int:id> (DELETE) retrieves the question specified by id in the
@@ -252,7 +541,6 @@ def create_app(test_config=None):
 
         try:
             the_question.delete()
-            db.session.commit()
         except DatabaseError:
             app.logger.info("An error occurred in trying to delete question.")
             abort(422)
@@ -260,6 +548,66 @@ def create_app(test_config=None):
         return jsonify({'success': True,
                         'deleted': id})
 
+# ------------------------------------------------------------------------------
+#  /questions/<int:id> (PATCH) changes any of the question text, answer text,
+#  difficulty and category of the question specified by id, and returns the
+#  question as it now is. Invalid changes are a 400, and a question that does
+#  not exist a 404
+# ------------------------------------------------------------------------------
+    @app.route('/questions/<int:id>', methods=['PATCH'])
+    def update_question(id):
+
+        try:
+            changes = clean_question_changes(request.get_json(silent=True))
+        except ValueError:
+            abort(400)
+
+        the_question = Question.query.filter_by(id=id).one_or_none()
+        if the_question is None:
+            abort(404)
+
+        try:
+            for field, value in changes.items():
+                setattr(the_question, field, value)
+            the_question.update()
+        except DatabaseError:
+            db.session.rollback()
+            app.logger.info("An error occurred in trying to update question.")
+            abort(422)
+
+        return jsonify({'success': True,
+                        'question': the_question.format()})
+
+# ------------------------------------------------------------------------------
+#  /questions/batch (POST) applies a list of changes to questions, sent as
+#  {"operations": [...]}, each {"op": "update", "id": <int>, "changes": {...}}
+#  (changes as for PATCH /questions/<id>) or {"op": "delete", "id": <int>}, in
+#  a single transaction with bulk UPDATE and DELETE statements (see batch.py).
+#  Operations that are invalid or name a question that does not exist are
+#  skipped, and the status of every operation is reported
+# ------------------------------------------------------------------------------
+    @app.route('/questions/batch', methods=['POST'])
+    def batch_update_questions():
+
+        body = request.get_json(silent=True)
+        operations = body.get('operations') if isinstance(body, dict) else None
+        if (not isinstance(operations, list) or
+                len(operations) > BATCH_MAX_OPERATIONS):
+            abort(400)
+
+        try:
+            results = run_batch(operations, clean_question_changes)
+        except DatabaseError:
+            app.logger.info("An error occurred in trying to apply a batch.")
+            abort(422)
+
+        statuses = Counter(result['status'] for result in results)
+        return jsonify({'success': True,
+                        'updated': statuses['updated'],
+                        'deleted': statuses['deleted'],
+                        'failed': statuses['invalid'] + statuses['not_found'],
+                        'results': results})
+
 # -------------------------------------------------------------------------------
 #  /questions/add (POST) accepts new question text, answer text and difficulty
 #  and category from the Add Question form in the user interface. If not all
@@ -298,11 +646,69 @@ def create_app(test_config=None):
             abort(422)
 
 
+# -------------------------------------------------------------------------------
+#  /questions/bulk (POST) adds many questions at once. The request body is
+#  read as a stream, either as JSON Lines (one question object per line,
+#  Content-Type application/x-ndjson) or as CSV with a header line
+#  (Content-Type text/csv), and inserted in batches of BULK_BATCH_SIZE, one
+#  transaction per batch. Rows that cannot be added are skipped and
+#  reported by line number
+# -------------------------------------------------------------------------------
+    @app.route('/questions/bulk', methods=['POST'])
+    def bulk_add_questions():
+
+        if request.mimetype in NDJSON_MIMETYPES:
+            rows = iter_ndjson_rows(request.stream)
+        elif request.mimetype in CSV_MIMETYPES:
+            rows = iter_csv_rows(request.stream)
+        else:
+            abort(400)
+
+        inserted, errors = import_questions(rows, clean_question_row)
+
+        return jsonify({'success': True,
+                        'inserted': inserted,
+                        'failed': len(errors),
+                        'errors': errors})
+
+# -------------------------------------------------------------------------------
+#  /questions/export (GET) streams every question in the database, in id
+#  order, as JSON Lines (the default), as CSV (?format=csv) or as a json
+#  array (?format=json). JSON Lines and CSV can be sent back to
+#  /questions/bulk
+# -------------------------------------------------------------------------------
+    @app.route('/questions/export')
+    def export_questions():
+        export_format = request.args.get('format', 'ndjson')
+
+        if export_format == 'ndjson':
+            body = export_ndjson(iter_export_rows())
+            mimetype = 'application/x-ndjson'
+        elif export_format == 'csv':
+            body = export_csv(iter_export_rows())
+            mimetype = 'text/csv'
+        elif export_format == 'json':
+            body = stream_json_array(iter_export_rows())
+            mimetype = 'application/json'
+        else:
+            abort(400)
+
+        filename = 'questions.{}'.format(export_format)
+        return Response(stream_with_context(body), mimetype=mimetype,
+                        headers={'Content-Disposition':
+                                 'attachment; filename=' + filename})
+
 # ---------------------------------------------------------------------------
 #  /quizzes (POST) returns a random question from the specified category
 #  (or from the general pool of questions if ALL is specified).
 #  Questions that have already been posed this session are omitted; they
-#  are passed in as previous_questions from the front-end
+#  are passed in as previous_questions from the front-end.
+#  The question is picked from the in-memory question index (see quiz.py),
+#  so only the chosen question is read from the database.
+#  With count (at most QUIZ_MAX_COUNT), up to that many distinct questions
+#  are returned at once, as a questions list, read with a single query.
+#  With difficulty (a difficulty, or {"min": <int>, "max": <int>}), only
+#  questions in that range are picked, and total_questions counts those
 # ---------------------------------------------------------------------------
     @app.route('/quizzes', methods=['POST'])
     def get_quiz_question():
@@ -313,59 +719,226 @@ def create_app(test_config=None):
             abort(400)
 
         quiz_cat = request.json['quiz_category']
-        quiz_category_id = quiz_cat['id']
+
+        # the front-end sends the category id as a string
+        try:
+            quiz_category_id = int(quiz_cat['id'])
+        except (KeyError, TypeError, ValueError):
+            abort(400)
 
         previous_questions = request.get_json()['previous_questions']
 
         if previous_questions is None:
             previous_questions = []
 
-        try:
-            if quiz_category_id == 0:  # if user selects All categories
-                questions = (
-                      Question.query
-                      .filter(~Question.id.in_(previous_questions)).all()
-                )
-                tot_questions = len(Question.query.all())
-            else:
-                questions = (
-                      Question.query
-                      .filter(Question.category == quiz_category_id)
-                      .filter(~Question.id.in_(previous_questions)).all()
-                )
-                tot_questions = (len(
-                          Question.query
-                          .filter(Question.category == quiz_category_id)
-                          .all())
-                )
+        difficulty = get_difficulty_range(request.json)
+        selector = RangeSelector(*difficulty) if difficulty else None
 
-        except DatabaseError:
-            app.logger.info("An error occurred on querying for quiz data.")
-            abort(422)
+        if 'count' in request.json:
+            try:
+                count = int(request.json['count'])
+            except (TypeError, ValueError):
+                abort(400)
+            if count < 1 or count > QUIZ_MAX_COUNT:
+                abort(400)
+
+            questions, tot_questions = get_random_questions(
+                quiz_category_id, previous_questions, count, selector)
+
+            return jsonify({'questions': [format_question(q)
+                                          for q in questions],
+                            'total_questions': tot_questions,
+                            'success': True})
+
+        question, tot_questions = get_random_question(quiz_category_id,
+                                                      previous_questions,
+                                                      selector)
 
         result = {}
-        if len(questions) == 0:
-            result['question'] = jsonify({'id': 0,
-                                          'question': '',
-                                          'answer': '',
-                                          'difficulty': -1,
-                                          'category': 0})
+        result['total_questions'] = tot_questions
+        result['success'] = True
+
+        if question is None:
+            result['question'] = {'id': 0,
+                                  'question': '',
+                                  'answer': '',
+                                  'difficulty': -1,
+                                  'category': 0}
             return jsonify(result)
 
-        result['total_questions'] = tot_questions
+        result['question'] = format_question(question)
+        return jsonify(result)
 
-        # if more than one question to choose from,
-        # then randomly select from the batch
-        if len(questions) > 1:
-            rand_idx = random.randint(0, len(questions)-1)
-            result['question'] = format_question(questions[rand_idx])
-            result['success'] = True
-            return jsonify(result)
+# ---------------------------------------------------------------------------
+#  /quizzes/sessions (POST) starts a quiz on the specified category (0 for
+#  ALL). The order the category's questions will be asked in is shuffled
+#  and kept on the server, so the front-end only has to send back the
+#  session_id to get each following question.
+#  With difficulty (as for /quizzes), only questions in that range are
+#  asked. With adaptive set, the questions are not ordered in advance:
+#  each one is picked at the session's target difficulty, which starts at
+#  difficulty (or ADAPTIVE_START_DIFFICULTY) and follows the answers
+#  reported to /quizzes/sessions/<session_id>/answers
+# ---------------------------------------------------------------------------
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def create_quiz_session():
+
+        if not request.json or 'quiz_category' not in request.json:
+            abort(400)
+
+        try:
+            quiz_category_id = int(request.json['quiz_category']['id'])
+        except (KeyError, TypeError, ValueError):
+            abort(400)
+
+        if quiz_category_id != 0 and not is_valid_category(quiz_category_id):
+            abort(404)
+
+        difficulty = get_difficulty_range(request.json)
+
+        if request.json.get('adaptive'):
+            start = difficulty[0] if difficulty else ADAPTIVE_START_DIFFICULTY
+            state = {'selector': AdaptiveSelector.name,
+                     'category': quiz_category_id,
+                     'start': start,
+                     'target': start,
+                     'asked': []}
+            session_id = quiz_sessions.create(quiz_category_id, [], state)
+
+            return jsonify({'success': True,
+                            'session_id': session_id,
+                            'total_questions':
+                                question_index.count(quiz_category_id)})
+
+        state = {}
+        if difficulty:
+            low, high = difficulty
+            state = {'selector': RangeSelector.name, 'min': low, 'max': high}
+            question_ids = [id for d in range(low, high + 1)
+                            for id in question_index.bucket(quiz_category_id,
+                                                            d)]
+        else:
+            question_ids = list(question_index.ids(quiz_category_id))
+        random.shuffle(question_ids)
+
+        session_id = quiz_sessions.create(quiz_category_id, question_ids,
+                                          state)
+
+        return jsonify({'success': True,
+                        'session_id': session_id,
+                        'total_questions': len(question_ids)})
+
+# ---------------------------------------------------------------------------
+#  /quizzes/sessions/<session_id>/next (GET) returns the next question of
+#  the quiz session, in the same format as /quizzes. Once every question
+#  has been asked, the empty question with id 0 is returned. An unknown or
+#  expired session returns 404
+# ---------------------------------------------------------------------------
+    @app.route('/quizzes/sessions/<session_id>/next')
+    def get_quiz_session_question(session_id):
+
+        try:
+            state = quiz_sessions.get_state(session_id)
+        except KeyError:
+            abort(404)
+
+        if state.get('selector') == AdaptiveSelector.name:
+            question = next_adaptive_question(state)
+            try:
+                quiz_sessions.set_state(session_id, state)
+            except KeyError:
+                abort(404)
+
+            tot_questions = question_index.count(state['category'])
+            remaining = 0
+            if question is not None:
+                remaining = max(tot_questions - len(state['asked']), 0)
         else:
-            result['question'] = format_question(questions[0])
-            result['success'] = True
+            question = None
+            while question is None:
+                try:
+                    question_id, tot_questions, remaining = (
+                        quiz_sessions.pop_next(session_id)
+                    )
+                except KeyError:
+                    abort(404)
+
+                if question_id is None:
+                    break
+
+                # None if the question was deleted since the session began
+                question = get_question(question_id)
+
+        result = {'total_questions': tot_questions,
+                  'remaining': remaining,
+                  'success': True}
+
+        if question is None:
+            result['question'] = {'id': 0,
+                                  'question': '',
+                                  'answer': '',
+                                  'difficulty': -1,
+                                  'category': 0}
             return jsonify(result)
 
+        result['question'] = format_question(question)
+        return jsonify(result)
+
+# ---------------------------------------------------------------------------
+#  /quizzes/sessions/<session_id>/answers (POST) reports whether the player
+#  answered a question of the session correctly ({"question_id": <int>,
+#  "correct": <bool>}). The session keeps the score, and adaptive sessions
+#  move their target difficulty up after a correct answer and down after a
+#  wrong one. An unknown or expired session, or question, returns 404
+# ---------------------------------------------------------------------------
+    @app.route('/quizzes/sessions/<session_id>/answers', methods=['POST'])
+    def report_quiz_session_answer(session_id):
+
+        if (not request.json or
+                'question_id' not in request.json or
+                not isinstance(request.json.get('correct'), bool)):
+            abort(400)
+
+        try:
+            question_id = int(request.json['question_id'])
+        except (TypeError, ValueError):
+            abort(400)
+        correct = request.json['correct']
+
+        try:
+            state = quiz_sessions.get_state(session_id)
+        except KeyError:
+            abort(404)
+
+        question = get_question(question_id)
+        if question is None:
+            abort(404)
+
+        create_selector(state).report(state, question.difficulty, correct)
+        state['answered'] = state.get('answered', 0) + 1
+        state['correct'] = state.get('correct', 0) + (1 if correct else 0)
+
+        try:
+            quiz_sessions.set_state(session_id, state)
+        except KeyError:
+            abort(404)
+
+        return jsonify({'success': True,
+                        'answered': state['answered'],
+                        'correct': state['correct'],
+                        'target_difficulty': state.get('target')})
+
+# ---------------------------------------------------------------------------
+#  /stats/pool (GET) reports the state of this process's database connection
+#  pool: connections in use and idle, and how many checkouts had to wait for
+#  a connection and for how long. Use it to size DB_POOL_SIZE and
+#  DB_MAX_OVERFLOW. With read replicas, it also shows which of them are up
+# ---------------------------------------------------------------------------
+    @app.route('/stats/pool')
+    def pool_stats():
+        return jsonify({'success': True,
+                        'pool': get_pool_stats()})
+
 # ---------------------------------------------------------------------------
 #  If user specifies a page beyond which there are questions, return a 404
 #  There is nothing defined at localhost:5000/, so that also returns 404
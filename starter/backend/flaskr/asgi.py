@@ -0,0 +1,422 @@
+import asyncio
+import logging
+import time
+
+import databases
+from sqlalchemy import and_, func, select, true
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from models import (get_database_path, ALL_CATEGORIES, Question, Category,
+                    QuestionCount)
+from .categories import format_categories, CATEGORY_CACHE_TTL
+from .pagination import encode_cursor, parse_cursor, QUESTIONS_PER_PAGE
+from .quiz import (index_by_category, pick_random_ids, QUESTION_INDEX_TTL,
+                   QUIZ_MAX_COUNT)
+from .quiz_selectors import (index_by_difficulty, select_ids, RangeSelector,
+                             parse_difficulty)
+from .search import search_clauses
+
+# ----------------------------------------------------------------------------
+#  An asyncio (ASGI) version of the read-only endpoints: /categories,
+#  /questions, /categories/<id>/questions, /questions/search and /quizzes.
+#  It uses the same tables (from models), the same query logic and the same
+#  json as the Flask app, but talks to the database through the databases
+#  package with an async driver (asyncpg for Postgres, aiosqlite for
+#  SQLite), so a slow query does not hold up a worker.
+#  The app is only built when create_asgi_app is called, so that importing
+#  this module needs no database driver. Run it with, for example:
+#      uvicorn flaskr.asgi:create_asgi_app --factory --workers 4
+#  and send writes to the Flask app. The extra dependencies are listed in
+#  requirements-async.txt
+# ----------------------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+
+questions = Question.__table__
+categories = Category.__table__
+question_counts = QuestionCount.__table__
+
+QUESTION_COLUMNS = [questions.c.id, questions.c.question, questions.c.answer,
+                    questions.c.difficulty, questions.c.category]
+
+ERROR_MESSAGES = {400: 'Bad request',
+                  404: 'Resource not found',
+                  422: 'Not processable'}
+
+
+# ----------------------------------------------------------------------------
+#  async_database_url: the databases package names the Postgres scheme
+#  postgresql://, where the Flask app also accepts postgres://
+# ----------------------------------------------------------------------------
+def async_database_url(database_path):
+    if database_path.startswith('postgres://'):
+        return 'postgresql://' + database_path[len('postgres://'):]
+    return database_path
+
+
+# ----------------------------------------------------------------------------
+#  format_question_row: Put a question row into key:value format, with the
+#  name of its category if include_category is set
+# ----------------------------------------------------------------------------
+def format_question_row(row, include_category=False):
+    formatted = {'id': row['id'],
+                 'question': row['question'],
+                 'answer': row['answer'],
+                 'difficulty': row['difficulty'],
+                 'category': row['category']}
+    if include_category:
+        formatted['category_type'] = row['category_type']
+    return formatted
+
+
+# ----------------------------------------------------------------------------
+#  select_questions: the async counterpart of question_listing; select the
+#  question columns, joining in the category name if include_category is set
+# ----------------------------------------------------------------------------
+def select_questions(include_category=False):
+    if not include_category:
+        return select(QUESTION_COLUMNS)
+    return (
+        select(QUESTION_COLUMNS + [categories.c.type.label('category_type')])
+        .select_from(questions.outerjoin(
+            categories, categories.c.id == questions.c.category))
+    )
+
+
+# ----------------------------------------------------------------------------
+#  TimedValue: a value loaded by an async function and kept for ttl
+#  seconds. Concurrent requests for a stale value wait for a single reload
+# ----------------------------------------------------------------------------
+class TimedValue:
+
+    def __init__(self, load, ttl):
+        self.load = load
+        self.ttl = ttl
+        self._value = None
+        self._loaded_at = None
+        # created on first use, inside the event loop that will run it
+        self._lock = None
+
+    def _is_fresh(self):
+        if self._loaded_at is None:
+            return False
+        if self.ttl is None:
+            return True
+        return time.monotonic() - self._loaded_at < self.ttl
+
+    async def get(self):
+        if self._is_fresh():
+            return self._value
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._is_fresh():
+                self._value = await self.load()
+                self._loaded_at = time.monotonic()
+        return self._value
+
+    def invalidate(self):
+        self._loaded_at = None
+
+
+# ----------------------------------------------------------------------------
+#  Row: lets format_categories read a databases record as c.id and c.type
+# ----------------------------------------------------------------------------
+class Row:
+
+    def __init__(self, record):
+        self._record = record
+
+    def __getattr__(self, name):
+        return self._record[name]
+
+
+def create_asgi_app(database_path=None, config=None):
+    config = config or {}
+    database_path = database_path or get_database_path()
+    database = databases.Database(async_database_url(database_path))
+    full_text = database.url.dialect == 'postgresql'
+
+    async def fetch(method, query):
+        try:
+            return await getattr(database, method)(query)
+        except HTTPException:
+            raise
+        except Exception:
+            logger.exception('An error occurred on querying the database.')
+            raise HTTPException(422)
+
+    async def load_categories():
+        rows = await fetch('fetch_all', select([categories.c.id,
+                                                categories.c.type])
+                           .order_by(categories.c.id))
+        return {'payload': format_categories([Row(r) for r in rows]),
+                'ids': frozenset(r['id'] for r in rows)}
+
+    async def load_question_index():
+        rows = await fetch('fetch_all', select([questions.c.id,
+                                                questions.c.category,
+                                                questions.c.difficulty])
+                           .order_by(questions.c.id))
+        return {'categories': index_by_category((r['id'], r['category'])
+                                                for r in rows),
+                'buckets': index_by_difficulty((r['id'], r['category'],
+                                                r['difficulty'])
+                                               for r in rows)}
+
+    # the ids picked from the question index, and how many they were picked
+    # from, as by quiz.pick_question_ids and quiz.count_questions
+    async def pick_ids(quiz_category_id, excluded, count, selector):
+        index = await question_index.get()
+        if selector is None:
+            ids = index['categories'].get(quiz_category_id, [])
+            return pick_random_ids(ids, excluded, count), len(ids)
+
+        def bucket(difficulty):
+            return index['buckets'].get((quiz_category_id, difficulty), [])
+        return (select_ids(selector, bucket, excluded, count),
+                selector.count(bucket))
+
+    category_cache = TimedValue(
+        load_categories,
+        config.get('CATEGORY_CACHE_TTL', CATEGORY_CACHE_TTL))
+    question_index = TimedValue(
+        load_question_index,
+        config.get('QUESTION_INDEX_TTL', QUESTION_INDEX_TTL))
+
+# ----------------------------------------------------------------------------
+#  questions_package: the async counterpart of get_questions_package. Counts
+#  the questions matching where, and returns the requested page of them
+#  (or, in cursor mode, the page after the cursor) in the same format.
+#  Listings give count_key, the question_counts row holding their total,
+#  which is only counted if the row is missing
+# ----------------------------------------------------------------------------
+    async def questions_package(where, cat, page, cursor=None,
+                                order_by=None, include_category=False,
+                                count_key=None):
+        total = None
+        if count_key is not None:
+            total = await fetch('fetch_val',
+                                select([question_counts.c.count])
+                                .where(question_counts.c.category ==
+                                       count_key))
+        if total is None:
+            total = await fetch('fetch_val',
+                                select([func.count()]).select_from(questions)
+                                                      .where(where))
+
+        next_cursor = None
+        if cursor is None:
+            if page is None or page < 1:
+                raise HTTPException(404)
+            startIdx = (page-1) * QUESTIONS_PER_PAGE
+            if startIdx > total:
+                raise HTTPException(404)
+
+            rows = await fetch('fetch_all',
+                               select_questions(include_category)
+                               .where(where)
+                               .order_by(*(order_by or [questions.c.id]))
+                               .offset(startIdx)
+                               .limit(QUESTIONS_PER_PAGE))
+        else:
+            try:
+                last_id = parse_cursor(cursor, cat)
+            except ValueError:
+                raise HTTPException(400)
+            if last_id is not None:
+                where = and_(where, questions.c.id > last_id)
+
+            rows = await fetch('fetch_all',
+                               select_questions(include_category)
+                               .where(where)
+                               .order_by(questions.c.id)
+                               .limit(QUESTIONS_PER_PAGE + 1))
+            if len(rows) > QUESTIONS_PER_PAGE:
+                rows = rows[:QUESTIONS_PER_PAGE]
+                next_cursor = encode_cursor(rows[-1]['id'], cat)
+
+        q_obj = {}
+        for i, row in enumerate(rows, 1):
+            q_obj[i] = format_question_row(row, include_category)
+
+        cached = await category_cache.get()
+        qresults = {'questions': q_obj,
+                    'total_questions': total,
+                    'categories': cached['payload'],
+                    'currentCategory': cat,
+                    'success': True}
+        if cursor is not None:
+            qresults['next_cursor'] = next_cursor
+
+        return JSONResponse(qresults)
+
+    def wants_category_types(request):
+        include = request.query_params.get('include', '')
+        return 'category' in include.split(',')
+
+    def get_page(request):
+        try:
+            return int(request.query_params.get('page', 1))
+        except ValueError:
+            return 1
+
+    async def get_categories(request):
+        cached = await category_cache.get()
+        return JSONResponse({'categories': cached['payload'],
+                             'success': True})
+
+    async def get_questions(request):
+        return await questions_package(true(), None, get_page(request),
+                                       request.query_params.get('cursor'),
+                                       include_category=wants_category_types(
+                                           request),
+                                       count_key=ALL_CATEGORIES)
+
+    async def get_questions_by_cat(request):
+        id = request.path_params['id']
+
+        cached = await category_cache.get()
+        if id not in cached['ids']:
+            raise HTTPException(404)
+
+        return await questions_package(questions.c.category == id, id,
+                                       get_page(request),
+                                       request.query_params.get('cursor'),
+                                       include_category=wants_category_types(
+                                           request),
+                                       count_key=id)
+
+    async def read_json(request):
+        try:
+            return await request.json()
+        except ValueError:
+            return None
+
+    async def search_questions(request):
+        body = await read_json(request)
+        if not isinstance(body, dict) or 'searchTerm' not in body:
+            raise HTTPException(400)
+
+        condition, order_by = search_clauses(body['searchTerm'],
+                                             bool(body.get('includeAnswers')),
+                                             full_text)
+        return await questions_package(condition, None, body.get('page', 1),
+                                       order_by=order_by,
+                                       include_category=wants_category_types(
+                                           request))
+
+    async def random_questions(quiz_category_id, excluded, count, selector):
+        found = []
+        for _ in range(2):
+            picked, total = await pick_ids(quiz_category_id, excluded,
+                                           count - len(found), selector)
+            if not picked:
+                break
+            rows = await fetch('fetch_all',
+                               select(QUESTION_COLUMNS)
+                               .where(questions.c.id.in_(picked)))
+            by_id = {row['id']: row for row in rows}
+            found.extend(by_id[id] for id in picked if id in by_id)
+            if len(rows) == len(picked):
+                break
+            # some questions were deleted since the index was loaded
+            excluded = excluded | set(picked)
+            question_index.invalidate()
+
+        picked, total = await pick_ids(quiz_category_id, excluded, 0,
+                                       selector)
+        return {'questions': [format_question_row(row) for row in found],
+                'total_questions': total,
+                'success': True}
+
+    async def get_quiz_question(request):
+        body = await read_json(request)
+        if (not isinstance(body, dict) or
+                'previous_questions' not in body or
+                'quiz_category' not in body):
+            raise HTTPException(400)
+
+        try:
+            quiz_category_id = int(body['quiz_category']['id'])
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(400)
+
+        excluded = set(body['previous_questions'] or [])
+
+        selector = None
+        if body.get('difficulty') is not None:
+            try:
+                selector = RangeSelector(*parse_difficulty(body['difficulty']))
+            except (TypeError, ValueError):
+                raise HTTPException(400)
+
+        if 'count' in body:
+            try:
+                count = int(body['count'])
+            except (TypeError, ValueError):
+                raise HTTPException(400)
+            if count < 1 or count > QUIZ_MAX_COUNT:
+                raise HTTPException(400)
+            return JSONResponse(await random_questions(quiz_category_id,
+                                                       excluded, count,
+                                                       selector))
+
+        row = None
+        for _ in range(2):
+            picked, total = await pick_ids(quiz_category_id, excluded, 1,
+                                           selector)
+            if not picked:
+                break
+            row = await fetch('fetch_one',
+                              select(QUESTION_COLUMNS)
+                              .where(questions.c.id == picked[0]))
+            if row is not None:
+                break
+            # the question was deleted since the index was loaded
+            question_index.invalidate()
+
+        result = {'total_questions': total,
+                  'success': True}
+        if row is None:
+            result['question'] = {'id': 0,
+                                  'question': '',
+                                  'answer': '',
+                                  'difficulty': -1,
+                                  'category': 0}
+        else:
+            result['question'] = format_question_row(row)
+        return JSONResponse(result)
+
+    async def http_error(request, exc):
+        return JSONResponse({'success': False,
+                             'error': exc.status_code,
+                             'message': ERROR_MESSAGES.get(exc.status_code,
+                                                           exc.detail)},
+                            status_code=exc.status_code)
+
+    routes = [
+        Route('/categories', get_categories),
+        Route('/categories/{id:int}/questions', get_questions_by_cat),
+        Route('/questions', get_questions),
+        Route('/questions/search', search_questions, methods=['POST']),
+        Route('/quizzes', get_quiz_question, methods=['POST']),
+    ]
+    middleware = [
+        Middleware(CORSMiddleware, allow_origins=['*'],
+                   allow_methods=['GET', 'POST', 'OPTIONS']),
+    ]
+
+    app = Starlette(routes=routes,
+                    middleware=middleware,
+                    exception_handlers={HTTPException: http_error},
+                    on_startup=[database.connect],
+                    on_shutdown=[database.disconnect])
+    app.state.database = database
+    return app
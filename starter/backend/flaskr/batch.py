@@ -0,0 +1,154 @@
+from collections import Counter
+
+from sqlalchemy import bindparam
+from sqlalchemy.exc import DatabaseError
+
+from models import db, bump_content_version, adjust_question_counts, Question
+from .suggest import suggestion_index
+
+# the most operations one /questions/batch request may hold
+BATCH_MAX_OPERATIONS = 10000
+
+# ids per SELECT or DELETE ... WHERE id IN (...), well under the number of
+# parameters a statement may have on SQLite
+BATCH_CHUNK_SIZE = 500
+
+BATCH_OPERATIONS = ('update', 'delete')
+
+
+def chunks(items, size=BATCH_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+# ----------------------------------------------------------------------------
+#  load_questions: the id, question and category of each of the questions
+#  with the given ids that exist, by id. The rows are locked (SELECT ... FOR
+#  UPDATE, where the database supports it) until the batch commits, so that
+#  they do not change in between
+# ----------------------------------------------------------------------------
+def load_questions(ids):
+    found = {}
+    for chunk in chunks(sorted(ids)):
+        rows = (
+            db.session.query(Question.id, Question.question,
+                             Question.category)
+                      .filter(Question.id.in_(chunk))
+                      .with_for_update()
+        )
+        found.update((row.id, row) for row in rows)
+    return found
+
+
+# ----------------------------------------------------------------------------
+#  plan_batch: check each operation ({"op": "update", "id": <int>,
+#  "changes": {...}} or {"op": "delete", "id": <int>}), cleaning the changes
+#  with clean(changes), which raises ValueError if they are not valid.
+#  Operations on the same question are combined in order: updates are
+#  merged, and a question deleted is not updated afterwards. Returns the
+#  result of each operation (so far), the changes to make to each question
+#  (None to delete it) and the current rows of those questions
+# ----------------------------------------------------------------------------
+def plan_batch(operations, clean):
+    results = []
+    checked = []
+    for index, operation in enumerate(operations):
+        result = {'index': index}
+        results.append(result)
+        try:
+            if not isinstance(operation, dict):
+                raise ValueError('expected a JSON object')
+            result['id'] = id = operation.get('id')
+            op = result['op'] = operation.get('op')
+            if op not in BATCH_OPERATIONS:
+                raise ValueError('op must be update or delete')
+            if not isinstance(id, int) or isinstance(id, bool):
+                raise ValueError('id must be an integer')
+            changes = (clean(operation.get('changes')) if op == 'update'
+                       else None)
+        except ValueError as e:
+            result.update(status='invalid', error=str(e))
+            continue
+        checked.append((result, id, changes))
+
+    rows = load_questions({id for _, id, _ in checked})
+    planned = {}
+    for result, id, changes in checked:
+        if id not in rows or (id in planned and planned[id] is None):
+            result.update(status='not_found',
+                          error='no question with id {}'.format(id))
+            continue
+        if changes is None:
+            planned[id] = None
+            result['status'] = 'deleted'
+        else:
+            planned[id] = dict(planned.get(id) or {}, **changes)
+            result['status'] = 'updated'
+
+    return results, planned, rows
+
+
+# ----------------------------------------------------------------------------
+#  apply_batch: make the planned changes (see plan_batch) in one transaction:
+#  one DELETE per BATCH_CHUNK_SIZE questions deleted, and one executemany
+#  UPDATE per set of columns changed, along with the question counts they
+#  change. The suggestion index is updated once the transaction commits.
+#  Raises DatabaseError (after rolling back) if the database rejects them
+# ----------------------------------------------------------------------------
+def apply_batch(planned, rows):
+    table = Question.__table__
+    deleted = sorted(id for id, changes in planned.items() if changes is None)
+    updates = {}
+    for id, changes in sorted(planned.items()):
+        if changes is not None:
+            params = {'new_' + column: value
+                      for column, value in changes.items()}
+            params['question_id'] = id
+            updates.setdefault(tuple(sorted(changes)), []).append(params)
+
+    counts = Counter()
+    added = []
+    removed = []
+    for id, changes in planned.items():
+        row = rows[id]
+        if changes is None:
+            counts[row.category] -= 1
+            removed.append(row.question)
+            continue
+        if changes.get('category', row.category) != row.category:
+            counts[row.category] -= 1
+            counts[changes['category']] += 1
+        if changes.get('question', row.question) != row.question:
+            removed.append(row.question)
+            added.append(changes['question'])
+
+    try:
+        for chunk in chunks(deleted):
+            db.session.execute(table.delete().where(table.c.id.in_(chunk)))
+        for columns, params in updates.items():
+            db.session.execute(
+                table.update()
+                     .where(table.c.id == bindparam('question_id'))
+                     .values({column: bindparam('new_' + column)
+                              for column in columns}),
+                params)
+        adjust_question_counts(db.session, counts)
+        db.session.commit()
+    except DatabaseError:
+        db.session.rollback()
+        raise
+
+    suggestion_index.update(added, removed)
+    if planned:
+        bump_content_version()
+
+
+# ----------------------------------------------------------------------------
+#  run_batch: check and apply a list of operations (see plan_batch and
+#  apply_batch). Returns the result of each one: its index in the list, id,
+#  op and status (updated, deleted, not_found or invalid, with an error)
+# ----------------------------------------------------------------------------
+def run_batch(operations, clean):
+    results, planned, rows = plan_batch(operations, clean)
+    apply_batch(planned, rows)
+    return results
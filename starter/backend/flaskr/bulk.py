@@ -0,0 +1,162 @@
+import csv
+import io
+import json
+from collections import Counter
+
+from sqlalchemy.exc import DatabaseError
+
+from models import (db, bump_content_version, adjust_question_counts,
+                    Question)
+from .suggest import suggestion_index
+
+BULK_BATCH_SIZE = 1000
+EXPORT_FIELDS = ['id', 'question', 'answer', 'difficulty', 'category']
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonl',
+                    'application/x-jsonlines')
+CSV_MIMETYPES = ('text/csv',)
+
+
+# ----------------------------------------------------------------------------
+#  iter_ndjson_rows: read one JSON object per line from a binary stream,
+#  yielding (line number, row) pairs. A line that is not a JSON object is
+#  yielded as (line number, ValueError) so it can be reported and skipped
+#  without stopping the import
+# ----------------------------------------------------------------------------
+def iter_ndjson_rows(stream):
+    line_no = 0
+    for line in stream:
+        line_no += 1
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line.decode('utf-8'))
+        except ValueError as e:
+            yield line_no, ValueError('invalid JSON: {}'.format(e))
+            continue
+        if not isinstance(row, dict):
+            yield line_no, ValueError('expected a JSON object')
+            continue
+        yield line_no, row
+
+
+# ----------------------------------------------------------------------------
+#  iter_csv_rows: read rows from a binary CSV stream whose first line names
+#  the columns, yielding (line number, row) pairs
+# ----------------------------------------------------------------------------
+def iter_csv_rows(stream):
+    lines = (line.decode('utf-8') for line in stream)
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, row
+
+
+# ----------------------------------------------------------------------------
+#  insert_batch: insert a batch of cleaned rows with a single executemany
+#  INSERT and commit it, along with the question counts it changes, then add
+#  its questions to the suggestion index. If the batch fails, it is retried
+#  one row at a time so that only the rows the database rejects are
+#  reported.
+#  Returns the number of rows inserted
+# ----------------------------------------------------------------------------
+def insert_batch(batch, errors):
+    table = Question.__table__
+    try:
+        db.session.execute(table.insert(), [row for _, row in batch])
+        adjust_question_counts(db.session, Counter(row.get('category')
+                                                   for _, row in batch))
+        db.session.commit()
+        suggestion_index.update(added=[row.get('question')
+                                       for _, row in batch])
+        bump_content_version()
+        return len(batch)
+    except DatabaseError:
+        db.session.rollback()
+
+    inserted = 0
+    for line_no, row in batch:
+        try:
+            db.session.execute(table.insert(), row)
+            adjust_question_counts(db.session, {row.get('category'): 1})
+            db.session.commit()
+            suggestion_index.update(added=[row.get('question')])
+            inserted += 1
+        except DatabaseError as e:
+            db.session.rollback()
+            errors.append({'line': line_no,
+                           'error': 'database error: {}'.format(e.orig)})
+    if inserted:
+        bump_content_version()
+    return inserted
+
+
+# ----------------------------------------------------------------------------
+#  import_questions: insert questions from (line number, row) pairs, in
+#  transactions of batch_size rows. clean(row) must return the column
+#  values to insert, or raise ValueError if the row is not a valid question.
+#  Returns the number of questions inserted, and a list of the rows that
+#  were not, with the reason for each
+# ----------------------------------------------------------------------------
+def import_questions(rows, clean, batch_size=BULK_BATCH_SIZE):
+    inserted = 0
+    errors = []
+    batch = []
+
+    for line_no, row in rows:
+        if isinstance(row, Exception):
+            errors.append({'line': line_no, 'error': str(row)})
+            continue
+        try:
+            batch.append((line_no, clean(row)))
+        except ValueError as e:
+            errors.append({'line': line_no, 'error': str(e)})
+            continue
+
+        if len(batch) >= batch_size:
+            inserted += insert_batch(batch, errors)
+            batch = []
+
+    if batch:
+        inserted += insert_batch(batch, errors)
+
+    return inserted, errors
+
+
+# ----------------------------------------------------------------------------
+#  iter_export_rows: yield every question as a dict, in id order. Rows are
+#  read through a server-side cursor, batch_size at a time, so the whole
+#  question bank is never held in memory
+# ----------------------------------------------------------------------------
+def iter_export_rows(batch_size=BULK_BATCH_SIZE):
+    columns = [getattr(Question, field) for field in EXPORT_FIELDS]
+    rows = (
+        db.session.query(*columns)
+                  .order_by(Question.id)
+                  .execution_options(stream_results=True)
+                  .yield_per(batch_size)
+    )
+    for row in rows:
+        yield dict(zip(EXPORT_FIELDS, row))
+
+
+# ----------------------------------------------------------------------------
+#  export_ndjson / export_csv: encode the exported questions one line at a
+#  time, for use as a streaming response body
+# ----------------------------------------------------------------------------
+def export_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+def export_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
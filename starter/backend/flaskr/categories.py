@@ -0,0 +1,107 @@
+import threading
+import time
+
+from flask import abort
+from sqlalchemy.exc import DatabaseError
+
+from models import Category
+
+CATEGORY_CACHE_TTL = 300
+
+
+# ----------------------------------------------------------------------------
+#  format_categories: given the categories, in id order, return the
+#  categories object the endpoints send, using index as key
+# ----------------------------------------------------------------------------
+def format_categories(categories):
+    i = 1
+    cat_obj = {}
+    for c in categories:
+        cat_obj[i] = c.type
+        i = i+1
+    return cat_obj
+
+
+# ----------------------------------------------------------------------------
+#  CategoryRegistry: a process-local copy of the categories table.
+#  Categories rarely change, so rather than running Category.query.all()
+#  every time categories are needed, they are loaded once and kept here
+#  until the registry is invalidated or ttl seconds have passed (a ttl of
+#  None keeps them until invalidated). Valid ids are held in a set for
+#  O(1) validation, and the categories object returned by the endpoints is
+#  built once per load.
+#  hits and misses count the lookups that were answered from memory and
+#  those that had to go to the database. generation counts the loads, so
+#  it changes whenever the categories may have changed
+# ----------------------------------------------------------------------------
+class CategoryRegistry:
+
+    def __init__(self, ttl=CATEGORY_CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._ids = frozenset()
+        self._payload = {}
+
+    def _is_fresh(self):
+        if self._loaded_at is None:
+            return False
+        if self.ttl is None:
+            return True
+        return time.monotonic() - self._loaded_at < self.ttl
+
+    def _load(self):
+        try:
+            categories = Category.query.order_by(Category.id).all()
+        except DatabaseError:
+            abort(422)
+
+        self._ids = frozenset(c.id for c in categories)
+        self._payload = format_categories(categories)
+        self._loaded_at = time.monotonic()
+        self.generation += 1
+
+    def _ensure_loaded(self):
+        if self._is_fresh():
+            self.hits += 1
+            return
+
+        with self._lock:
+            # another thread may have reloaded while we waited for the lock
+            if self._is_fresh():
+                self.hits += 1
+                return
+            self.misses += 1
+            self._load()
+
+    def payload(self):
+        self._ensure_loaded()
+        return self._payload
+
+    def is_valid(self, id):
+        self._ensure_loaded()
+        return id in self._ids
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._ids),
+                'ttl': self.ttl}
+
+
+category_registry = CategoryRegistry()
+
+
+# ----------------------------------------------------------------------------
+#  invalidate_categories: drop the cached categories so that the next lookup
+#  reloads them from the database. Call this after categories are edited
+# ----------------------------------------------------------------------------
+def invalidate_categories():
+    category_registry.invalidate()
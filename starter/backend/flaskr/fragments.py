@@ -0,0 +1,145 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from models import on_content_change
+from .metrics import current_stats
+from .snapshot import on_snapshot_reload
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FRAGMENT_CACHE_SIZE = 10000
+
+# made once: json.dumps builds a new encoder on every call it is given
+# options for
+COMPACT_ENCODER = json.JSONEncoder(sort_keys=True, separators=(',', ':'))
+
+
+# ----------------------------------------------------------------------------
+#  encode_json: the compact json (as bytes, keys sorted as jsonify sorts
+#  them) of a question dict. orjson is used if it is installed, since it
+#  is several times faster than the json module; both give the same json,
+#  except that orjson writes non-ASCII characters as UTF-8 rather than
+#  \u escapes
+# ----------------------------------------------------------------------------
+def encode_json(value):
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+    return COMPACT_ENCODER.encode(value).encode('utf-8')
+
+
+# the other, small values of a response, with the json module, which sorts
+# integer keys (such as the categories') as numbers, as jsonify does
+def encode_small(value):
+    return COMPACT_ENCODER.encode(value).encode('utf-8')
+
+
+# adds the time since start to the json encoding time of the request
+def record_json_time(start):
+    stats = current_stats()
+    if stats is not None:
+        stats.json_duration += time.perf_counter() - start
+
+
+# ----------------------------------------------------------------------------
+#  FragmentCache: the encoded json of recently served questions, so that a
+#  page of questions is put together from bytes already encoded instead of
+#  formatting and encoding every question again. Entries are keyed by the
+#  row itself (every column read, id included) and whether the category
+#  name is included, so a question changed since it was cached, by this
+#  process or any other, is read back as a different row and encoded
+#  again; it can never be served from an old entry. Every entry is dropped
+#  when this process adds or deletes questions, and the least recently
+#  used are dropped beyond max_entries (0 turns the cache off)
+# ----------------------------------------------------------------------------
+class FragmentCache:
+
+    def __init__(self, max_entries=FRAGMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    # ----------------------------------------------------------------------
+    #  fragments: the encoded json of each of the rows, with
+    #  format_question(row, include_category) giving the dict to encode for
+    #  the rows that are not cached
+    # ----------------------------------------------------------------------
+    def fragments(self, rows, format_question, include_category=False):
+        start = time.perf_counter()
+        try:
+            return self._fragments(rows, format_question, include_category)
+        finally:
+            record_json_time(start)
+
+    def _fragments(self, rows, format_question, include_category):
+        if not self.max_entries:
+            return [encode_json(format_question(row, include_category))
+                    for row in rows]
+
+        keys = [(tuple(row), include_category) for row in rows]
+        with self._lock:
+            found = [self._entries.get(key) for key in keys]
+            for key, fragment in zip(keys, found):
+                if fragment is not None:
+                    self._entries.move_to_end(key)
+
+        encoded = []
+        for i, row in enumerate(rows):
+            if found[i] is None:
+                found[i] = encode_json(format_question(row, include_category))
+                encoded.append((keys[i], found[i]))
+
+        with self._lock:
+            self.hits += len(rows) - len(encoded)
+            self.misses += len(encoded)
+            for key, fragment in encoded:
+                self._entries[key] = fragment
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return found
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'max_entries': self.max_entries}
+
+
+fragment_cache = FragmentCache()
+on_content_change(fragment_cache.clear)
+on_snapshot_reload(fragment_cache.clear)
+
+
+# ----------------------------------------------------------------------------
+#  encode_questions_package: the json body of a page of questions, as
+#  get_questions_package returns it, assembled from the encoded questions
+#  (fragments). The keys are in the order jsonify sorts them in. The time
+#  taken counts as json encoding time in the request metrics
+# ----------------------------------------------------------------------------
+def encode_questions_package(fragments, total, categories, cat,
+                             next_cursor=None, cursor_mode=False):
+    start = time.perf_counter()
+
+    parts = [b'{"categories":', encode_small(categories),
+             b',"currentCategory":', encode_small(cat)]
+    if cursor_mode:
+        parts += [b',"next_cursor":', encode_small(next_cursor)]
+    parts.append(b',"questions":{')
+    parts.append(b','.join(b'"%d":%s' % (i, fragment)
+                           for i, fragment in enumerate(fragments, 1)))
+    parts += [b'},"success":true,"total_questions":',
+              str(total).encode('ascii'), b'}\n']
+    body = b''.join(parts)
+
+    record_json_time(start)
+    return body
@@ -0,0 +1,171 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import request, g
+
+from models import get_content_version, on_content_change
+from .snapshot import question_snapshot, on_snapshot_reload
+
+HTTP_CACHE_SIZE = 256
+HTTP_CACHE_MAX_AGE = 0
+HTTP_CACHE_TTL = 60
+
+# The GET endpoints whose responses only change when the questions or the
+# categories change
+CACHEABLE_ENDPOINTS = ('get_categories', 'get_questions',
+                       'get_questions_by_cat')
+
+# Content versions are counted separately by each server process, so the
+# ETags of each process include an id of their own. A version number from
+# one process then never matches the same number from another
+PROCESS_TAG = uuid.uuid4().hex[:8]
+
+
+# ----------------------------------------------------------------------------
+#  ResponseCache: a least recently used cache of response bodies, holding
+#  at most max_entries of them. Entries are keyed on the request url and
+#  the ETag it was served with, so entries for old content are never
+#  served; they are dropped as the cache fills up, or all at once by clear().
+#  renew() also changes the ETag, for when the data served changes without
+#  a write (a snapshot reload).
+#  Only the changes this process makes change the ETag at once, so the ETag
+#  also changes every ttl seconds (see period): a change made by another
+#  process is served, and revalidated, at most ttl seconds later. A ttl of
+#  None keeps the ETag until this process changes the data
+# ----------------------------------------------------------------------------
+class ResponseCache:
+
+    def __init__(self, max_entries=HTTP_CACHE_SIZE, ttl=HTTP_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    # the number of the current ttl second period, counted from the epoch
+    # so that every process changes period at the same time
+    def period(self):
+        if not self.ttl:
+            return 0
+        return int(time.time() // self.ttl)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def renew(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'max_entries': self.max_entries}
+
+
+response_cache = ResponseCache()
+on_content_change(response_cache.clear)
+on_snapshot_reload(response_cache.renew)
+
+
+# ----------------------------------------------------------------------------
+#  current_etag: the ETag of every cacheable response in the current state
+#  of the data, built from the content version counter, the category
+#  registry's generation and the response cache's generation and period
+# ----------------------------------------------------------------------------
+def current_etag(category_registry):
+    # make sure the registry (and, in snapshot mode, the snapshot) is up to
+    # date before reading the generations
+    category_registry.payload()
+    if question_snapshot.enabled:
+        question_snapshot.data()
+    return '{}-{}-{}-{}-{}'.format(PROCESS_TAG, get_content_version(),
+                                   category_registry.generation,
+                                   response_cache.generation,
+                                   response_cache.period())
+
+
+# ----------------------------------------------------------------------------
+#  cache_control: the Cache-Control header sent with cacheable responses.
+#  With the default max_age of 0, clients have to revalidate each time,
+#  which costs a 304 with no body when nothing has changed
+# ----------------------------------------------------------------------------
+def cache_control(max_age):
+    if max_age:
+        return 'public, max-age={}'.format(max_age)
+    return 'public, no-cache'
+
+
+# ----------------------------------------------------------------------------
+#  cached_response: called before a request is dispatched. For a cacheable
+#  GET, answers 304 if the client already has the current version of the
+#  response (If-None-Match), or returns the cached response if there is
+#  one. Returns None when the request has to be handled by its view
+# ----------------------------------------------------------------------------
+def cached_response(app, category_registry):
+    if (request.method not in ('GET', 'HEAD') or
+            request.endpoint not in CACHEABLE_ENDPOINTS):
+        return None
+
+    etag = current_etag(category_registry)
+    g.http_cache_etag = etag
+    max_age = app.config.get('HTTP_CACHE_MAX_AGE', HTTP_CACHE_MAX_AGE)
+
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        entry = response_cache.get((request.full_path, etag))
+        if entry is None:
+            return None
+        body, mimetype = entry
+        response = app.response_class(body, mimetype=mimetype)
+
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = cache_control(max_age)
+    g.http_cache_hit = True
+    return response
+
+
+# ----------------------------------------------------------------------------
+#  cache_response: called after a request. Adds the ETag and Cache-Control
+#  headers to a successful cacheable response, and keeps its body in the
+#  response cache. Streamed responses are passed through untouched
+# ----------------------------------------------------------------------------
+def cache_response(app, response):
+    etag = g.get('http_cache_etag')
+    if (etag is None or g.get('http_cache_hit') or
+            response.status_code != 200 or response.is_streamed):
+        return response
+
+    max_age = app.config.get('HTTP_CACHE_MAX_AGE', HTTP_CACHE_MAX_AGE)
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = cache_control(max_age)
+
+    response_cache.put((request.full_path, etag),
+                       (response.get_data(), response.mimetype))
+    return response
@@ -0,0 +1,328 @@
+import cProfile
+import json
+import os
+import tempfile
+import threading
+import time
+
+from flask import request, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PROFILE_HEADER = 'X-Profile'
+
+# Upper bounds, in seconds, of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                    10.0)
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+
+# ----------------------------------------------------------------------------
+#  EndpointMetrics: totals for the requests to one endpoint: how many there
+#  were (by method and status), how long they took, how many SQL queries
+#  they made and rows those returned, and the time spent in SQL and in
+#  encoding json
+# ----------------------------------------------------------------------------
+class EndpointMetrics:
+
+    def __init__(self):
+        self.requests = {}
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.count = 0
+        self.duration = 0.0
+        self.sql_queries = 0
+        self.sql_duration = 0.0
+        self.sql_rows = 0
+        self.json_duration = 0.0
+
+    def record(self, method, status, duration, stats):
+        key = (method, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if duration <= bound:
+                self.buckets[i] += 1
+        self.count += 1
+        self.duration += duration
+        self.sql_queries += stats.sql_queries
+        self.sql_duration += stats.sql_duration
+        self.sql_rows += stats.sql_rows
+        self.json_duration += stats.json_duration
+
+
+# ----------------------------------------------------------------------------
+#  RequestStats: what the current request has done so far. One is kept on g
+#  for each request while metrics are enabled
+# ----------------------------------------------------------------------------
+class RequestStats:
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_queries = 0
+        self.sql_duration = 0.0
+        self.sql_rows = 0
+        self.json_duration = 0.0
+
+
+# ----------------------------------------------------------------------------
+#  RequestMetrics: the EndpointMetrics of every endpoint, kept for the life
+#  of the server process
+# ----------------------------------------------------------------------------
+class RequestMetrics:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, method, status, duration, stats):
+        with self._lock:
+            metrics = self._endpoints.get(endpoint)
+            if metrics is None:
+                metrics = self._endpoints[endpoint] = EndpointMetrics()
+            metrics.record(method, status, duration, stats)
+
+    def endpoints(self):
+        with self._lock:
+            return sorted(self._endpoints.items())
+
+    def clear(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+request_metrics = RequestMetrics()
+
+
+def current_stats():
+    if not has_app_context():
+        return None
+    return g.get('request_stats')
+
+
+# ----------------------------------------------------------------------------
+#  SQL instrumentation: engine events that add the time and rows of every
+#  statement to the stats of the request that ran it. Rows are counted as
+#  the database driver reports them; psycopg2 reports the rows a SELECT
+#  returned, while SQLite reports none
+# ----------------------------------------------------------------------------
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if current_stats() is not None:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    stats = current_stats()
+    starts = conn.info.get('query_start')
+    if stats is None or not starts:
+        return
+    stats.sql_queries += 1
+    stats.sql_duration += time.perf_counter() - starts.pop()
+    if cursor.rowcount > 0:
+        stats.sql_rows += cursor.rowcount
+
+
+def install_sql_events():
+    if not event.contains(Engine, 'before_cursor_execute',
+                          before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+
+# ----------------------------------------------------------------------------
+#  TimedJSONEncoder: the app's json encoder, adding the time jsonify spends
+#  encoding to the stats of the current request
+# ----------------------------------------------------------------------------
+class TimedJSONEncoder(json.JSONEncoder):
+
+    def encode(self, o):
+        start = time.perf_counter()
+        try:
+            return super().encode(o)
+        finally:
+            stats = current_stats()
+            if stats is not None:
+                stats.json_duration += time.perf_counter() - start
+
+
+# ----------------------------------------------------------------------------
+#  server_timing: the Server-Timing header of a response, which shows the
+#  time the request spent in SQL and json encoding in the browser's
+#  developer tools
+# ----------------------------------------------------------------------------
+def server_timing(stats, duration):
+    return ('sql;dur={:.2f};desc="{} queries", json;dur={:.2f}, '
+            'total;dur={:.2f}'.format(1000 * stats.sql_duration,
+                                      stats.sql_queries,
+                                      1000 * stats.json_duration,
+                                      1000 * duration))
+
+
+# ----------------------------------------------------------------------------
+#  Request profiling: a request sent with the X-Profile header is run under
+#  a profiler, and the profile is written to the PROFILE_DIR directory. The
+#  name of the file is returned in the X-Profile-File response header.
+#  pyinstrument, a sampling profiler, is used if it is installed (giving a
+#  .txt call tree); otherwise cProfile is (giving a .prof file to open with
+#  pstats or snakeviz)
+# ----------------------------------------------------------------------------
+def start_profile():
+    if Profiler is not None:
+        profiler = Profiler()
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    g.profiler = profiler
+
+
+def stop_profile(app):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return None
+
+    directory = app.config.get('PROFILE_DIR') or tempfile.gettempdir()
+    name = 'trivia-{}-{}'.format(request.endpoint or 'unknown',
+                                 int(time.time() * 1000))
+    if Profiler is not None:
+        profiler.stop()
+        path = os.path.join(directory, name + '.txt')
+        with open(path, 'w') as f:
+            f.write(profiler.output_text())
+    else:
+        profiler.disable()
+        path = os.path.join(directory, name + '.prof')
+        profiler.dump_stats(path)
+    return path
+
+
+# ----------------------------------------------------------------------------
+#  format_metrics: the metrics in the Prometheus text exposition format.
+#  caches maps a cache name to its stats() method; pool_stats returns the
+#  connection pool's stats
+# ----------------------------------------------------------------------------
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def format_metrics(caches, pool_stats):
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for labels, value in samples:
+            label_text = ','.join('{}="{}"'.format(k, v) for k, v in labels)
+            lines.append('{}{{{}}} {}'.format(name, label_text, value)
+                         if label_text else '{} {}'.format(name, value))
+
+    endpoints = request_metrics.endpoints()
+
+    metric('trivia_requests_total', 'counter',
+           'Requests handled, by endpoint, method and status.',
+           [((('endpoint', endpoint), ('method', method),
+              ('status', status)), count)
+            for endpoint, m in endpoints
+            for (method, status), count in sorted(m.requests.items())])
+
+    lines.append('# HELP trivia_request_duration_seconds Time taken to '
+                 'handle requests, by endpoint.')
+    lines.append('# TYPE trivia_request_duration_seconds histogram')
+    for endpoint, m in endpoints:
+        for bound, count in zip(DURATION_BUCKETS + ('+Inf',),
+                                m.buckets + [m.count]):
+            lines.append('trivia_request_duration_seconds_bucket{{'
+                         'endpoint="{}",le="{}"}} {}'.format(endpoint, bound,
+                                                             count))
+        lines.append('trivia_request_duration_seconds_sum{{endpoint="{}"}} '
+                     '{}'.format(endpoint, m.duration))
+        lines.append('trivia_request_duration_seconds_count{{endpoint="{}"}}'
+                     ' {}'.format(endpoint, m.count))
+
+    for name, attr, help_text in (
+            ('trivia_sql_queries_total', 'sql_queries',
+             'SQL statements executed, by endpoint.'),
+            ('trivia_sql_duration_seconds_total', 'sql_duration',
+             'Time spent executing SQL, by endpoint.'),
+            ('trivia_sql_rows_total', 'sql_rows',
+             'Rows returned or changed by SQL statements, by endpoint.'),
+            ('trivia_json_encode_seconds_total', 'json_duration',
+             'Time spent encoding json responses, by endpoint.')):
+        metric(name, 'counter', help_text,
+               [((('endpoint', endpoint),), getattr(m, attr))
+                for endpoint, m in endpoints])
+
+    cache_samples = {}
+    for cache, stats in sorted(caches.items()):
+        for key, value in sorted(stats().items()):
+            if is_number(value):
+                cache_samples.setdefault(key, []).append(
+                    ((('cache', cache),), value))
+    for key, samples in sorted(cache_samples.items()):
+        metric('trivia_cache_{}'.format(key), 'gauge',
+               'The {} of the in-process caches.'.format(key), samples)
+
+    for key, value in sorted(pool_stats().items()):
+        if is_number(value):
+            metric('trivia_db_pool_{}'.format(key), 'gauge',
+                   'The {} of the database connection pool.'.format(key),
+                   [((), value)])
+
+    return '\n'.join(lines) + '\n'
+
+
+# ----------------------------------------------------------------------------
+#  init_metrics: instrument the app. Each request's duration, SQL queries,
+#  SQL rows and time and json encoding time are added to the totals of its
+#  endpoint and reported in its Server-Timing header. The totals, and the
+#  stats of the caches, are served at /metrics in the Prometheus format.
+#  With PROFILE_REQUESTS set, requests with the X-Profile header are
+#  profiled as well
+# ----------------------------------------------------------------------------
+def init_metrics(app, caches, pool_stats):
+    install_sql_events()
+    app.json_encoder = TimedJSONEncoder
+
+    @app.before_request
+    def before_request_metrics():
+        g.request_stats = RequestStats()
+        if (app.config.get('PROFILE_REQUESTS') and
+                PROFILE_HEADER in request.headers):
+            start_profile()
+
+    @app.after_request
+    def after_request_metrics(response):
+        stats = g.pop('request_stats', None)
+        if stats is None:
+            return response
+
+        profile_path = stop_profile(app)
+        if profile_path is not None:
+            response.headers['X-Profile-File'] = profile_path
+
+        # the time to produce a streamed body is not included
+        duration = time.perf_counter() - stats.start
+        request_metrics.record(request.endpoint or 'unknown',
+                               request.method, response.status_code,
+                               duration, stats)
+        response.headers['Server-Timing'] = server_timing(stats, duration)
+        return response
+
+    @app.teardown_request
+    def teardown_request_metrics(exc):
+        # stop a profiler left running by a request that raised
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            if Profiler is not None:
+                profiler.stop()
+            else:
+                profiler.disable()
+
+    @app.route('/metrics')
+    def metrics():
+        return app.response_class(format_metrics(caches, pool_stats),
+                                  mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,184 @@
+import base64
+import json
+
+from flask import abort
+from sqlalchemy import func
+from sqlalchemy.exc import DatabaseError
+
+from models import db, Question, Category
+
+QUESTIONS_PER_PAGE = 10
+
+QUESTION_COLUMNS = [Question.id, Question.question, Question.answer,
+                    Question.difficulty, Question.category]
+
+
+# ----------------------------------------------------------------------------
+#  question_listing: a query for the columns of questions rather than for
+#  Question objects, used by the listing endpoints. The rows it returns are
+#  plain tuples (read as q.id, q.question, ...), so no ORM objects are built
+#  or tracked for them
+# ----------------------------------------------------------------------------
+def question_listing():
+    return db.session.query(*QUESTION_COLUMNS)
+
+
+# ----------------------------------------------------------------------------
+#  with_category_types: add the name of each question's category, as
+#  category_type, to a question_listing query. The categories table is
+#  outer joined, so the names come back in the same query. Only the page of
+#  rows is fetched with the join; counting is done without it
+# ----------------------------------------------------------------------------
+def with_category_types(query):
+    return (
+        query.add_columns(Category.type.label('category_type'))
+             .outerjoin(Category, Category.id == Question.category)
+    )
+
+
+# ----------------------------------------------------------------------------
+#  count_questions: return the number of rows the given query would produce.
+#  The count is issued as its own SELECT count(*) rather than fetching the
+#  rows, and any ORDER BY on the query is dropped since it cannot change the
+#  result
+# ----------------------------------------------------------------------------
+def count_questions(query):
+    return (
+        query.order_by(None)
+             .with_entities(func.count(Question.id))
+             .scalar()
+    )
+
+
+# ----------------------------------------------------------------------------
+#  paginate_query: given a Question query (not yet executed), return the
+#  questions on the requested page along with the total number of
+#  matching questions. Only one page of rows is ever fetched from the
+#  database, using LIMIT/OFFSET. If no ordering was supplied by the caller,
+#  questions are ordered by id so that pages are stable between requests.
+#  A page beyond the last page of results aborts with a 404.
+#  With include_category, the page's rows include category_type (see
+#  with_category_types). The total is counted with count_questions unless
+#  count is given: a function returning it without counting the rows, or
+#  None if it does not know it (see models.get_question_count). It is
+#  called along with the other queries, so that a database error aborts
+#  with a 422 as theirs do
+# ----------------------------------------------------------------------------
+def paginate_query(query, page, per_page=QUESTIONS_PER_PAGE, order_by=None,
+                   include_category=False, count=None):
+    if page is None or page < 1:
+        abort(404)
+
+    startIdx = (page-1) * per_page
+
+    try:
+        total = count() if count is not None else None
+        if total is None:
+            total = count_questions(query)
+
+        if startIdx > total:
+            abort(404)
+
+        if order_by is None:
+            order_by = [Question.id]
+
+        if include_category:
+            query = with_category_types(query)
+
+        questions = (
+            query.order_by(*order_by)
+                 .offset(startIdx)
+                 .limit(per_page)
+                 .all()
+        )
+    except DatabaseError:
+        abort(422)
+
+    return questions, total
+
+
+# ----------------------------------------------------------------------------
+#  encode_cursor: build the opaque cursor handed back to clients in cursor
+#  mode. It records the id of the last question on the page, and the
+#  category the listing was filtered on (None for all categories)
+# ----------------------------------------------------------------------------
+def encode_cursor(last_id, cat):
+    payload = json.dumps({'id': last_id, 'cat': cat}, separators=(',', ':'))
+    token = base64.urlsafe_b64encode(payload.encode('utf-8'))
+    return token.decode('ascii').rstrip('=')
+
+
+# ----------------------------------------------------------------------------
+#  parse_cursor: return the last seen question id from a cursor produced by
+#  encode_cursor, or None for an empty cursor. Raises ValueError if the
+#  cursor cannot be decoded or was issued for a different category listing
+# ----------------------------------------------------------------------------
+def parse_cursor(cursor, cat):
+    if not cursor:
+        return None
+
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        last_id = payload['id']
+        cursor_cat = payload['cat']
+    except (ValueError, TypeError, KeyError):
+        raise ValueError('invalid cursor')
+
+    # bools are ints in Python, and True would equal category 1
+    if (not isinstance(last_id, int) or isinstance(last_id, bool) or
+            isinstance(cursor_cat, bool) or cursor_cat != cat):
+        raise ValueError('invalid cursor')
+
+    return last_id
+
+
+# ----------------------------------------------------------------------------
+#  decode_cursor: parse_cursor for the views; an empty cursor starts from
+#  the beginning, and an invalid one aborts with a 400
+# ----------------------------------------------------------------------------
+def decode_cursor(cursor, cat):
+    try:
+        return parse_cursor(cursor, cat)
+    except ValueError:
+        abort(400)
+
+
+# ----------------------------------------------------------------------------
+#  paginate_by_cursor: keyset pagination. Rather than skipping over
+#  (page-1) * per_page rows with OFFSET, resume directly after the last
+#  question id recorded in the cursor, so that the cost of fetching a page
+#  does not depend on how deep into the listing it is. One extra row is
+#  fetched to find out whether there is a following page; next_cursor is
+#  None once the listing is exhausted. As for paginate_query, a count
+#  function may be given for the total
+# ----------------------------------------------------------------------------
+def paginate_by_cursor(query, cursor, cat, per_page=QUESTIONS_PER_PAGE,
+                       include_category=False, count=None):
+    last_id = decode_cursor(cursor, cat)
+
+    try:
+        total = count() if count is not None else None
+        if total is None:
+            total = count_questions(query)
+
+        page_query = query
+        if last_id is not None:
+            page_query = page_query.filter(Question.id > last_id)
+        if include_category:
+            page_query = with_category_types(page_query)
+
+        questions = (
+            page_query.order_by(Question.id)
+                      .limit(per_page + 1)
+                      .all()
+        )
+    except DatabaseError:
+        abort(422)
+
+    next_cursor = None
+    if len(questions) > per_page:
+        questions = questions[:per_page]
+        next_cursor = encode_cursor(questions[-1].id, cat)
+
+    return questions, total, next_cursor
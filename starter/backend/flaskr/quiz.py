@@ -0,0 +1,281 @@
+import random
+import threading
+import time
+
+from flask import abort
+from sqlalchemy.exc import DatabaseError
+
+from models import db, on_content_change, Question
+from .pagination import question_listing
+from .snapshot import question_snapshot
+from .quiz_selectors import (index_by_difficulty, create_selector,
+                             select_ids, RANDOM_PICK_ATTEMPTS)
+
+QUESTION_INDEX_TTL = 60
+
+# the most questions one /quizzes request may ask for with count
+QUIZ_MAX_COUNT = 50
+
+
+# ----------------------------------------------------------------------------
+#  index_by_category: given (id, category) rows in id order, return a dict
+#  of the question ids of each category, plus all ids under category 0
+# ----------------------------------------------------------------------------
+def index_by_category(rows):
+    by_category = {0: []}
+    for id, category in rows:
+        by_category[0].append(id)
+        if category is not None:
+            by_category.setdefault(int(category), []).append(id)
+    return by_category
+
+
+# ----------------------------------------------------------------------------
+#  QuestionIndex: a process-local index of question ids by category, and by
+#  (category, difficulty) bucket, used to pick quiz questions. In snapshot
+#  mode the ids come from the snapshot (see snapshot.py). Otherwise only the
+#  id, category and difficulty columns are loaded, once, and kept until the
+#  index is invalidated or ttl seconds have passed (a ttl of None keeps the
+#  index until invalidated). The index is invalidated whenever this process
+#  changes the questions.
+#  Category 0 stands for all categories, as it does in /quizzes
+# ----------------------------------------------------------------------------
+class QuestionIndex:
+
+    def __init__(self, ttl=QUESTION_INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._by_category = {}
+        self._buckets = {}
+
+    def _is_fresh(self):
+        if self._loaded_at is None:
+            return False
+        if self.ttl is None:
+            return True
+        return time.monotonic() - self._loaded_at < self.ttl
+
+    def _load(self):
+        try:
+            rows = (
+                db.session.query(Question.id, Question.category,
+                                 Question.difficulty)
+                          .order_by(Question.id)
+                          .all()
+            )
+        except DatabaseError:
+            abort(422)
+
+        self._by_category = index_by_category((id, category)
+                                              for id, category, _ in rows)
+        self._buckets = index_by_difficulty(rows)
+        self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self._is_fresh():
+            return
+
+        with self._lock:
+            if not self._is_fresh():
+                self._load()
+
+    def ids(self, category_id):
+        if question_snapshot.enabled:
+            return question_snapshot.data().category_ids(category_id)
+        self._ensure_loaded()
+        return self._by_category.get(category_id, [])
+
+    def bucket(self, category_id, difficulty):
+        if question_snapshot.enabled:
+            return question_snapshot.data().bucket(category_id, difficulty)
+        self._ensure_loaded()
+        return self._buckets.get((category_id, difficulty), [])
+
+    def count(self, category_id):
+        return len(self.ids(category_id))
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def stats(self):
+        return {'size': len(self._by_category.get(0, [])),
+                'ttl': self.ttl}
+
+
+question_index = QuestionIndex()
+on_content_change(question_index.invalidate)
+
+
+# ----------------------------------------------------------------------------
+#  get_question: return the question with the given id, or None if there is
+#  none; from the snapshot in snapshot mode, otherwise from the database
+# ----------------------------------------------------------------------------
+def get_question(id):
+    if question_snapshot.enabled:
+        return question_snapshot.data().row(id)
+
+    try:
+        return Question.query.get(id)
+    except DatabaseError:
+        abort(422)
+
+
+# ----------------------------------------------------------------------------
+#  pick_random_ids: pick up to n distinct random question ids from ids that
+#  are not in excluded (a set), in the order they were drawn. While most
+#  questions are still available, a few random draws will find them without
+#  looking at the rest of ids; the list of remaining ids is only built if
+#  the draws keep hitting excluded or already chosen ids
+# ----------------------------------------------------------------------------
+def pick_random_ids(ids, excluded, n):
+    chosen = []
+    seen = set()
+    if not ids or n <= 0:
+        return chosen
+
+    for _ in range(n * RANDOM_PICK_ATTEMPTS):
+        id = random.choice(ids)
+        if id not in excluded and id not in seen:
+            chosen.append(id)
+            seen.add(id)
+            if len(chosen) == n:
+                return chosen
+
+    remaining = [id for id in ids if id not in excluded and id not in seen]
+    chosen.extend(random.sample(remaining, min(n - len(chosen),
+                                               len(remaining))))
+    return chosen
+
+
+# ----------------------------------------------------------------------------
+#  category_bucket: a function giving the ids of the category's questions
+#  of a difficulty, from the question index, as quiz selectors take it
+# ----------------------------------------------------------------------------
+def category_bucket(category_id):
+    def bucket(difficulty):
+        return question_index.bucket(category_id, difficulty)
+    return bucket
+
+
+# ----------------------------------------------------------------------------
+#  count_questions: how many questions of the category pick_question_ids
+#  picks from, with the quiz selector if one is given
+# ----------------------------------------------------------------------------
+def count_questions(category_id, selector=None):
+    if selector is None:
+        return question_index.count(category_id)
+    return selector.count(category_bucket(category_id))
+
+
+# ----------------------------------------------------------------------------
+#  pick_question_ids: pick up to count distinct random ids of questions of
+#  the category that are not in excluded, with the quiz selector if one is
+#  given (see quiz_selectors.py), otherwise from all the category's
+#  questions
+# ----------------------------------------------------------------------------
+def pick_question_ids(category_id, excluded, count, selector=None):
+    if selector is None:
+        return pick_random_ids(question_index.ids(category_id), excluded,
+                               count)
+
+    return select_ids(selector, category_bucket(category_id), excluded,
+                      count)
+
+
+# ----------------------------------------------------------------------------
+#  get_random_questions: return up to count distinct random questions (as
+#  question_listing rows) from the category (0 for all categories) that are
+#  not in previous_questions, along with the total number of questions in
+#  the category (or that the selector picks from). The ids are drawn from
+#  the question index, and the chosen questions are then read with a single
+#  id IN (...) query
+# ----------------------------------------------------------------------------
+def get_random_questions(category_id, previous_questions, count,
+                         selector=None):
+    excluded = set(previous_questions)
+    questions = []
+
+    for _ in range(2):
+        picked = pick_question_ids(category_id, excluded,
+                                   count - len(questions), selector)
+        if not picked:
+            break
+
+        if question_snapshot.enabled:
+            data = question_snapshot.data()
+            rows = [row for row in map(data.row, picked) if row is not None]
+        else:
+            try:
+                rows = (
+                    question_listing().filter(Question.id.in_(picked)).all()
+                )
+            except DatabaseError:
+                abort(422)
+
+        by_id = {row.id: row for row in rows}
+        questions.extend(by_id[id] for id in picked if id in by_id)
+        if len(rows) == len(picked):
+            break
+
+        # some questions were deleted since the index was loaded
+        excluded.update(picked)
+        question_index.invalidate()
+
+    return questions, count_questions(category_id, selector)
+
+
+# ----------------------------------------------------------------------------
+#  get_random_question: return a random Question from the category (0 for
+#  all categories) that is not in previous_questions, or None if there are
+#  none left, along with the total number of questions in the category (or
+#  that the selector picks from). Only the chosen question is fetched from
+#  the database
+# ----------------------------------------------------------------------------
+def get_random_question(category_id, previous_questions, selector=None):
+    excluded = set(previous_questions)
+
+    for _ in range(2):
+        picked = pick_question_ids(category_id, excluded, 1, selector)
+        if not picked:
+            return None, count_questions(category_id, selector)
+
+        question = get_question(picked[0])
+        if question is not None:
+            return question, count_questions(category_id, selector)
+
+        # the question was deleted since the index was loaded
+        question_index.invalidate()
+
+    return None, count_questions(category_id, selector)
+
+
+# ----------------------------------------------------------------------------
+#  next_adaptive_question: return the next Question of an adaptive quiz
+#  session, picked by the session's selector from the questions of its
+#  category that it has not asked yet, or None once every one has been
+#  asked. state is the session state, which is updated with the question
+#  asked; the caller saves it
+# ----------------------------------------------------------------------------
+def next_adaptive_question(state):
+    category_id = state['category']
+    selector = create_selector(state)
+    excluded = set(state['asked'])
+    bucket = category_bucket(category_id)
+
+    for _ in range(2):
+        id = selector.select(bucket, excluded, state)
+        if id is None:
+            return None
+
+        question = get_question(id)
+        if question is not None:
+            state['asked'].append(id)
+            return question
+
+        # the question was deleted since the index was loaded
+        excluded.add(id)
+        question_index.invalidate()
+
+    return None
@@ -0,0 +1,171 @@
+import random
+
+MOST_DIFFICULT_RATING = 5
+DIFFICULTIES = tuple(range(1, MOST_DIFFICULT_RATING + 1))
+
+# how many random draws to try before falling back to building the list of
+# questions that have not been asked yet
+RANDOM_PICK_ATTEMPTS = 8
+
+
+# ----------------------------------------------------------------------------
+#  index_by_difficulty: given (id, category, difficulty) rows in id order,
+#  return a dict of the question ids of each (category, difficulty) bucket,
+#  with every category's questions also under category 0
+# ----------------------------------------------------------------------------
+def index_by_difficulty(rows):
+    buckets = {}
+    for id, category, difficulty in rows:
+        buckets.setdefault((0, difficulty), []).append(id)
+        if category is not None:
+            buckets.setdefault((int(category), difficulty), []).append(id)
+    return buckets
+
+
+# ----------------------------------------------------------------------------
+#  pick_from_buckets: pick a random id from the buckets (lists of ids) that
+#  is not in excluded (a set), or return None if every id has been
+#  excluded. Each id is equally likely whatever bucket it is in: a random
+#  position is drawn over all the buckets, then looked up in them. Only
+#  when the draws keep hitting excluded ids is the list of remaining ids
+#  built
+# ----------------------------------------------------------------------------
+def pick_from_buckets(buckets, excluded):
+    total = sum(len(bucket) for bucket in buckets)
+    if not total:
+        return None
+
+    for _ in range(RANDOM_PICK_ATTEMPTS):
+        position = random.randrange(total)
+        for bucket in buckets:
+            if position < len(bucket):
+                id = bucket[position]
+                break
+            position -= len(bucket)
+        if id not in excluded:
+            return id
+
+    remaining = [id for bucket in buckets for id in bucket
+                 if id not in excluded]
+    if not remaining:
+        return None
+    return random.choice(remaining)
+
+
+# ----------------------------------------------------------------------------
+#  Quiz selectors.
+#  A selector picks the next question of a quiz from the question ids of
+#  the quiz category, bucketed by difficulty. Selectors implement:
+#    select(bucket, excluded, state) -> question id, or None if none is left
+#        bucket(difficulty) returns the ids of the category's questions of
+#        that difficulty; excluded is the set of ids already asked
+#    report(state, difficulty, correct)
+#        record whether the question just asked, of the given difficulty,
+#        was answered correctly
+#    count(bucket) -> how many questions the selector can pick from
+#  state is a json-serializable dict kept with the quiz session, where a
+#  selector keeps whatever it needs between questions
+# ----------------------------------------------------------------------------
+
+
+# ----------------------------------------------------------------------------
+#  RangeSelector: picks uniformly among the questions whose difficulty is
+#  between min_difficulty and max_difficulty (by default, all of them)
+# ----------------------------------------------------------------------------
+class RangeSelector:
+
+    name = 'range'
+
+    def __init__(self, min_difficulty=1, max_difficulty=MOST_DIFFICULT_RATING):
+        self.difficulties = [d for d in DIFFICULTIES
+                             if min_difficulty <= d <= max_difficulty]
+
+    def select(self, bucket, excluded, state):
+        return pick_from_buckets([bucket(d) for d in self.difficulties],
+                                 excluded)
+
+    def report(self, state, difficulty, correct):
+        pass
+
+    def count(self, bucket):
+        return sum(len(bucket(d)) for d in self.difficulties)
+
+
+# ----------------------------------------------------------------------------
+#  AdaptiveSelector: a staircase. Questions are picked at the session's
+#  target difficulty, which starts at start_difficulty and goes up by one
+#  after each correct answer and down by one after each wrong one. When no
+#  question is left at the target, the nearest difficulty that has one is
+#  used (the easier one first)
+# ----------------------------------------------------------------------------
+class AdaptiveSelector:
+
+    name = 'adaptive'
+
+    def __init__(self, start_difficulty=2):
+        self.start_difficulty = start_difficulty
+
+    def target(self, state):
+        return state.get('target', self.start_difficulty)
+
+    def select(self, bucket, excluded, state):
+        target = self.target(state)
+        for difficulty in sorted(DIFFICULTIES,
+                                 key=lambda d: (abs(d - target), d)):
+            id = pick_from_buckets([bucket(difficulty)], excluded)
+            if id is not None:
+                return id
+        return None
+
+    def report(self, state, difficulty, correct):
+        step = 1 if correct else -1
+        state['target'] = min(max(self.target(state) + step, 1),
+                              MOST_DIFFICULT_RATING)
+
+    def count(self, bucket):
+        return sum(len(bucket(d)) for d in DIFFICULTIES)
+
+
+# ----------------------------------------------------------------------------
+#  select_ids: pick up to count distinct ids with the selector, none of them
+#  in excluded, for a quiz that keeps no state between questions
+# ----------------------------------------------------------------------------
+def select_ids(selector, bucket, excluded, count):
+    picked = []
+    excluded = set(excluded)
+    while len(picked) < count:
+        id = selector.select(bucket, excluded, {})
+        if id is None:
+            break
+        picked.append(id)
+        excluded.add(id)
+    return picked
+
+
+# ----------------------------------------------------------------------------
+#  parse_difficulty: read the difficulty option of /quizzes and
+#  /quizzes/sessions: a single difficulty, or {"min": <int>, "max": <int>}
+#  (either may be left out). Returns (min, max); raises ValueError if the
+#  option is not valid
+# ----------------------------------------------------------------------------
+def parse_difficulty(value):
+    if isinstance(value, dict):
+        low = int(value.get('min', 1))
+        high = int(value.get('max', MOST_DIFFICULT_RATING))
+    else:
+        low = high = int(value)
+    if not 1 <= low <= high <= MOST_DIFFICULT_RATING:
+        raise ValueError('invalid difficulty range')
+    return low, high
+
+
+# ----------------------------------------------------------------------------
+#  create_selector: the selector for a quiz, from its session state
+#  ({'selector': 'adaptive', 'start': <int>} or {'selector': 'range',
+#  'min': <int>, 'max': <int>}); a range over every difficulty by default
+# ----------------------------------------------------------------------------
+def create_selector(state):
+    if state.get('selector') == AdaptiveSelector.name:
+        return AdaptiveSelector(state.get('start', 2))
+    return RangeSelector(state.get('min', 1),
+                         state.get('max', MOST_DIFFICULT_RATING))
@@ -0,0 +1,167 @@
+import json
+import threading
+import time
+import uuid
+
+QUIZ_SESSION_TTL = 3600
+
+
+# ----------------------------------------------------------------------------
+#  Quiz session stores.
+#  A quiz session holds the question ids still to be asked, in the (already
+#  shuffled) order they will be asked in, plus the category, the total
+#  number of questions, and a state dict (json-serializable) where the
+#  session's quiz selector keeps the score and whatever else it needs.
+#  Stores implement:
+#    create(category_id, question_ids, state=None) -> session id
+#    pop_next(session_id) -> (question id or None, total, remaining)
+#    get_state(session_id) -> the state dict
+#    set_state(session_id, state)
+#  all but create raising KeyError if there is no such session (or it has
+#  expired). pop_next is O(1) in the number of questions asked so far
+# ----------------------------------------------------------------------------
+
+
+# ----------------------------------------------------------------------------
+#  MemorySessionStore: keeps sessions in a dict in this process. Sessions
+#  are only visible to the process that created them, so this store is
+#  meant for development and single-process deployments
+# ----------------------------------------------------------------------------
+class MemorySessionStore:
+
+    def __init__(self, ttl=QUIZ_SESSION_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def _expire(self, now):
+        expired = [session_id
+                   for session_id, session in self._sessions.items()
+                   if session['expires'] <= now]
+        for session_id in expired:
+            del self._sessions[session_id]
+
+    def create(self, category_id, question_ids, state=None):
+        session_id = uuid.uuid4().hex
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            # ids are stored last to first so that pop_next can pop them
+            # off the end of the list
+            self._sessions[session_id] = {
+                'category': category_id,
+                'total': len(question_ids),
+                'order': list(reversed(question_ids)),
+                'state': dict(state or {}),
+                'expires': now + self.ttl}
+        return session_id
+
+    # the session, its expiry pushed back; the lock must be held
+    def _get(self, session_id):
+        now = time.monotonic()
+        session = self._sessions.get(session_id)
+        if session is None or session['expires'] <= now:
+            raise KeyError(session_id)
+        session['expires'] = now + self.ttl
+        return session
+
+    def pop_next(self, session_id):
+        with self._lock:
+            session = self._get(session_id)
+            order = session['order']
+            question_id = order.pop() if order else None
+            return question_id, session['total'], len(order)
+
+    def get_state(self, session_id):
+        with self._lock:
+            return dict(self._get(session_id)['state'])
+
+    def set_state(self, session_id, state):
+        with self._lock:
+            self._get(session_id)['state'] = dict(state)
+
+
+# ----------------------------------------------------------------------------
+#  RedisSessionStore: keeps sessions in Redis, so that they are shared by
+#  every worker process. client can be a redis.Redis instance or anything
+#  with the same get/set/rpush/lpop/llen/expire methods (such as
+#  fakeredis.FakeRedis in tests). Each session is stored under three keys:
+#  a JSON blob with the category and total, a list of the remaining ids,
+#  and a JSON blob with the state
+# ----------------------------------------------------------------------------
+class RedisSessionStore:
+
+    def __init__(self, client, ttl=QUIZ_SESSION_TTL,
+                 prefix='trivia:quiz_session:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _keys(self, session_id):
+        key = self.prefix + session_id
+        return key + ':meta', key + ':order', key + ':state'
+
+    def create(self, category_id, question_ids, state=None):
+        session_id = uuid.uuid4().hex
+        meta_key, order_key, state_key = self._keys(session_id)
+
+        meta = json.dumps({'category': category_id,
+                           'total': len(question_ids)})
+        self.client.set(meta_key, meta, ex=self.ttl)
+        self.client.set(state_key, json.dumps(state or {}), ex=self.ttl)
+        if question_ids:
+            self.client.rpush(order_key, *question_ids)
+            self.client.expire(order_key, self.ttl)
+        return session_id
+
+    def pop_next(self, session_id):
+        meta_key, order_key, state_key = self._keys(session_id)
+
+        meta = self.client.get(meta_key)
+        if meta is None:
+            raise KeyError(session_id)
+        meta = json.loads(meta)
+
+        self.client.expire(meta_key, self.ttl)
+        self.client.expire(order_key, self.ttl)
+        self.client.expire(state_key, self.ttl)
+
+        question_id = self.client.lpop(order_key)
+        if question_id is not None:
+            question_id = int(question_id)
+        return question_id, meta['total'], self.client.llen(order_key)
+
+    def get_state(self, session_id):
+        state = self.client.get(self._keys(session_id)[2])
+        if state is None:
+            raise KeyError(session_id)
+        return json.loads(state)
+
+    def set_state(self, session_id, state):
+        # xx: only while the session exists
+        if not self.client.set(self._keys(session_id)[2], json.dumps(state),
+                               ex=self.ttl, xx=True):
+            raise KeyError(session_id)
+
+
+# ----------------------------------------------------------------------------
+#  create_session_store: build the session store named by the
+#  QUIZ_SESSION_STORE setting: 'memory' (the default), or a redis:// URL.
+#  A store object may also be given directly.
+#  The redis package is only needed when a Redis store is configured
+# ----------------------------------------------------------------------------
+def create_session_store(config):
+    store = config.get('QUIZ_SESSION_STORE', 'memory')
+    ttl = config.get('QUIZ_SESSION_TTL', QUIZ_SESSION_TTL)
+
+    if not isinstance(store, str):
+        return store
+
+    if store == 'memory':
+        return MemorySessionStore(ttl=ttl)
+
+    if store.startswith('redis://') or store.startswith('rediss://'):
+        import redis
+        return RedisSessionStore(redis.Redis.from_url(store), ttl=ttl)
+
+    raise ValueError('Unknown QUIZ_SESSION_STORE: {}'.format(store))
@@ -0,0 +1,64 @@
+import time
+
+from flask import request
+
+from models import db, replica_set
+
+# The endpoints that only read from the database. Their queries go to a
+# read replica, when there are replicas (see models.ReplicaSet)
+READ_ONLY_ENDPOINTS = ('get_categories', 'get_questions',
+                       'get_questions_by_cat', 'search_questions',
+                       'suggest_questions', 'export_questions',
+                       'get_quiz_question', 'create_quiz_session',
+                       'get_quiz_session_question')
+
+# The endpoints that write to the database
+WRITE_ENDPOINTS = ('delete_question', 'update_question',
+                   'batch_update_questions', 'add_new_questions',
+                   'bulk_add_questions')
+
+# Set on the responses to writes: until the time it holds, the client's
+# reads go to the primary, so that it sees its own writes even if the
+# replicas have not caught up with them yet
+READ_YOUR_WRITES_COOKIE = 'trivia_read_primary'
+
+
+# ----------------------------------------------------------------------------
+#  pinned_to_primary: whether the client has written recently enough that
+#  its reads must go to the primary
+# ----------------------------------------------------------------------------
+def pinned_to_primary():
+    try:
+        until = float(request.cookies.get(READ_YOUR_WRITES_COOKIE, 0))
+    except ValueError:
+        return False
+    return until > time.time()
+
+
+# ----------------------------------------------------------------------------
+#  init_read_routing: send the database reads of read-only requests to a
+#  read replica, unless the client is pinned to the primary, and pin the
+#  clients that write to the primary for READ_YOUR_WRITES_SECONDS. Set up
+#  before anything else that reads from the database in a request
+# ----------------------------------------------------------------------------
+def init_read_routing(app):
+
+    @app.before_request
+    def before_request_routing():
+        if (request.endpoint not in READ_ONLY_ENDPOINTS or
+                pinned_to_primary()):
+            return
+        replica = replica_set.choose(app)
+        if replica is not None:
+            db.session.info['replica'] = replica
+
+    @app.after_request
+    def after_request_routing(response):
+        if (replica_set.names and request.endpoint in WRITE_ENDPOINTS and
+                response.status_code < 400):
+            seconds = replica_set.read_your_writes_seconds
+            response.set_cookie(READ_YOUR_WRITES_COOKIE,
+                                str(time.time() + seconds),
+                                max_age=int(seconds) + 1, httponly=True,
+                                samesite='Lax')
+        return response
@@ -0,0 +1,96 @@
+import re
+
+from sqlalchemy import func, literal_column
+
+from models import db, Question
+
+# The 'simple' text search configuration lowercases words but neither stems
+# them nor drops stop words, which keeps full text matching close to the
+# substring matching users are used to. It must agree with the expression
+# indexes created in migrations/versions/0001_search_index.py
+SEARCH_CONFIG = literal_column("'simple'::regconfig")
+
+SEARCH_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+# ----------------------------------------------------------------------------
+#  get_term: given a Search Term, return a lower case version, enclosed with %
+# ----------------------------------------------------------------------------
+def get_term(term):
+    term_lower = term.lower()
+    term_lower = '%' + term_lower + '%'
+    return term_lower
+
+
+# ----------------------------------------------------------------------------
+#  get_tsquery_text: turn a user supplied search term into to_tsquery syntax,
+#  in which every word of the term must appear as a prefix of some word in
+#  the document, so that typing "scis" already finds "Scissorhands".
+#  Punctuation is dropped; None is returned if no words remain
+# ----------------------------------------------------------------------------
+def get_tsquery_text(term):
+    words = SEARCH_WORD.findall(term.lower())
+    if not words:
+        return None
+    return ' & '.join(word + ':*' for word in words)
+
+
+# ----------------------------------------------------------------------------
+#  search_document: the tsvector searched for a question. The expression has
+#  to match the one the GIN indexes were built on for Postgres to use them
+# ----------------------------------------------------------------------------
+def search_document(include_answers):
+    text = func.coalesce(Question.question, literal_column("''"))
+    if include_answers:
+        text = (text.op('||')(literal_column("' '"))
+                    .op('||')(func.coalesce(Question.answer,
+                                            literal_column("''"))))
+    return func.to_tsvector(SEARCH_CONFIG, text)
+
+
+# ----------------------------------------------------------------------------
+#  uses_full_text_search: full text search is only available on Postgres.
+#  Other databases, such as the SQLite databases used in some tests, fall
+#  back to ILIKE matching
+# ----------------------------------------------------------------------------
+def uses_full_text_search():
+    return db.engine.dialect.name == 'postgresql'
+
+
+# ----------------------------------------------------------------------------
+#  search_clauses: return the condition that selects the questions matching
+#  term, and the ordering to page through them with. With full_text set
+#  (on Postgres) the term is matched against an indexed tsvector and results
+#  are ranked, best match first. Otherwise (or for a term with no words in
+#  it) the question text is matched with ILIKE and results are ordered by
+#  id. If include_answers is set, the answer text is searched as well
+# ----------------------------------------------------------------------------
+def search_clauses(term, include_answers=False, full_text=True):
+    tsquery_text = get_tsquery_text(term)
+
+    if tsquery_text is None or not full_text:
+        search_term = get_term(term)
+        condition = Question.question.ilike(search_term)
+        if include_answers:
+            condition = condition | Question.answer.ilike(search_term)
+        return condition, [Question.id]
+
+    document = search_document(include_answers)
+    tsquery = func.to_tsquery(SEARCH_CONFIG, tsquery_text)
+
+    condition = document.op('@@')(tsquery)
+    order_by = [func.ts_rank(document, tsquery).desc(), Question.id]
+    return condition, order_by
+
+
+# ----------------------------------------------------------------------------
+#  search_questions_query: return a query for the questions matching term,
+#  and the ordering to page through them with (see search_clauses). The
+#  condition is added to query, Question.query by default
+# ----------------------------------------------------------------------------
+def search_questions_query(term, include_answers=False, query=None):
+    condition, order_by = search_clauses(term, include_answers,
+                                         uses_full_text_search())
+    if query is None:
+        query = Question.query
+    return query.filter(condition), order_by
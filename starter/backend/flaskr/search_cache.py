@@ -0,0 +1,220 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from models import on_content_change
+from .search import get_term
+from .snapshot import on_snapshot_reload
+
+SEARCH_CACHE_BYTES = 8 * 1024 * 1024
+SEARCH_CACHE_TTL = 300
+
+
+# ----------------------------------------------------------------------------
+#  Search cache backends.
+#  A backend keeps encoded search results (strings) under string keys, and
+#  implements:
+#    get(key) -> the string stored under key, or None
+#    put(key, value)
+#    clear() -> drop every entry
+#    clear_local() -> drop the entries kept in this process
+# ----------------------------------------------------------------------------
+
+
+# ----------------------------------------------------------------------------
+#  MemorySearchBackend: a least recently used cache in this process, holding
+#  at most max_bytes of results. The least recently used entries are
+#  dropped to make room for new ones, and every entry expires ttl seconds
+#  after it is stored (None keeps it until it is dropped). clear() only
+#  reaches this process, so the ttl bounds how long the other processes
+#  serve results from before a change
+# ----------------------------------------------------------------------------
+class MemorySearchBackend:
+
+    def __init__(self, max_bytes=SEARCH_CACHE_BYTES, ttl=SEARCH_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and time.monotonic() >= expires:
+                del self._entries[key]
+                self.size -= len(value)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self._entries[key] = (value, expires)
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, (dropped, _) = self._entries.popitem(last=False)
+                self.size -= len(dropped)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    clear_local = clear
+
+    def stats(self):
+        return {'entries': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes}
+
+
+# ----------------------------------------------------------------------------
+#  RedisSearchBackend: keeps results in Redis, shared by every worker
+#  process, in front of a small MemorySearchBackend in each process. client
+#  can be a redis.Redis instance or anything with the same get/set/incr
+#  methods (such as fakeredis.FakeRedis in tests).
+#  Keys include a generation number kept in Redis; clear() increments it,
+#  so a write in any process invalidates the results cached by all of them.
+#  Old entries are left to expire after ttl seconds (Redis' maxmemory
+#  policy bounds the space they take until then). The local entries are
+#  keyed on the generation as well, so they are never served once stale
+# ----------------------------------------------------------------------------
+class RedisSearchBackend:
+
+    def __init__(self, client, ttl=SEARCH_CACHE_TTL,
+                 local_bytes=SEARCH_CACHE_BYTES // 8,
+                 prefix='trivia:search:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.local = MemorySearchBackend(local_bytes, ttl)
+
+    def _key(self, key):
+        generation = self.client.get(self.prefix + 'generation')
+        if isinstance(generation, bytes):
+            generation = generation.decode('ascii')
+        return '{}{}:{}'.format(self.prefix, generation or 0, key)
+
+    def get(self, key):
+        key = self._key(key)
+        value = self.local.get(key)
+        if value is not None:
+            return value
+
+        value = self.client.get(key)
+        if value is None:
+            return None
+        value = value.decode('utf-8')
+        self.local.put(key, value)
+        return value
+
+    def put(self, key, value):
+        key = self._key(key)
+        self.client.set(key, value, ex=self.ttl)
+        self.local.put(key, value)
+
+    def clear(self):
+        self.client.incr(self.prefix + 'generation')
+        self.local.clear()
+
+    def clear_local(self):
+        self.local.clear()
+
+    def stats(self):
+        return self.local.stats()
+
+
+# ----------------------------------------------------------------------------
+#  SearchCache: caches the pages of search results, each under the search
+#  term (normalized as by get_term), the page number, and the search
+#  options. get returns {'questions': [<question dict>, ...],
+#  'total_questions': <int>}. The results are kept by the configured
+#  backend (None turns the cache off). Every entry is dropped when this
+#  process adds, changes or deletes questions
+# ----------------------------------------------------------------------------
+class SearchCache:
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(term, page, include_answers, include_category):
+        return json.dumps([get_term(term), page, include_answers,
+                           include_category], separators=(',', ':'))
+
+    def get(self, key):
+        if self.backend is None:
+            return None
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    # questions: the encoded json of each question of the page, as bytes
+    def put(self, key, questions, total):
+        if self.backend is not None:
+            self.backend.put(key, '{{"questions":[{}],"total_questions":{}}}'
+                             .format(b','.join(questions).decode('utf-8'),
+                                     total))
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def clear_local(self):
+        if self.backend is not None:
+            self.backend.clear_local()
+
+    def stats(self):
+        stats = {'hits': self.hits, 'misses': self.misses}
+        if self.backend is not None:
+            stats.update(self.backend.stats())
+        return stats
+
+
+search_cache = SearchCache()
+on_content_change(search_cache.clear)
+on_snapshot_reload(search_cache.clear_local)
+
+
+# ----------------------------------------------------------------------------
+#  create_search_backend: build the backend named by the SEARCH_CACHE
+#  setting: 'memory' (the default), 'none' to turn the cache off, or a
+#  redis:// URL. A backend object may also be given directly.
+#  The redis package is only needed when a Redis backend is configured
+# ----------------------------------------------------------------------------
+def create_search_backend(config):
+    backend = config.get('SEARCH_CACHE', 'memory')
+    max_bytes = config.get('SEARCH_CACHE_BYTES', SEARCH_CACHE_BYTES)
+    ttl = config.get('SEARCH_CACHE_TTL', SEARCH_CACHE_TTL)
+
+    if not isinstance(backend, str):
+        return backend
+
+    if backend == 'memory':
+        return MemorySearchBackend(max_bytes, ttl)
+
+    if backend == 'none':
+        return None
+
+    if backend.startswith('redis://') or backend.startswith('rediss://'):
+        import redis
+        return RedisSearchBackend(redis.Redis.from_url(backend), ttl=ttl,
+                                  local_bytes=max_bytes)
+
+    raise ValueError('Unknown SEARCH_CACHE: {}'.format(backend))
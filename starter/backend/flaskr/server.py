@@ -0,0 +1,107 @@
+import multiprocessing
+import os
+import time
+
+from sqlalchemy import text
+
+from models import db, replica_set
+from .categories import category_registry
+from .quiz import question_index
+from .snapshot import question_snapshot, install_refresh_signal
+from .suggest import suggestion_index
+
+DEFAULT_BIND = '127.0.0.1:8000'
+
+
+# ----------------------------------------------------------------------------
+#  default_workers: the number of worker processes to run: WEB_CONCURRENCY
+#  if it is set (as on most hosting platforms), otherwise two per CPU plus
+#  one, as gunicorn recommends
+# ----------------------------------------------------------------------------
+def default_workers():
+    if os.environ.get('WEB_CONCURRENCY'):
+        return int(os.environ['WEB_CONCURRENCY'])
+    return multiprocessing.cpu_count() * 2 + 1
+
+
+# ----------------------------------------------------------------------------
+#  warm_up: get the app ready to serve its first request at full speed:
+#  connect to the database (which also builds the engine and its pool),
+#  and load the categories, the question index, the suggestion index and,
+#  in snapshot mode, the snapshot. The connections are then closed, so
+#  that none is shared by the worker processes forked afterwards: each
+#  worker opens its own (to the primary and to the read replicas, if there
+#  are any). Returns how long each step took, in seconds
+# ----------------------------------------------------------------------------
+def warm_up(app):
+    timings = {}
+    with app.app_context():
+        start = time.perf_counter()
+        db.session.execute(text('SELECT 1'))
+        timings['engine'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        category_registry.payload()
+        timings['categories'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        question_index.ids(0)
+        timings['question_index'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        suggestion_index.build()
+        timings['suggest'] = time.perf_counter() - start
+
+        if question_snapshot.enabled:
+            start = time.perf_counter()
+            question_snapshot.data()
+            timings['snapshot'] = time.perf_counter() - start
+
+        db.session.remove()
+        db.engine.dispose()
+        replica_set.dispose(app)
+    return timings
+
+
+# ----------------------------------------------------------------------------
+#  run_server: serve the app with gunicorn's pre-forking server: the app is
+#  created and warmed up once, in the master process, then forked into
+#  workers, which share its loaded code and caches (copy-on-write) instead
+#  of each building their own. Each worker disposes of the engine it
+#  inherited after the fork, in case the master opened connections after
+#  warm_up. gunicorn resets the signal handlers of each worker, so in
+#  snapshot mode the SIGHUP handler is installed again in the worker.
+#  gunicorn (see requirements-server.txt) is only needed here; it does not
+#  run on Windows
+# ----------------------------------------------------------------------------
+def run_server(app, bind=DEFAULT_BIND, workers=None, threads=1,
+               options=None):
+    from gunicorn.app.base import BaseApplication
+
+    def post_fork(server, worker):
+        with app.app_context():
+            db.engine.dispose()
+            replica_set.dispose(app)
+
+    def post_worker_init(worker):
+        if question_snapshot.enabled:
+            install_refresh_signal()
+
+    settings = {'bind': bind,
+                'workers': workers or default_workers(),
+                'threads': threads,
+                'preload_app': True,
+                'post_fork': post_fork,
+                'post_worker_init': post_worker_init}
+    settings.update(options or {})
+
+    class TriviaServer(BaseApplication):
+
+        def load_config(self):
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    TriviaServer().run()
@@ -0,0 +1,293 @@
+import signal
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from flask import abort
+from sqlalchemy.exc import DatabaseError
+
+from models import db, on_content_change, Question, Category
+from .pagination import (question_listing, encode_cursor, decode_cursor,
+                         QUESTIONS_PER_PAGE)
+
+SNAPSHOT_BATCH_SIZE = 10000
+
+# Separates the questions (and the answers) in the lowercased text that
+# substring search runs over. Search terms are stripped of it, so a match
+# can never span two questions
+TEXT_SEPARATOR = '\x00'
+
+# A question as served from the snapshot. It has the same attributes as
+# the rows of question_listing, so format_question works on it
+SnapshotRow = namedtuple('SnapshotRow', ['id', 'question', 'answer',
+                                         'difficulty', 'category',
+                                         'category_type'])
+
+
+# ----------------------------------------------------------------------------
+#  SnapshotData: every question, held in compact columns rather than as
+#  Python objects. Row i of the snapshot is question ids[i]; the rows are
+#  in id order, so a question is found by binary search on ids.
+#    ids, difficulty, category   arrays of machine integers (a category of
+#                                -1 stands for none)
+#    questions, answers          lists of the question and answer strings;
+#                                answers are interned, since many questions
+#                                share an answer
+#    question_text, answer_text  all questions (answers), lowercased, in one
+#                                string each, for substring search, with the
+#                                offset each one starts at
+#    by_category                 the ids of each category, as arrays
+#    buckets                     the ids of each (category, difficulty), as
+#                                arrays, category 0 being every category
+# ----------------------------------------------------------------------------
+class SnapshotData:
+
+    def __init__(self, rows, category_types):
+        self.ids = array('q')
+        self.difficulty = array('b')
+        self.category = array('q')
+        self.questions = []
+        self.answers = []
+        self.category_types = category_types
+        self.by_category = {}
+        self.buckets = {}
+
+        for id, question, answer, difficulty, category in rows:
+            self.ids.append(id)
+            self.difficulty.append(difficulty or 0)
+            self.category.append(-1 if category is None else category)
+            self.questions.append(question or '')
+            self.answers.append(sys.intern(answer or ''))
+            self.buckets.setdefault((0, difficulty), array('q')).append(id)
+            if category is not None:
+                self.by_category.setdefault(category, array('q')).append(id)
+                self.buckets.setdefault((category, difficulty),
+                                        array('q')).append(id)
+        self.by_category[0] = self.ids
+
+        self.question_text, self.question_starts = self._text(self.questions)
+        self.answer_text, self.answer_starts = self._text(self.answers)
+
+    @staticmethod
+    def _text(strings):
+        # lowercasing can change the length of a string, so the offsets
+        # are taken from the lowercased strings
+        lowered = [s.lower() for s in strings]
+        starts = array('q')
+        offset = 0
+        for s in lowered:
+            starts.append(offset)
+            offset += len(s) + 1
+        return TEXT_SEPARATOR.join(lowered), starts
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, id):
+        i = bisect_left(self.ids, id)
+        if i < len(self.ids) and self.ids[i] == id:
+            return i
+        return None
+
+    def row(self, id):
+        i = self.position(id)
+        if i is None:
+            return None
+        category = self.category[i]
+        if category < 0:
+            category = None
+        return SnapshotRow(self.ids[i], self.questions[i], self.answers[i],
+                           self.difficulty[i], category,
+                           self.category_types.get(category))
+
+    def category_ids(self, category_id):
+        return self.by_category.get(category_id, array('q'))
+
+    def bucket(self, category_id, difficulty):
+        return self.buckets.get((category_id, difficulty), array('q'))
+
+    # the rows whose text (from question_text or answer_text) contains term
+    def _matches(self, text, starts, term):
+        found = set()
+        i = text.find(term)
+        while i != -1:
+            row = bisect_right(starts, i) - 1
+            found.add(row)
+            # carry on from the start of the next question
+            next_start = (starts[row + 1] if row + 1 < len(starts)
+                          else len(text))
+            i = text.find(term, next_start)
+        return found
+
+    # ----------------------------------------------------------------------
+    #  search: the ids, in id order, of the questions containing term
+    #  (ignoring case), searching the answers too if include_answers is set
+    # ----------------------------------------------------------------------
+    def search(self, term, include_answers=False):
+        term = term.lower().replace(TEXT_SEPARATOR, '')
+        if not term:
+            return self.ids
+
+        rows = self._matches(self.question_text, self.question_starts, term)
+        if include_answers:
+            rows |= self._matches(self.answer_text, self.answer_starts, term)
+        return array('q', (self.ids[row] for row in sorted(rows)))
+
+    # ----------------------------------------------------------------------
+    #  memory_bytes: an estimate of the memory the snapshot takes, counting
+    #  the arrays, the strings (interned strings once) and the lists
+    # ----------------------------------------------------------------------
+    def memory_bytes(self):
+        arrays = [self.ids, self.difficulty, self.category,
+                  self.question_starts, self.answer_starts]
+        arrays.extend(ids for category, ids in self.by_category.items()
+                      if category != 0)
+        arrays.extend(self.buckets.values())
+        total = sum(sys.getsizeof(a) for a in arrays)
+
+        strings = {id(s): s for s in self.questions + self.answers}
+        total += sum(sys.getsizeof(s) for s in strings.values())
+        total += sys.getsizeof(self.questions) + sys.getsizeof(self.answers)
+        total += (sys.getsizeof(self.question_text) +
+                  sys.getsizeof(self.answer_text))
+        return total
+
+
+# ----------------------------------------------------------------------------
+#  Snapshot reloads
+#    the functions registered with on_snapshot_reload are called each time
+#    the snapshot is reloaded, so that caches of responses built from the
+#    old snapshot are dropped. A reload is not a write: the content version,
+#    and what depends on it (read-your-writes pinning to the primary, the
+#    shared Redis search cache generation), is left alone
+# ----------------------------------------------------------------------------
+_snapshot_reload_listeners = []
+
+
+def on_snapshot_reload(listener):
+    if listener not in _snapshot_reload_listeners:
+        _snapshot_reload_listeners.append(listener)
+    return listener
+
+
+# ----------------------------------------------------------------------------
+#  QuestionSnapshot: the snapshot of the question bank used in snapshot mode
+#  (SNAPSHOT_MODE). It is loaded on first use, and reloaded:
+#    - after questions are added or deleted through this process,
+#    - after the process receives SIGHUP (see install_refresh_signal),
+#    - after ttl seconds, if a ttl is set (None, the default, never expires)
+#  Each reload calls the on_snapshot_reload listeners, so the HTTP, fragment
+#  and search caches do not keep serving results from the old snapshot
+# ----------------------------------------------------------------------------
+class QuestionSnapshot:
+
+    def __init__(self, ttl=None):
+        self.enabled = False
+        self.ttl = ttl
+        self.loads = 0
+        self.load_seconds = None
+        self._lock = threading.Lock()
+        self._data = None
+        self._loaded_at = None
+
+    def _is_fresh(self):
+        if self._loaded_at is None:
+            return False
+        if self.ttl is None:
+            return True
+        return time.monotonic() - self._loaded_at < self.ttl
+
+    def _load(self):
+        start = time.perf_counter()
+        try:
+            category_types = {c.id: c.type
+                              for c in db.session.query(Category.id,
+                                                        Category.type)}
+            rows = (
+                question_listing()
+                .order_by(Question.id)
+                .yield_per(SNAPSHOT_BATCH_SIZE)
+            )
+            data = SnapshotData(rows, category_types)
+        except DatabaseError:
+            abort(422)
+
+        self._data = data
+        self._loaded_at = time.monotonic()
+        self.loads += 1
+        self.load_seconds = time.perf_counter() - start
+
+        for listener in list(_snapshot_reload_listeners):
+            listener()
+
+    def data(self):
+        if not self._is_fresh():
+            with self._lock:
+                if not self._is_fresh():
+                    self._load()
+        return self._data
+
+    def refresh(self):
+        # called by content change listeners, and from the signal handler,
+        # so it only marks the snapshot for reloading on next use
+        self._loaded_at = None
+
+    def stats(self):
+        data = self._data
+        return {'enabled': self.enabled,
+                'questions': len(data) if data is not None else 0,
+                'bytes': data.memory_bytes() if data is not None else 0,
+                'loads': self.loads,
+                'load_seconds': self.load_seconds}
+
+
+question_snapshot = QuestionSnapshot()
+on_content_change(question_snapshot.refresh)
+
+
+# ----------------------------------------------------------------------------
+#  install_refresh_signal: reload the snapshot when the process receives
+#  SIGHUP (kill -HUP <pid>), for example after the question bank has been
+#  updated directly in the database. Under flask serve, SIGHUP goes to the
+#  worker processes (run_server installs it again in each); sent to the
+#  gunicorn master, it restarts the workers instead. Signal handlers can
+#  only be installed from the main thread; elsewhere (and on Windows) this
+#  does nothing
+# ----------------------------------------------------------------------------
+def install_refresh_signal():
+    if (not hasattr(signal, 'SIGHUP') or
+            threading.current_thread() is not threading.main_thread()):
+        return False
+    signal.signal(signal.SIGHUP,
+                  lambda signum, frame: question_snapshot.refresh())
+    return True
+
+
+# ----------------------------------------------------------------------------
+#  paginate_ids: the snapshot counterpart of paginate_query and
+#  paginate_by_cursor. Given the ids (in id order) of the questions of a
+#  listing, return the SnapshotRows of the requested page, the total, and
+#  (in cursor mode) the cursor of the next page, aborting as they do
+# ----------------------------------------------------------------------------
+def paginate_ids(data, ids, page, cursor, cat, per_page=QUESTIONS_PER_PAGE):
+    total = len(ids)
+    next_cursor = None
+
+    if cursor is None:
+        if page is None or page < 1:
+            abort(404)
+        startIdx = (page-1) * per_page
+        if startIdx > total:
+            abort(404)
+        page_ids = ids[startIdx:startIdx + per_page]
+    else:
+        last_id = decode_cursor(cursor, cat)
+        startIdx = 0 if last_id is None else bisect_right(ids, last_id)
+        page_ids = ids[startIdx:startIdx + per_page]
+        if startIdx + per_page < total:
+            next_cursor = encode_cursor(page_ids[-1], cat)
+
+    return [data.row(id) for id in page_ids], total, next_cursor
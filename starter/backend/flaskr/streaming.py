@@ -0,0 +1,53 @@
+import json
+
+from models import Question
+
+STREAM_BATCH_SIZE = 1000
+
+
+# ----------------------------------------------------------------------------
+#  iter_questions: yield the Question objects of query in id order. Rows are
+#  read through a server-side cursor, batch_size at a time, so only one
+#  batch is in memory at once however many questions the query returns
+# ----------------------------------------------------------------------------
+def iter_questions(query, batch_size=STREAM_BATCH_SIZE):
+    return (
+        query.order_by(Question.id)
+             .execution_options(stream_results=True)
+             .yield_per(batch_size)
+    )
+
+
+# ----------------------------------------------------------------------------
+#  stream_questions_package: encode the same json object that
+#  get_questions_package returns, but for every question of the query and
+#  one question at a time, for use as a streaming response body.
+#  format_question turns a Question into the dict to send for it. Since the
+#  questions are counted as they are sent, total_questions comes last and
+#  no separate count query is needed
+# ----------------------------------------------------------------------------
+def stream_questions_package(query, cat, categories, format_question):
+    yield '{{"categories": {}, "currentCategory": {}, "questions": {{'.format(
+        json.dumps(categories), json.dumps(cat))
+
+    i = 0
+    for q in iter_questions(query):
+        i = i + 1
+        separator = ', ' if i > 1 else ''
+        yield '{}"{}": {}'.format(separator, i,
+                                  json.dumps(format_question(q)))
+
+    yield '}}, "success": true, "total_questions": {}}}\n'.format(i)
+
+
+# ----------------------------------------------------------------------------
+#  stream_json_array: encode the dicts produced by rows as a json array, one
+#  element at a time
+# ----------------------------------------------------------------------------
+def stream_json_array(rows):
+    yield '['
+    separator = ''
+    for row in rows:
+        yield separator + json.dumps(row)
+        separator = ', '
+    yield ']\n'
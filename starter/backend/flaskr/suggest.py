@@ -0,0 +1,238 @@
+import re
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from flask import abort
+from sqlalchemy import event
+from sqlalchemy.exc import DatabaseError
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import get_history
+
+from models import db, RoutingSession, Question
+
+SUGGEST_INDEX_TTL = 300
+SUGGEST_BATCH_SIZE = 10000
+
+# the suggestions /questions/suggest returns by default, and at most
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+
+# words are runs of letters and digits; shorter ones are not suggested
+WORD_PATTERN = re.compile(r'[^\W_]+')
+MIN_WORD_LENGTH = 2
+
+
+# ----------------------------------------------------------------------------
+#  question_words: the distinct words of a question, lowercased
+# ----------------------------------------------------------------------------
+def question_words(text):
+    if not text:
+        return set()
+    return {word for word in WORD_PATTERN.findall(text.lower())
+            if len(word) >= MIN_WORD_LENGTH}
+
+
+# ----------------------------------------------------------------------------
+#  last_word: the word being typed at the end of a search box's text
+#  (lowercased), or '' if there is none
+# ----------------------------------------------------------------------------
+def last_word(text):
+    words = WORD_PATTERN.findall(text.lower())
+    return words[-1] if words else ''
+
+
+# ----------------------------------------------------------------------------
+#  SuggestionIndex: every word of the questions, in a sorted list, with the
+#  number of questions each one is in, in an array alongside. The words
+#  starting with a prefix are next to each other in the list, so they are
+#  found by binary search, without querying the database.
+#  The index is built on first use (or by warm_up), and rebuilt after ttl
+#  seconds (None never expires it), which is how changes made by other
+#  processes reach it. In between, the questions this process adds, changes
+#  and deletes are applied to it as their transactions commit (see the
+#  events below, bulk.py and batch.py); a word is inserted into, or removed
+#  from, the list in place
+# ----------------------------------------------------------------------------
+class SuggestionIndex:
+
+    def __init__(self, ttl=SUGGEST_INDEX_TTL):
+        self.ttl = ttl
+        self.builds = 0
+        self.build_seconds = None
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._words = []
+        self._counts = array('l')
+
+    def _is_fresh(self):
+        if self._loaded_at is None:
+            return False
+        if self.ttl is None:
+            return True
+        return time.monotonic() - self._loaded_at < self.ttl
+
+    # ----------------------------------------------------------------------
+    #  load: replace the index with one built from the given question texts
+    # ----------------------------------------------------------------------
+    def load(self, texts):
+        start = time.perf_counter()
+        counts = Counter()
+        for text in texts:
+            counts.update(question_words(text))
+        words = sorted(counts)
+
+        self._words = words
+        self._counts = array('l', (counts[word] for word in words))
+        self._loaded_at = time.monotonic()
+        self.builds += 1
+        self.build_seconds = time.perf_counter() - start
+
+    def _build(self):
+        try:
+            rows = (
+                db.session.query(Question.question)
+                          .yield_per(SUGGEST_BATCH_SIZE)
+            )
+            self.load(text for text, in rows)
+        except DatabaseError:
+            abort(422)
+
+    def build(self):
+        with self._lock:
+            self._build()
+
+    def _ensure_built(self):
+        if self._is_fresh():
+            return
+
+        with self._lock:
+            if not self._is_fresh():
+                self._build()
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    # ----------------------------------------------------------------------
+    #  suggest: the words starting with prefix, in alphabetical order, with
+    #  the number of questions each is in; at most limit of them
+    # ----------------------------------------------------------------------
+    def suggest(self, prefix, limit=SUGGEST_LIMIT):
+        self._ensure_built()
+
+        with self._lock:
+            words, counts = self._words, self._counts
+            suggestions = []
+            i = bisect_left(words, prefix)
+            while (i < len(words) and len(suggestions) < limit and
+                   words[i].startswith(prefix)):
+                suggestions.append((words[i], counts[i]))
+                i += 1
+        return suggestions
+
+    # ----------------------------------------------------------------------
+    #  update: count the words of the added question texts in, and those of
+    #  the removed ones out. Nothing to do if the index is not built yet:
+    #  building it will read the questions as they are now
+    # ----------------------------------------------------------------------
+    def update(self, added=(), removed=()):
+        if self._loaded_at is None:
+            return
+
+        with self._lock:
+            for text in added:
+                for word in question_words(text):
+                    self._count(word, 1)
+            for text in removed:
+                for word in question_words(text):
+                    self._count(word, -1)
+
+    def _count(self, word, delta):
+        i = bisect_left(self._words, word)
+        if i < len(self._words) and self._words[i] == word:
+            self._counts[i] += delta
+            if self._counts[i] <= 0:
+                del self._words[i]
+                del self._counts[i]
+        elif delta > 0:
+            self._words.insert(i, word)
+            self._counts.insert(i, delta)
+
+    # ----------------------------------------------------------------------
+    #  memory_bytes: an estimate of the memory the index takes: the list,
+    #  the word strings and the array of counts
+    # ----------------------------------------------------------------------
+    def memory_bytes(self):
+        words = self._words
+        return (sys.getsizeof(words) + sys.getsizeof(self._counts) +
+                sum(sys.getsizeof(word) for word in words))
+
+    def stats(self):
+        return {'words': len(self._words),
+                'bytes': self.memory_bytes(),
+                'builds': self.builds,
+                'build_seconds': self.build_seconds}
+
+
+suggestion_index = SuggestionIndex()
+
+
+# ----------------------------------------------------------------------------
+#  The questions added, changed and deleted through the ORM (Question.insert,
+#  update and delete) are collected in session.info as the session flushes
+#  them, and applied to the suggestion index once the transaction commits;
+#  a rollback drops them. When a question's old text was not loaded, the
+#  index is rebuilt instead
+# ----------------------------------------------------------------------------
+def pending_changes(session):
+    return session.info.setdefault('suggest_changes',
+                                   {'added': [], 'removed': [],
+                                    'stale': False})
+
+
+@event.listens_for(Question, 'after_insert')
+def collect_inserted_question(mapper, connection, question):
+    changes = pending_changes(object_session(question))
+    changes['added'].append(question.question)
+
+
+@event.listens_for(Question, 'after_delete')
+def collect_deleted_question(mapper, connection, question):
+    changes = pending_changes(object_session(question))
+    text = question.__dict__.get('question')
+    if text is None:
+        changes['stale'] = True
+    else:
+        changes['removed'].append(text)
+
+
+@event.listens_for(Question, 'after_update')
+def collect_updated_question(mapper, connection, question):
+    history = get_history(question, 'question')
+    if not history.added:
+        return
+    changes = pending_changes(object_session(question))
+    if history.deleted:
+        changes['removed'].extend(history.deleted)
+        changes['added'].extend(history.added)
+    else:
+        changes['stale'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def apply_question_changes(session):
+    changes = session.info.pop('suggest_changes', None)
+    if changes is None:
+        return
+    if changes['stale']:
+        suggestion_index.invalidate()
+    else:
+        suggestion_index.update(changes['added'], changes['removed'])
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def drop_question_changes(session):
+    session.info.pop('suggest_changes', None)
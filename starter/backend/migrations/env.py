@@ -0,0 +1,60 @@
+import os
+import sys
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import engine_from_config, pool
+
+# make models importable when alembic is run from starter/backend
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db  # noqa: E402
+
+config = context.config
+
+if config.config_file_name is not None and not config.attributes.get(
+        'skip_logging_config'):
+    fileConfig(config.config_file_name)
+
+if os.environ.get('DATABASE_URL') and not config.attributes.get('url_set'):
+    config.set_main_option('sqlalchemy.url', os.environ['DATABASE_URL'])
+
+target_metadata = db.metadata
+
+
+# ---------------------------------------------------------
+# run_migrations_offline()
+#    writes the migration SQL out instead of running it
+#    (alembic upgrade head --sql)
+# ---------------------------------------------------------
+def run_migrations_offline():
+    context.configure(url=config.get_main_option('sqlalchemy.url'),
+                      target_metadata=target_metadata,
+                      literal_binds=True)
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+# ---------------------------------------------------------
+# run_migrations_online()
+#    runs the migrations against the database
+# ---------------------------------------------------------
+def run_migrations_online():
+    connectable = engine_from_config(
+        config.get_section(config.config_ini_section),
+        prefix='sqlalchemy.',
+        poolclass=pool.NullPool)
+
+    with connectable.connect() as connection:
+        context.configure(connection=connection,
+                          target_metadata=target_metadata)
+
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
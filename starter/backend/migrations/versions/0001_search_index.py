@@ -0,0 +1,49 @@
+"""full text search indexes for /questions/search
+
+These are expression indexes, so building them indexes every question
+already in the table (including the data loaded from trivia.psql), and
+Postgres keeps them up to date as questions are added or deleted.
+The expressions must match the ones built in flaskr/search.py.
+Other databases do not support them, and search those with ILIKE.
+
+Revision ID: 0001
+Revises:
+Create Date: 2020-01-06 10:12:31.480212
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS questions_question_tsv_idx
+            ON questions
+            USING GIN (to_tsvector('simple'::regconfig,
+                                   coalesce(question, '')))
+    """)
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS questions_question_answer_tsv_idx
+            ON questions
+            USING GIN (to_tsvector('simple'::regconfig,
+                                   coalesce(question, '') || ' ' ||
+                                   coalesce(answer, '')))
+    """)
+    op.execute("ANALYZE questions")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute("DROP INDEX IF EXISTS questions_question_answer_tsv_idx")
+    op.execute("DROP INDEX IF EXISTS questions_question_tsv_idx")
@@ -0,0 +1,58 @@
+"""integer questions.category and indexes for the category filters
+
+questions.category is an integer foreign key in the database, but was
+declared as a String in models.py; this makes sure the column really is
+an integer. The composite indexes back the category listing
+(WHERE category = ? ORDER BY id) and filtering on category and
+difficulty.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2020-01-06 11:40:02.113509
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    'ix_questions_category_id': ['category', 'id'],
+    'ix_questions_category_difficulty': ['category', 'difficulty'],
+}
+
+
+def existing_indexes():
+    # with --sql there is no database to look at
+    if op.get_context().as_sql:
+        return set()
+    inspector = sa.inspect(op.get_bind())
+    return {index['name'] for index in inspector.get_indexes('questions')}
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.alter_column('questions', 'category',
+                        type_=sa.Integer(),
+                        postgresql_using='category::integer')
+
+    # the tables may have been created by db.create_all, with the indexes
+    existing = existing_indexes()
+    for name, columns in INDEXES.items():
+        if name not in existing:
+            op.create_index(name, 'questions', columns)
+
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("ANALYZE questions")
+
+
+def downgrade():
+    existing = existing_indexes()
+    for name in INDEXES:
+        if name in existing:
+            op.drop_index(name, table_name='questions')
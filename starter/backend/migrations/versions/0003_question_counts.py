@@ -0,0 +1,56 @@
+"""question_counts: the number of questions in each category
+
+One row per category, and one (category 0) for all questions, so that the
+question listings read their totals by primary key instead of counting.
+models.py keeps the rows up to date as questions are added, moved and
+deleted; "flask rebuild-counts" counts them again.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2020-01-08 09:21:45.370214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def table_exists():
+    # with --sql there is no database to look at
+    if op.get_context().as_sql:
+        return False
+    return 'question_counts' in sa.inspect(op.get_bind()).get_table_names()
+
+
+def upgrade():
+    # the table may have been created by db.create_all
+    if not table_exists():
+        op.create_table(
+            'question_counts',
+            sa.Column('category', sa.Integer(), autoincrement=False,
+                      nullable=False),
+            sa.Column('count', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('category'))
+
+    op.execute("DELETE FROM question_counts")
+    op.execute("""
+        INSERT INTO question_counts (category, count)
+        SELECT categories.id, count(questions.id)
+        FROM categories
+        LEFT OUTER JOIN questions ON questions.category = categories.id
+        GROUP BY categories.id
+    """)
+    op.execute("""
+        INSERT INTO question_counts (category, count)
+        SELECT 0, count(*) FROM questions
+    """)
+
+
+def downgrade():
+    op.drop_table('question_counts')
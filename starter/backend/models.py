@@ -1,24 +1,445 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import threading
+import time
+import weakref
+from collections import Counter
+from sqlalchemy import (Column, String, Integer, ForeignKey, Index,
+                        create_engine, event, func, orm, text)
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm.attributes import get_history
+from sqlalchemy.pool import QueuePool
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 import json
 
 database_name = "trivia"
-database_path = "postgres://{}/{}".format('localhost:5432', database_name)
+database_path = os.environ.get(
+    'DATABASE_URL',
+    "postgres://{}/{}".format('localhost:5432', database_name))
 
-db = SQLAlchemy()
+REPLICA_CHECK_INTERVAL = 10
+READ_YOUR_WRITES_SECONDS = 10
+
+
+# ---------------------------------------------------------
+# RoutingSession: a session that sends its queries to the
+# read replica named in session.info['replica'], if one is
+# (see flaskr/read_routing.py, which sets it for read-only
+# requests). Flushes, and so every write, always go to the
+# primary
+# ---------------------------------------------------------
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('replica')
+        if replica is not None and not self._flushing:
+            return db.get_engine(self.app, bind=replica)
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+
+# a true/false setting, from the app config or the environment
+def is_true(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+# ---------------------------------------------------------
+# Connection pool settings. Each can be set in the app config
+# (for example through create_app's test_config) or as an
+# environment variable of the same name; the app config wins.
+#    DB_POOL_SIZE           connections kept open per process
+#    DB_MAX_OVERFLOW        extra connections allowed under load
+#    DB_POOL_TIMEOUT        seconds to wait for a free connection
+#    DB_POOL_RECYCLE        seconds after which a connection is
+#                           replaced, so that idle connections
+#                           closed by the server are not used
+#    DB_POOL_PRE_PING       test each connection before use
+#    DB_STATEMENT_TIMEOUT   milliseconds before Postgres cancels
+#                           a statement
+# ---------------------------------------------------------
+POOL_SETTINGS = {
+    'DB_POOL_SIZE': ('pool_size', int),
+    'DB_MAX_OVERFLOW': ('max_overflow', int),
+    'DB_POOL_TIMEOUT': ('pool_timeout', float),
+    'DB_POOL_RECYCLE': ('pool_recycle', int),
+    'DB_POOL_PRE_PING': ('pool_pre_ping', is_true),
+}
+
+
+# ---------------------------------------------------------
+# PoolStats: counts of connection checkouts from the pool
+# and how long each one had to wait for a connection
+# (including the time to open a new one, when the pool had
+# room for it). The wait times show whether DB_POOL_SIZE
+# and DB_MAX_OVERFLOW are large enough for the load
+# ---------------------------------------------------------
+class PoolStats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_checkout(self, wait):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {'checkouts': self.checkouts,
+                    'timeouts': self.timeouts,
+                    'total_wait_seconds': self.total_wait,
+                    'max_wait_seconds': self.max_wait}
+
+
+# ---------------------------------------------------------
+# TimedQueuePool: a QueuePool that records PoolStats for
+# every checkout
+# ---------------------------------------------------------
+class TimedQueuePool(QueuePool):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record_timeout()
+            raise
+        self.stats.record_checkout(time.perf_counter() - start)
+        return conn
+
+    def recreate(self):
+        # keep counting across engine.dispose()
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def _setting(app, name):
+    value = app.config.get(name)
+    if value is None:
+        value = os.environ.get(name)
+    return value
+
+
+# ---------------------------------------------------------
+# get_engine_options(app, path)
+#    builds the SQLAlchemy engine options for the database
+#    at path from the pool settings above. SQLite does not
+#    use a connection pool, so the pool settings only apply
+#    to other databases
+# ---------------------------------------------------------
+def get_engine_options(app, path):
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    url = make_url(path)
+
+    if url.get_backend_name() == 'sqlite':
+        return options
+
+    options.setdefault('poolclass', TimedQueuePool)
+    for name, (option, cast) in POOL_SETTINGS.items():
+        value = _setting(app, name)
+        if value is not None:
+            options[option] = cast(value)
+
+    statement_timeout = _setting(app, 'DB_STATEMENT_TIMEOUT')
+    if (statement_timeout is not None and
+            url.get_backend_name() in ('postgres', 'postgresql')):
+        connect_args = dict(options.get('connect_args') or {})
+        connect_args['options'] = '-c statement_timeout={}'.format(
+            int(statement_timeout))
+        options['connect_args'] = connect_args
+
+    return options
+
+
+# ---------------------------------------------------------
+# get_database_path(app)
+#    the database to use: the DATABASE_URL app config
+#    setting (if an app is given) or environment variable,
+#    otherwise the local trivia database
+# ---------------------------------------------------------
+def get_database_path(app=None):
+    if app is not None and app.config.get('DATABASE_URL'):
+        return app.config['DATABASE_URL']
+    return database_path
+
+
+# ---------------------------------------------------------
+# get_replica_paths(app)
+#    the read replicas to use: the REPLICA_URLS app config
+#    setting (a list, or a comma separated string) or
+#    environment variable; none by default
+# ---------------------------------------------------------
+def get_replica_paths(app):
+    paths = _setting(app, 'REPLICA_URLS') or []
+    if isinstance(paths, str):
+        paths = paths.split(',')
+    return [path.strip() for path in paths if path.strip()]
+
+
+# ---------------------------------------------------------
+# ReplicaSet: the read replicas of the database, each a
+# Flask-SQLAlchemy bind (replica_0, replica_1, ...). choose()
+# takes turns between the replicas that are up, checking a
+# replica with SELECT 1 at most every check_interval
+# seconds; one that fails the check, or loses its
+# connection during a query, is left out until it passes a
+# check again. choose() returns None (read from the
+# primary) when no replica is up, and for
+# read_your_writes_seconds after this process has changed
+# the questions, so that its caches are not reloaded from a
+# replica that has not caught up with the change yet
+# ---------------------------------------------------------
+class ReplicaSet:
+
+    def __init__(self):
+        self.names = []
+        self.check_interval = REPLICA_CHECK_INTERVAL
+        self.read_your_writes_seconds = READ_YOUR_WRITES_SECONDS
+        self.last_write = None
+        self._lock = threading.Lock()
+        self._turn = 0
+        self._healthy = {}
+        self._checked_at = {}
+        self._failures = {}
+        self._engines = weakref.WeakSet()
+
+    def configure(self, names, check_interval=REPLICA_CHECK_INTERVAL,
+                  read_your_writes_seconds=READ_YOUR_WRITES_SECONDS):
+        with self._lock:
+            self.names = list(names)
+            self.check_interval = check_interval
+            self.read_your_writes_seconds = read_your_writes_seconds
+            self.last_write = None
+            self._turn = 0
+            self._healthy = {name: True for name in self.names}
+            self._checked_at = {}
+            self._failures = {name: 0 for name in self.names}
+
+    def record_write(self):
+        self.last_write = time.monotonic()
+
+    def recently_written(self):
+        return (self.last_write is not None and
+                time.monotonic() - self.last_write <
+                self.read_your_writes_seconds)
+
+    def engine(self, app, name):
+        engine = db.get_engine(app, bind=name)
+        if engine not in self._engines:
+            self._engines.add(engine)
+
+            @event.listens_for(engine, 'handle_error')
+            def handle_error(context):
+                # lost or refused connections take the replica out
+                if context.is_disconnect or context.connection is None:
+                    self.mark_failed(name)
+        return engine
+
+    def choose(self, app):
+        if not self.names or self.recently_written():
+            return None
+        with self._lock:
+            start = self._turn
+            self._turn = (self._turn + 1) % len(self.names)
+        for i in range(len(self.names)):
+            name = self.names[(start + i) % len(self.names)]
+            if self.is_healthy(app, name):
+                return name
+        return None
+
+    def is_healthy(self, app, name):
+        checked_at = self._checked_at.get(name)
+        if (checked_at is not None and
+                time.monotonic() - checked_at < self.check_interval):
+            return self._healthy[name]
+        return self.check(app, name)
+
+    def check(self, app, name):
+        try:
+            with self.engine(app, name).connect() as connection:
+                connection.execute(text('SELECT 1'))
+        except SQLAlchemyError:
+            self.mark_failed(name)
+            return False
+        with self._lock:
+            self._healthy[name] = True
+            self._checked_at[name] = time.monotonic()
+        return True
+
+    # counts the times each replica is taken out of rotation
+    def mark_failed(self, name):
+        with self._lock:
+            if name not in self._healthy:
+                return
+            if self._healthy[name]:
+                self._failures[name] += 1
+            self._healthy[name] = False
+            self._checked_at[name] = time.monotonic()
+
+    def dispose(self, app):
+        for name in self.names:
+            db.get_engine(app, bind=name).dispose()
+
+    def stats(self, app):
+        return [dict(get_engine_pool_stats(self.engine(app, name)),
+                     name=name,
+                     healthy=self._healthy[name],
+                     failures=self._failures[name])
+                for name in self.names]
+
+
+replica_set = ReplicaSet()
 
 
 # ---------------------------------------------------------
 # setup_db(app)
-#    binds a flask application and a SQLAlchemy service
+#    binds a flask application and a SQLAlchemy service.
+#    The database is database_path if given, otherwise the
+#    one named by get_database_path. Reads may be sent to
+#    the read replicas in replica_paths if given, otherwise
+#    those named by get_replica_paths (see ReplicaSet); they
+#    use the same engine options as the primary. The tables
+#    are only created (if missing) when CREATE_SCHEMA is
+#    set, in the app config or the environment; otherwise
+#    the schema is left to trivia.psql and the migrations
 # ---------------------------------------------------------
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=None, replica_paths=None):
+    if database_path is None:
+        database_path = get_database_path(app)
+    if replica_paths is None:
+        replica_paths = get_replica_paths(app)
+    binds = {'replica_{}'.format(i): path
+             for i, path in enumerate(replica_paths)}
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+    app.config["SQLALCHEMY_BINDS"] = binds
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = get_engine_options(app,
+                                                                 database_path)
     db.app = app
     db.init_app(app)
-    db.create_all()
+    replica_set.configure(
+        sorted(binds),
+        float(_setting(app, 'REPLICA_CHECK_INTERVAL') or
+              REPLICA_CHECK_INTERVAL),
+        float(_setting(app, 'READ_YOUR_WRITES_SECONDS') or
+              READ_YOUR_WRITES_SECONDS))
+    if is_true(_setting(app, 'CREATE_SCHEMA')):
+        # on the primary only: the replicas copy it
+        db.create_all(bind=None)
+
+
+# ---------------------------------------------------------
+# run_migrations(database_path, revision)
+#    upgrades the database to the given alembic revision
+#    (by default the latest one) using the migrations in
+#    the migrations directory. The database is
+#    database_path if given, otherwise DATABASE_URL or the
+#    local trivia database. Also available from the command
+#    line as "flask db-upgrade" or "alembic upgrade head"
+# ---------------------------------------------------------
+def run_migrations(database_path=None, revision='head'):
+    from alembic import command
+    from alembic.config import Config
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    config = Config(os.path.join(here, 'alembic.ini'))
+    config.set_main_option('script_location',
+                           os.path.join(here, 'migrations'))
+    config.set_main_option('sqlalchemy.url',
+                           database_path or get_database_path())
+    config.attributes['url_set'] = True
+    config.attributes['skip_logging_config'] = True
+
+    command.upgrade(config, revision)
+
+
+# ---------------------------------------------------------
+# get_pool_stats()
+#    returns the state of the connection pool of the current
+#    app's database: its size, the connections checked out
+#    and in, the overflow in use, and the PoolStats counts.
+#    With read replicas, also the state of each replica
+# ---------------------------------------------------------
+def get_pool_stats():
+    stats = get_engine_pool_stats(db.engine)
+    if replica_set.names:
+        replicas = replica_set.stats(db.get_app())
+        stats['replicas'] = replicas
+        stats['replicas_healthy'] = sum(1 for replica in replicas
+                                        if replica['healthy'])
+    return stats
+
+
+def get_engine_pool_stats(engine):
+    pool = engine.pool
+    stats = {'pool': type(pool).__name__}
+
+    if isinstance(pool, QueuePool):
+        stats.update({'size': pool.size(),
+                      'checked_in': pool.checkedin(),
+                      'checked_out': pool.checkedout(),
+                      'overflow': pool.overflow()})
+    if isinstance(pool, TimedQueuePool):
+        stats.update(pool.stats.as_dict())
+
+    return stats
+
+
+# ---------------------------------------------------------
+# Content version
+#    a counter of changes made to the questions by this
+#    process. Question.insert/update/delete (and anything
+#    else that writes questions, such as bulk imports) call
+#    bump_content_version, which also calls the functions
+#    registered with on_content_change, so that caches of
+#    question data know to reload
+# ---------------------------------------------------------
+_content_version = 0
+_content_version_lock = threading.Lock()
+_content_change_listeners = []
+
+
+def get_content_version():
+    return _content_version
+
+
+def bump_content_version():
+    global _content_version
+    with _content_version_lock:
+        _content_version += 1
+    for listener in list(_content_change_listeners):
+        listener()
+
+
+def on_content_change(listener):
+    if listener not in _content_change_listeners:
+        _content_change_listeners.append(listener)
+    return listener
+
+
+on_content_change(replica_set.record_write)
 
 
 # ---------------------------------------------------------
@@ -26,11 +447,22 @@ def setup_db(app, database_path=database_path):
 # ---------------------------------------------------------
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        # category listings: WHERE category = ? ORDER BY id
+        Index('ix_questions_category_id', 'category', 'id'),
+        Index('ix_questions_category_difficulty', 'category', 'difficulty'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    # active_history: the old category is loaded when it is changed, so
+    # that the question can be counted out of it (see QuestionCount)
+    category = orm.column_property(
+        Column(Integer, ForeignKey('categories.id',
+                                   onupdate='CASCADE',
+                                   ondelete='SET NULL')),
+        active_history=True)
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -42,13 +474,16 @@ class Question(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        bump_content_version()
 
     def update(self):
         db.session.commit()
+        bump_content_version()
 
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        bump_content_version()
 
     def format(self):
         return {
@@ -60,6 +495,110 @@ class Question(db.Model):
         }
 
 
+# ---------------------------------------------------------
+#  QuestionCount
+#    the number of questions in each category, and (under
+#    ALL_CATEGORIES) in all of them, so that listings do not
+#    have to count their questions. The counts are changed
+#    in the same transaction as the questions: by the mapper
+#    events below for Question objects, and by
+#    adjust_question_counts for inserts, updates and deletes
+#    that bypass the ORM (such as bulk imports). They are
+#    only kept for the categories that have a row, which
+#    rebuild_question_counts (or "flask rebuild-counts")
+#    creates; get_question_count returns None for the
+#    others
+# ---------------------------------------------------------
+ALL_CATEGORIES = 0
+
+
+class QuestionCount(db.Model):
+    __tablename__ = 'question_counts'
+
+    category = Column(Integer, primary_key=True, autoincrement=False)
+    count = Column(Integer, nullable=False, default=0)
+
+
+# ---------------------------------------------------------
+# adjust_question_counts(connection, changes)
+#    adds changes ({category: questions added, or removed
+#    if negative}) to the counts, on the connection of the
+#    transaction that made them. Questions without a
+#    category only change the count of all questions
+# ---------------------------------------------------------
+def adjust_question_counts(connection, changes):
+    deltas = Counter()
+    for category, delta in changes.items():
+        if category is not None:
+            deltas[int(category)] += delta
+        deltas[ALL_CATEGORIES] += delta
+
+    table = QuestionCount.__table__
+    for category, delta in sorted(deltas.items()):
+        if delta:
+            connection.execute(table.update()
+                               .where(table.c.category == category)
+                               .values(count=table.c.count + delta))
+
+
+@event.listens_for(Question, 'after_insert')
+def count_inserted_question(mapper, connection, question):
+    adjust_question_counts(connection, {question.category: 1})
+
+
+@event.listens_for(Question, 'after_delete')
+def count_deleted_question(mapper, connection, question):
+    adjust_question_counts(connection, {question.category: -1})
+
+
+@event.listens_for(Question, 'after_update')
+def count_moved_question(mapper, connection, question):
+    history = get_history(question, 'category')
+    if history.deleted and history.added:
+        adjust_question_counts(connection, {history.deleted[0]: -1,
+                                            history.added[0]: 1})
+
+
+# ---------------------------------------------------------
+# get_question_count(category)
+#    the number of questions in the category (all of them
+#    for None), read from question_counts by primary key;
+#    None if it has not been counted
+# ---------------------------------------------------------
+def get_question_count(category=None):
+    key = ALL_CATEGORIES if category is None else category
+    return (db.session.query(QuestionCount.count)
+                      .filter(QuestionCount.category == key)
+                      .scalar())
+
+
+# ---------------------------------------------------------
+# rebuild_question_counts()
+#    counts the questions of every category, and all of
+#    them, again, and replaces question_counts with the
+#    result. On Postgres, writes to the questions wait until
+#    it is done, so that none is missed. Returns the counts
+# ---------------------------------------------------------
+def rebuild_question_counts():
+    session = db.session
+    if session.get_bind().dialect.name == 'postgresql':
+        session.execute(text('LOCK TABLE questions IN SHARE MODE'))
+
+    counts = dict(
+        session.query(Category.id, func.count(Question.id))
+               .outerjoin(Question, Question.category == Category.id)
+               .group_by(Category.id))
+    counts[ALL_CATEGORIES] = session.query(func.count(Question.id)).scalar()
+
+    table = QuestionCount.__table__
+    session.execute(table.delete())
+    session.execute(table.insert(),
+                    [{'category': category, 'count': count}
+                     for category, count in sorted(counts.items())])
+    session.commit()
+    return counts
+
+
 # ---------------------------------------------------------
 #  Category
 # ---------------------------------------------------------
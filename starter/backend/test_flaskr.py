@@ -1,10 +1,35 @@
 import os
+import tempfile
+import time
 import unittest
 import json
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, text
 
-from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr import create_app, QUESTIONS_PER_PAGE
+from flaskr.categories import category_registry, invalidate_categories
+from flaskr.fragments import fragment_cache
+from flaskr.quiz import question_index
+from flaskr.server import warm_up
+from flaskr.quiz_sessions import RedisSessionStore
+from flaskr.search_cache import (search_cache, MemorySearchBackend,
+                                 RedisSearchBackend)
+from flaskr.snapshot import question_snapshot
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+try:
+    from starlette.testclient import TestClient
+    from flaskr.asgi import create_asgi_app
+except ImportError:
+    create_asgi_app = None
+from models import (db, setup_db, get_engine_options, get_question_count,
+                    get_content_version, rebuild_question_counts,
+                    replica_set, RoutingSession, Question, QuestionCount,
+                    Category)
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -41,6 +66,158 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['categories'])
 
+    # test warming up loads the caches the first requests need
+    def test_warm_up(self):
+        invalidate_categories()
+        misses = category_registry.misses
+
+        timings = warm_up(self.app)
+        self.client().get('/categories')
+
+        self.assertIn('question_index', timings)
+        self.assertEqual(category_registry.misses, misses + 1)
+        self.assertGreater(question_index.stats()['size'], 0)
+
+    # test categories are loaded once and then served from the registry
+    def test_categories_are_cached(self):
+        invalidate_categories()
+        misses = category_registry.misses
+        hits = category_registry.hits
+
+        self.client().get('/categories')
+        self.client().get('/questions?page=1')
+        self.client().get('/categories/1/questions')
+
+        self.assertEqual(category_registry.misses, misses + 1)
+        self.assertGreaterEqual(category_registry.hits, hits + 2)
+
+    # test the connection pool statistics
+    def test_get_pool_stats(self):
+        self.client().get('/categories/1/questions')
+        res = self.client().get('/stats/pool')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertGreater(data['pool']['checkouts'], 0)
+        self.assertEqual(data['pool']['timeouts'], 0)
+
+    # test reads go to the replica and writes, and the writer's next reads,
+    # to the primary, using two SQLite files
+    def test_read_replica_routing(self):
+        directory = tempfile.mkdtemp()
+        primary = 'sqlite:///' + os.path.join(directory, 'primary.db')
+        replica = 'sqlite:///' + os.path.join(directory, 'replica.db')
+        app = create_app({'DATABASE_URL': primary,
+                          'REPLICA_URLS': replica,
+                          'CREATE_SCHEMA': True,
+                          'HTTP_CACHE_SIZE': 0})
+        with app.app_context():
+            replica_engine = db.get_engine(app, 'replica_0')
+            Question.metadata.create_all(replica_engine)
+            for engine in (db.engine, replica_engine):
+                engine.execute(Category.__table__.insert(), id=1,
+                               type='Science')
+        client = app.test_client()
+
+        res = client.post('/questions/add',
+                          json={'question': 'Primary?', 'answer': 'Yes',
+                                'category': 1, 'difficulty': 1})
+        pinned = json.loads(client.get('/questions').data)
+        replica_set.last_write = None
+        unpinned = json.loads(app.test_client().get('/questions').data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(pinned['total_questions'], 1)
+        self.assertEqual(unpinned['total_questions'], 0)
+
+    # test a replica that fails its health check is taken out of rotation
+    def test_failed_replica_is_skipped(self):
+        app = create_app({'DATABASE_URL': self.database_path,
+                          'REPLICA_URLS': 'sqlite:////nonexistent/r.db'})
+        res = app.test_client().get('/questions')
+        pool = json.loads(app.test_client().get('/stats/pool').data)['pool']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(pool['replicas_healthy'], 0)
+        self.assertFalse(pool['replicas'][0]['healthy'])
+
+    # test request metrics are counted and served at /metrics
+    def test_get_metrics(self):
+        app = create_app({'METRICS': True,
+                          'DATABASE_URL': self.database_path})
+        client = app.test_client()
+
+        res = client.get('/categories/1/questions')
+        self.assertIn('sql;dur=', res.headers['Server-Timing'])
+
+        res = client.get('/metrics')
+        text = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('trivia_requests_total{endpoint="get_questions_by_cat",'
+                      'method="GET",status="200"}', text)
+        self.assertIn('trivia_sql_queries_total'
+                      '{endpoint="get_questions_by_cat"}', text)
+        self.assertIn('trivia_cache_hits{cache="categories"}', text)
+
+    # test engine options are taken from the app config
+    def test_engine_options_from_config(self):
+        app = create_app({'DB_POOL_SIZE': '7',
+                          'DB_POOL_PRE_PING': 'true',
+                          'DB_STATEMENT_TIMEOUT': 2000})
+        options = get_engine_options(app, self.database_path)
+
+        self.assertEqual(options['pool_size'], 7)
+        self.assertEqual(options['pool_pre_ping'], True)
+        self.assertEqual(options['connect_args']['options'],
+                         '-c statement_timeout=2000')
+
+    # test a conditional GET of an unchanged page returns 304
+    def test_conditional_get_not_modified(self):
+        res = self.client().get('/questions?page=1')
+        etag = res.headers['ETag']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('no-cache', res.headers['Cache-Control'])
+
+        res = self.client().get('/questions?page=1',
+                                headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+    # test adding a question changes the ETag of the question pages
+    def test_etag_changes_when_questions_change(self):
+        res = self.client().get('/categories/1/questions')
+        etag = res.headers['ETag']
+
+        self.client().post('/questions/add',
+                           json={'question': 'etag question?',
+                                 'answer': 'etag answer',
+                                 'category': 1,
+                                 'difficulty': 1})
+        res = self.client().get('/categories/1/questions',
+                                headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    # test the ETag changes after HTTP_CACHE_TTL even if this process has
+    # not changed anything, since another process may have
+    def test_etag_changes_after_http_cache_ttl(self):
+        client = create_app({'HTTP_CACHE_TTL': 0.2,
+                             'DATABASE_URL': self.database_path}).test_client()
+        res = client.get('/questions?page=1')
+        etag = res.headers['ETag']
+
+        time.sleep(0.25)
+        res = client.get('/questions?page=1',
+                         headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
     # test getting category with wrong endpoint
     def test_get_category_404(self):
         res = self.client().get('/category')
@@ -59,6 +236,49 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['categories'])
         self.assertTrue(data['questions'])
 
+    # test include=category adds each question's category name
+    def test_get_questions_with_category_types(self):
+        res = self.client().get('/categories/1/questions?include=category')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['questions'])
+        for question in data['questions'].values():
+            self.assertEqual(question['category_type'],
+                             data['categories']['1'])
+
+        res = self.client().get('/questions?page=1')
+        data = json.loads(res.data)
+        self.assertNotIn('category_type', data['questions']['1'])
+
+    # test that a page holds at most QUESTIONS_PER_PAGE questions while
+    # total_questions still counts every question in the bank
+    def test_paginated_questions_are_limited_to_page_size(self):
+        res = self.client().get('/questions?page=1')
+        data = json.loads(res.data)
+
+        with self.app.app_context():
+            total = Question.query.count()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], total)
+        self.assertEqual(len(data['questions']),
+                         min(total, QUESTIONS_PER_PAGE))
+
+    # test streaming every question in the same format as a page
+    def test_get_all_questions_streamed(self):
+        res = self.client().get('/questions?all=true')
+        data = json.loads(res.data)
+
+        with self.app.app_context():
+            total = Question.query.count()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_questions'], total)
+        self.assertEqual(len(data['questions']), total)
+        self.assertTrue(data['categories'])
+
     # test requesting a page beyond the number of possible pages returns 404
     def test_404_sent_requesting_beyond_valid_page(self):
         res = self.client().get('/questions?page=100')
@@ -68,6 +288,36 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'Resource not found')
 
+    # test paging through all questions by cursor visits each question once
+    def test_get_questions_by_cursor(self):
+        seen = []
+        cursor = ''
+        while cursor is not None:
+            res = self.client().get('/questions?cursor={}'.format(cursor))
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['success'], True)
+            seen.extend(q['id'] for q in data['questions'].values())
+            cursor = data['next_cursor']
+
+        self.assertEqual(len(seen), data['total_questions'])
+        self.assertEqual(seen, sorted(set(seen)))
+
+    # test a malformed cursor returns 400
+    def test_get_questions_by_bad_cursor(self):
+        res = self.client().get('/categories/1/questions?cursor=notacursor')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+        # {"id": true, "cat": null}: an id must be an integer, not a bool
+        res = self.client().get(
+            '/questions?cursor=eyJpZCI6IHRydWUsICJjYXQiOiBudWxsfQ')
+
+        self.assertEqual(res.status_code, 400)
+
     # test getting a page of questions by category
     def test_get_paginated_questions_by_category(self):
         res = self.client().get('/categories/1/questions')
@@ -118,6 +368,249 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 400)
         self.assertEqual(data['success'], False)
 
+    # test searching answer text as well as question text
+    def test_search_question_including_answers(self):
+        res = self.client().post('/questions/search',
+                                 json={'searchTerm': 'apollo'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 0)
+
+        res = self.client().post('/questions/search',
+                                 json={'searchTerm': 'apollo',
+                                       'includeAnswers': True})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['total_questions'])
+        answers = [q['answer'] for q in data['questions'].values()]
+        self.assertIn('Apollo 13', answers)
+
+    # test pages are assembled from cached question json, which is dropped
+    # when a question is added
+    def test_question_fragments_are_cached(self):
+        app = create_app({'HTTP_CACHE_SIZE': 0,
+                          'DATABASE_URL': self.database_path})
+        client = app.test_client()
+
+        first = json.loads(client.get('/questions?page=1').data)
+        hits = fragment_cache.hits
+        second = json.loads(client.get('/questions?page=1').data)
+
+        self.assertEqual(first, second)
+        self.assertEqual(fragment_cache.hits,
+                         hits + len(first['questions']))
+
+        client.post('/questions/add',
+                    json={'question': 'Is this fragment cached?',
+                          'answer': 'no',
+                          'category': 1,
+                          'difficulty': 1})
+        self.assertEqual(fragment_cache.stats()['size'], 0)
+
+    # test a question changed by another process (which this one's content
+    # version does not see) is not served from its cached json
+    def test_changed_question_is_not_served_from_fragment_cache(self):
+        app = create_app({'HTTP_CACHE_SIZE': 0,
+                          'DATABASE_URL': self.database_path})
+        client = app.test_client()
+
+        first = json.loads(client.get('/questions?page=1').data)
+        question = first['questions']['1']
+        changed = question['question'] + ' (changed)'
+        update = text('UPDATE questions SET question = :question '
+                      'WHERE id = :id')
+        with app.app_context():
+            db.session.execute(update, {'question': changed,
+                                        'id': question['id']})
+            db.session.commit()
+        try:
+            second = json.loads(client.get('/questions?page=1').data)
+        finally:
+            with app.app_context():
+                db.session.execute(update, {'question': question['question'],
+                                            'id': question['id']})
+                db.session.commit()
+
+        self.assertEqual(second['questions']['1']['question'], changed)
+
+    # test type-ahead suggestions of the words starting with a prefix
+    def test_suggest_questions(self):
+        res = self.client().get('/questions/suggest?prefix=Who%20w')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['prefix'], 'w')
+        self.assertTrue(data['suggestions'])
+        self.assertTrue(all(s['word'].startswith('w') and s['questions'] > 0
+                            for s in data['suggestions']))
+
+    # test questions added and deleted are suggested and then no longer
+    def test_suggestions_follow_changes(self):
+        self.client().get('/questions/suggest?prefix=a')
+        self.client().post('/questions/add',
+                           json={'question': 'Who named the quokkaesque?',
+                                 'answer': 'Nobody',
+                                 'category': 1,
+                                 'difficulty': 1})
+        added = json.loads(
+            self.client().get('/questions/suggest?prefix=quokka').data)
+        with self.app.app_context():
+            Question.query.filter(
+                Question.question == 'Who named the quokkaesque?'
+            ).one().delete()
+        deleted = json.loads(
+            self.client().get('/questions/suggest?prefix=quokka').data)
+
+        self.assertEqual(added['suggestions'],
+                         [{'word': 'quokkaesque', 'questions': 1}])
+        self.assertEqual(deleted['suggestions'], [])
+
+    # test the suggestion index is rebuilt after SUGGEST_INDEX_TTL, picking
+    # up questions added by another process
+    def test_suggestion_index_expires(self):
+        app = create_app({'SUGGEST_INDEX_TTL': 0.1,
+                          'DATABASE_URL': self.database_path})
+        client = app.test_client()
+        client.get('/questions/suggest?prefix=a')
+        with app.app_context():
+            db.session.execute(text(
+                "INSERT INTO questions (question, answer, difficulty, "
+                "category) VALUES ('Who saw the wombatlike?', 'No one', 1, "
+                "1)"))
+            db.session.commit()
+        try:
+            before = json.loads(
+                client.get('/questions/suggest?prefix=wombat').data)
+            time.sleep(0.15)
+            after = json.loads(
+                client.get('/questions/suggest?prefix=wombat').data)
+        finally:
+            with app.app_context():
+                db.session.execute(text(
+                    "DELETE FROM questions "
+                    "WHERE question = 'Who saw the wombatlike?'"))
+                db.session.commit()
+
+        self.assertEqual(before['suggestions'], [])
+        self.assertEqual(after['suggestions'],
+                         [{'word': 'wombatlike', 'questions': 1}])
+
+    # test suggestions need a prefix
+    def test_suggest_questions_without_prefix(self):
+        res = self.client().get('/questions/suggest?prefix=%20')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    # test repeated searches are served from the search cache, and adding a
+    # question invalidates the cached results
+    def test_search_results_are_cached(self):
+        search_cache.clear()
+        hits = search_cache.hits
+
+        res = self.client().post('/questions/search',
+                                 json={'searchTerm': 'Title'})
+        first = json.loads(res.data)
+        res = self.client().post('/questions/search',
+                                 json={'searchTerm': 'title'})
+        second = json.loads(res.data)
+
+        self.assertEqual(first, second)
+        self.assertEqual(search_cache.hits, hits + 1)
+
+        self.client().post('/questions/add',
+                           json={'question': 'Which title is cached?',
+                                 'answer': 'none',
+                                 'category': 1,
+                                 'difficulty': 1})
+        res = self.client().post('/questions/search',
+                                 json={'searchTerm': 'title'})
+        data = json.loads(res.data)
+
+        self.assertEqual(search_cache.hits, hits + 1)
+        self.assertEqual(data['total_questions'],
+                         first['total_questions'] + 1)
+
+    # test cached search results expire after SEARCH_CACHE_TTL, since a
+    # change made by another process does not clear this one's cache
+    def test_search_cache_memory_backend_expires(self):
+        backend = MemorySearchBackend(ttl=60)
+        backend.put('key', 'result')
+        self.assertEqual(backend.get('key'), 'result')
+
+        backend = MemorySearchBackend(ttl=0)
+        backend.put('key', 'result')
+        self.assertIsNone(backend.get('key'))
+        self.assertEqual(backend.stats()['bytes'], 0)
+
+    # test the Redis search cache backend is invalidated for every process
+    @unittest.skipUnless(fakeredis, 'fakeredis is not installed')
+    def test_search_cache_redis_backend(self):
+        client = fakeredis.FakeRedis()
+        backend = RedisSearchBackend(client)
+        other = RedisSearchBackend(client)
+
+        backend.put('key', 'result')
+        self.assertEqual(other.get('key'), 'result')
+
+        other.clear()
+        self.assertIsNone(backend.get('key'))
+
+    # test snapshot mode serves the same listings as the database, and
+    # searches its in-memory copy of the questions
+    def test_snapshot_mode(self):
+        urls = ('/questions?page=2', '/categories/1/questions',
+                '/questions?cursor=&include=category')
+        expected = [json.loads(self.client().get(url).data) for url in urls]
+
+        # snapshot mode applies to the whole process once an app enables it
+        snapshot_app = create_app({'SNAPSHOT_MODE': True,
+                                   'DATABASE_URL': self.database_path})
+        try:
+            for url, data in zip(urls, expected):
+                res = snapshot_app.test_client().get(url)
+
+                self.assertEqual(res.status_code, 200)
+                self.assertEqual(json.loads(res.data), data)
+
+            res = snapshot_app.test_client().post(
+                '/questions/search', json={'searchTerm': 'TITLE'})
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertTrue(data['total_questions'])
+            for question in data['questions'].values():
+                self.assertIn('title', question['question'].lower())
+        finally:
+            question_snapshot.enabled = False
+
+    # test reloading the snapshot renews the ETag, but is not counted as a
+    # write: the content version stays, and reads are not pinned to the
+    # primary
+    def test_snapshot_reload_is_not_a_write(self):
+        snapshot_app = create_app({'SNAPSHOT_MODE': True,
+                                   'DATABASE_URL': self.database_path})
+        client = snapshot_app.test_client()
+        try:
+            etag = client.get('/questions?page=1').headers['ETag']
+            version = get_content_version()
+            replica_set.last_write = None
+
+            question_snapshot.refresh()
+            res = client.get('/questions?page=1',
+                             headers={'If-None-Match': etag})
+
+            self.assertEqual(res.status_code, 200)
+            self.assertNotEqual(res.headers['ETag'], etag)
+            self.assertEqual(get_content_version(), version)
+            self.assertFalse(replica_set.recently_written())
+        finally:
+            question_snapshot.enabled = False
+
     # test creation of a new question
     def test_create_question(self):
         res = (
@@ -138,6 +631,62 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
 
+    # test bulk import of JSON Lines reports the rows it could not add
+    def test_bulk_add_questions(self):
+        body = '\n'.join([
+            json.dumps({'question': 'bulk question 1?',
+                        'answer': 'bulk answer 1',
+                        'category': 1, 'difficulty': 1}),
+            json.dumps({'question': 'bulk question 2?',
+                        'answer': 'bulk answer 2',
+                        'category': 2, 'difficulty': 2}),
+            'not json',
+            json.dumps({'question': 'bulk question 3?',
+                        'answer': 'bulk answer 3',
+                        'category': 1, 'difficulty': 100})])
+
+        res = self.client().post('/questions/bulk', data=body,
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual([e['line'] for e in data['errors']], [3, 4])
+
+    # test bulk import of CSV
+    def test_bulk_add_questions_csv(self):
+        body = ('question,answer,difficulty,category\n'
+                'bulk csv question?,bulk csv answer,3,4\n')
+
+        res = self.client().post('/questions/bulk', data=body,
+                                 content_type='text/csv')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['errors'], [])
+
+    # test bulk import with an unsupported content type returns 400
+    def test_bulk_add_questions_bad_format(self):
+        res = self.client().post('/questions/bulk', data='question',
+                                 content_type='text/plain')
+
+        self.assertEqual(res.status_code, 400)
+
+    # test exporting every question as JSON Lines
+    def test_export_questions(self):
+        res = self.client().get('/questions/export')
+        lines = res.get_data(as_text=True).splitlines()
+
+        with self.app.app_context():
+            total = Question.query.count()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(lines), total)
+        self.assertIn('answer', json.loads(lines[0]))
+
     # test blank question returns 400
     def test_incomplete_create_question(self):
         res = self.client().post('/questions/add', json={'question': '',
@@ -198,6 +747,52 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 400)
         self.assertEqual(data['success'], False)
 
+    # test the question counts are rebuilt by the CLI and kept up to date
+    # as questions are added and deleted
+    def test_question_counts(self):
+        result = self.app.test_cli_runner().invoke(args=['rebuild-counts'])
+        with self.app.app_context():
+            before = get_question_count(2)
+
+        res = self.client().post('/questions/add',
+                                 json={'question': 'counted question?',
+                                       'answer': 'counted answer',
+                                       'category': 2,
+                                       'difficulty': 1})
+        with self.app.app_context():
+            added = get_question_count(2)
+            question = Question.query.filter(
+                Question.question == 'counted question?').first()
+            question.delete()
+            counted = Question.query.filter(Question.category == 2).count()
+            deleted = get_question_count(2)
+        data = json.loads(self.client().get('/categories/2/questions').data)
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(added, before + 1)
+        self.assertEqual(deleted, before)
+        self.assertEqual(counted, before)
+        self.assertEqual(data['total_questions'], before)
+
+    # test listings return 422, not 500, when the question counts cannot be
+    # read (such as before the migration creating their table has run)
+    def test_question_counts_table_missing(self):
+        table = QuestionCount.__table__
+        with self.app.app_context():
+            table.drop(db.engine)
+        try:
+            responses = [self.client().get(url)
+                         for url in ('/questions', '/categories/1/questions')]
+        finally:
+            with self.app.app_context():
+                table.create(db.engine)
+                rebuild_question_counts()
+
+        for res in responses:
+            self.assertEqual(res.status_code, 422)
+            self.assertEqual(json.loads(res.data)['success'], False)
+
     # test deletion of a question that exists
     def test_delete_question(self):
         res = self.client().delete('/questions/10')
@@ -218,6 +813,65 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'Bad request')
 
+    # test changing a question
+    def test_update_question(self):
+        res = self.client().patch('/questions/2',
+                                  json={'difficulty': 5, 'category': 3})
+        data = json.loads(res.data)
+
+        question = Question.query.filter(Question.id == 2).one()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['question']['difficulty'], 5)
+        self.assertEqual(question.category, 3)
+
+    # test invalid changes, and changes to a question that does not exist
+    def test_update_question_errors(self):
+        invalid = self.client().patch('/questions/2', json={'difficulty': 9})
+        unknown = self.client().patch('/questions/2', json={'rating': 1})
+        missing = self.client().patch('/questions/1000',
+                                      json={'answer': 'None'})
+
+        self.assertEqual(invalid.status_code, 400)
+        self.assertEqual(unknown.status_code, 400)
+        self.assertEqual(missing.status_code, 404)
+
+    # test a batch of changes is applied in one transaction, with the status
+    # of each operation reported
+    def test_batch_update_questions(self):
+        commits = []
+
+        def count_commit(session):
+            commits.append(session)
+
+        event.listen(RoutingSession, 'after_commit', count_commit)
+        res = self.client().post('/questions/batch', json={'operations': [
+            {'op': 'update', 'id': 4, 'changes': {'answer': 'Tom Cruise'}},
+            {'op': 'delete', 'id': 9},
+            {'op': 'update', 'id': 9, 'changes': {'difficulty': 1}},
+            {'op': 'delete', 'id': 1000},
+            {'op': 'update', 'id': 4, 'changes': {'difficulty': 9}},
+            {'op': 'rename', 'id': 4}]})
+        event.remove(RoutingSession, 'after_commit', count_commit)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual((data['updated'], data['deleted'], data['failed']),
+                         (1, 1, 4))
+        self.assertEqual([r['status'] for r in data['results']],
+                         ['updated', 'deleted', 'not_found', 'not_found',
+                          'invalid', 'invalid'])
+        self.assertEqual(len(commits), 1)
+        self.assertEqual(Question.query.get(4).answer, 'Tom Cruise')
+        self.assertIsNone(Question.query.get(9))
+
+    # test a batch needs a list of operations
+    def test_batch_update_questions_without_operations(self):
+        res = self.client().post('/questions/batch', json={'operations': {}})
+
+        self.assertEqual(res.status_code, 400)
+
     # test getting a quiz, no previous questions
     def test_get_quiz(self):
         res = (
@@ -233,6 +887,175 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_questions'])
         self.assertTrue(data['question'])
 
+    # test that a quiz never repeats a question and ends with an empty one
+    def test_quiz_exhausts_category(self):
+        previous = []
+        while True:
+            res = (
+                self.client()
+                    .post('/quizzes',
+                          json={'previous_questions': previous,
+                                'quiz_category': {'type': 'Science',
+                                                  'id': '1'}})
+            )
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['success'], True)
+            if data['question']['id'] == 0:
+                break
+            self.assertNotIn(data['question']['id'], previous)
+            previous.append(data['question']['id'])
+
+        self.assertEqual(len(previous), data['total_questions'])
+
+    # test count returns several distinct questions in one request
+    def test_get_quiz_questions_with_count(self):
+        res = self.client().post('/quizzes',
+                                 json={'previous_questions': [20],
+                                       'quiz_category': {'type': 'Science',
+                                                         'id': 1},
+                                       'count': 3})
+        data = json.loads(res.data)
+        ids = [q['id'] for q in data['questions']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(ids),
+                         min(3, data['total_questions'] - 1))
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertNotIn(20, ids)
+        for question in data['questions']:
+            self.assertEqual(question['category'], 1)
+
+    # test a count that is out of range returns 400
+    def test_get_quiz_questions_with_bad_count(self):
+        res = self.client().post('/quizzes',
+                                 json={'previous_questions': [],
+                                       'quiz_category': {'id': 1},
+                                       'count': 0})
+
+        self.assertEqual(res.status_code, 400)
+
+    # test difficulty only picks questions in the range
+    def test_get_quiz_questions_with_difficulty(self):
+        res = self.client().post('/quizzes',
+                                 json={'previous_questions': [],
+                                       'quiz_category': {'id': 0},
+                                       'difficulty': {'min': 3, 'max': 4},
+                                       'count': 50})
+        data = json.loads(res.data)
+
+        with self.app.app_context():
+            in_range = (
+                Question.query
+                        .filter(Question.difficulty.between(3, 4))
+                        .count()
+            )
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], in_range)
+        self.assertEqual(len(data['questions']), min(in_range, 50))
+        for question in data['questions']:
+            self.assertIn(question['difficulty'], (3, 4))
+
+        res = self.client().post('/quizzes',
+                                 json={'previous_questions': [],
+                                       'quiz_category': {'id': 0},
+                                       'difficulty': {'min': 4, 'max': 2}})
+        self.assertEqual(res.status_code, 400)
+
+    # test an adaptive session follows the answers reported to it
+    def test_adaptive_quiz_session(self):
+        res = self.client().post('/quizzes/sessions',
+                                 json={'quiz_category': {'id': 0},
+                                       'adaptive': True,
+                                       'difficulty': 3})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        session_id = data['session_id']
+
+        res = self.client().get('/quizzes/sessions/{}/next'.format(session_id))
+        question = json.loads(res.data)['question']
+        self.assertEqual(question['difficulty'], 3)
+
+        res = self.client().post(
+            '/quizzes/sessions/{}/answers'.format(session_id),
+            json={'question_id': question['id'], 'correct': True})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['answered'], 1)
+        self.assertEqual(data['correct'], 1)
+        self.assertEqual(data['target_difficulty'], 4)
+
+        res = self.client().get('/quizzes/sessions/{}/next'.format(session_id))
+        data = json.loads(res.data)
+        self.assertEqual(data['question']['difficulty'], 4)
+        self.assertNotEqual(data['question']['id'], question['id'])
+
+        res = self.client().post(
+            '/quizzes/sessions/{}/answers'.format(session_id),
+            json={'question_id': question['id'], 'correct': 'yes'})
+        self.assertEqual(res.status_code, 400)
+
+    # test a quiz session asks each question of its category exactly once
+    def test_quiz_session(self):
+        res = self.client().post('/quizzes/sessions',
+                                 json={'quiz_category': {'type': 'Science',
+                                                         'id': 1}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['total_questions'])
+
+        session_id = data['session_id']
+        total = data['total_questions']
+        asked = []
+        for _ in range(total):
+            res = self.client().get(
+                '/quizzes/sessions/{}/next'.format(session_id))
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['question']['category'], 1)
+            asked.append(data['question']['id'])
+
+        self.assertEqual(len(set(asked)), total)
+        self.assertEqual(data['remaining'], 0)
+
+        res = self.client().get('/quizzes/sessions/{}/next'.format(session_id))
+        data = json.loads(res.data)
+        self.assertEqual(data['question']['id'], 0)
+
+    # test quiz sessions kept in a Redis store
+    @unittest.skipUnless(fakeredis, 'fakeredis is not installed')
+    def test_quiz_session_redis_store(self):
+        store = RedisSessionStore(fakeredis.FakeRedis())
+        session_id = store.create(1, [20, 21, 22])
+
+        self.assertEqual(store.pop_next(session_id), (20, 3, 2))
+        self.assertEqual(store.pop_next(session_id), (21, 3, 1))
+        self.assertEqual(store.pop_next(session_id), (22, 3, 0))
+        self.assertEqual(store.pop_next(session_id), (None, 3, 0))
+        with self.assertRaises(KeyError):
+            store.pop_next('no-such-session')
+
+        store.set_state(session_id, {'target': 3})
+        self.assertEqual(store.get_state(session_id), {'target': 3})
+        with self.assertRaises(KeyError):
+            store.set_state('no-such-session', {})
+
+    # test an unknown quiz session returns 404
+    def test_unknown_quiz_session(self):
+        res = self.client().get('/quizzes/sessions/no-such-session/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
     # test getting a quiz without sending previous questions
     def test_get_quiz_without_previous_questions(self):
         res = (
@@ -255,6 +1078,70 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 400)
         self.assertEqual(data['success'], False)
 
+    # test the async app returns the same json as the Flask app
+    @unittest.skipUnless(create_asgi_app, 'async dependencies not installed')
+    def test_async_app_matches_flask_app(self):
+        asgi_app = create_asgi_app(self.database_path)
+
+        with TestClient(asgi_app) as async_client:
+            for url in ['/categories',
+                        '/questions?page=2',
+                        '/categories/1/questions',
+                        '/questions?cursor=',
+                        '/questions?page=100']:
+                res = self.client().get(url)
+                async_res = async_client.get(url)
+
+                self.assertEqual(async_res.status_code, res.status_code)
+                self.assertEqual(async_res.json(), json.loads(res.data))
+
+            res = async_client.post('/quizzes',
+                                    json={'previous_questions': [],
+                                          'quiz_category': {'id': 1}})
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.json()['question']['category'], 1)
+
+    # returns the Postgres query plan of a Question query as one string,
+    # with sequential scans disabled: on a table as small as the test data
+    # a sequential scan is always cheapest, but the question here is
+    # whether an index can be used at all
+    def explain(self, query):
+        with self.app.app_context():
+            sql = str(query.statement.compile(
+                dialect=self.db.engine.dialect,
+                compile_kwargs={'literal_binds': True}))
+            self.db.session.execute('SET enable_seqscan = off')
+            plan = self.db.session.execute('EXPLAIN ' + sql).fetchall()
+            self.db.session.rollback()
+        return '\n'.join(row[0] for row in plan)
+
+    # test a page of a category listing is read from the (category, id) index
+    def test_category_listing_uses_index(self):
+        with self.app.app_context():
+            query = (
+                Question.query
+                        .filter_by(category=1)
+                        .order_by(Question.id)
+                        .limit(QUESTIONS_PER_PAGE)
+            )
+        plan = self.explain(query)
+
+        self.assertIn('ix_questions_category_id', plan)
+        self.assertNotIn('Seq Scan', plan)
+
+    # test quiz questions of a category and difficulty are found by index
+    def test_quiz_difficulty_filter_uses_index(self):
+        with self.app.app_context():
+            query = (
+                Question.query
+                        .filter(Question.category == 1)
+                        .filter(Question.difficulty == 4)
+            )
+        plan = self.explain(query)
+
+        self.assertIn('ix_questions_category_difficulty', plan)
+        self.assertNotIn('Seq Scan', plan)
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -0,0 +1,25 @@
+# ----------------------------------------------------------------------------
+#  The app for WSGI servers, created and warmed up (see flaskr/server.py)
+#  when this module is imported. With gunicorn's --preload, that happens
+#  once, before the workers are forked:
+#
+#      gunicorn --preload --workers 4 --bind 0.0.0.0:8000 wsgi:app
+#
+#  "flask serve" does the same without a separate command line. Settings
+#  come from the environment (DATABASE_URL, CREATE_SCHEMA, ...)
+# ----------------------------------------------------------------------------
+import logging
+import time
+
+from flaskr import create_app
+from flaskr.server import warm_up
+
+start = time.perf_counter()
+app = create_app()
+created = time.perf_counter() - start
+timings = warm_up(app)
+
+# gunicorn's own logger, so that the message shows in its log
+logging.getLogger('gunicorn.error').info(
+    'Created the app in %.3fs, warmed up in %.3fs', created,
+    sum(timings.values()))
@@ -12,6 +12,7 @@ class QuizView extends Component {
     super();
     this.state = {
         quizCategory: null,
+        quizSessionId: null,
         previousQuestions: [], 
         numTotalQuestions: 0,
         showAnswer: false,
@@ -39,7 +40,28 @@ class QuizView extends Component {
   }
 
   selectCategory = ({type, id=0}) => {
-    this.setState({quizCategory: {type, id}}, this.getNextQuestion)
+    $.ajax({
+      url: `${API_SERVER}/quizzes/sessions`,
+      type: "POST",
+      dataType: 'json',
+      contentType: 'application/json; charset=utf-8',
+      data: JSON.stringify({
+        quiz_category: {type, id}
+      }),
+      crossDomain: true,
+      success: (result) => {
+        this.setState({
+          quizCategory: {type, id},
+          quizSessionId: result.session_id,
+          numTotalQuestions: result.total_questions
+        }, this.getNextQuestion)
+        return;
+      },
+      error: (error) => {
+        alert('Unable to start the quiz. Please try your request again')
+        return;
+      }
+    })
   }
 
   handleChange = (event) => {
@@ -58,14 +80,8 @@ class QuizView extends Component {
     }
 
     $.ajax({
-      url: `${API_SERVER}/quizzes`, 
-      type: "POST",
-      dataType: 'json',
-      contentType: 'application/json; charset=utf-8',
-      data: JSON.stringify({
-        previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory
-      }),
+      url: `${API_SERVER}/quizzes/sessions/${this.state.quizSessionId}/next`,
+      type: "GET",
       // xhrFields: {
       //   withCredentials: true
       // },
@@ -77,7 +93,7 @@ class QuizView extends Component {
           numTotalQuestions: result.total_questions,          
           currentQuestion: result.question,
           guess: '',
-          forceEnd: result.question ? false : true
+          forceEnd: result.question.id ? false : true
         })
         return;
       },
@@ -101,6 +117,7 @@ class QuizView extends Component {
   restartGame = () => {
     this.setState({
       quizCategory: null,
+      quizSessionId: null,
       previousQuestions: [], 
       showAnswer: false,
       numCorrect: 0,
@@ -1,8 +1,12 @@
 import React, { Component } from 'react'
+import $ from 'jquery';
+
+import { API_SERVER } from '../constants'
 
 class Search extends Component {
   state = {
     query: '',
+    suggestions: [],
   }
 
   getInfo = (event) => {
@@ -14,6 +18,33 @@ class Search extends Component {
     this.setState({
       query: this.search.value
     })
+    this.getSuggestions(this.search.value)
+  }
+
+  // offer the query with its last word completed by /questions/suggest
+  getSuggestions = (query) => {
+    if (this.suggestRequest) {
+      this.suggestRequest.abort()
+    }
+    const start = query.replace(/\w*$/, '')
+    if (start === query) {
+      this.setState({ suggestions: [] })
+      return
+    }
+    this.suggestRequest = $.ajax({
+      url: `${API_SERVER}/questions/suggest?prefix=${encodeURIComponent(query)}`,
+      type: "GET",
+      success: (result) => {
+        this.setState({
+          suggestions: result.suggestions.map(suggestion => start + suggestion.word)
+        })
+        return;
+      },
+      error: () => {
+        this.setState({ suggestions: [] })
+        return;
+      }
+    })
   }
 
   render() {
@@ -22,9 +53,15 @@ class Search extends Component {
         <input
           type="search"
           placeholder="Search questions..."
+          list="question-suggestions"
           ref={input => this.search = input}
           onChange={this.handleInputChange}
         />
+        <datalist id="question-suggestions">
+          {this.state.suggestions.map(suggestion => (
+            <option key={suggestion} value={suggestion} />
+          ))}
+        </datalist>
         <input disabled={this.state.query === ''} type="submit" value="Submit" className="button"/>
       </form>
     )